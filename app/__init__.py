@@ -33,7 +33,6 @@ def init_app_extensions(app):
     """
     mail.init_app(app)
     csrf.init_app(app)
-    limiter.init_app(app)
 
     mongo_uri = app.config.get("MONGO_URI")
     if not mongo_uri:
@@ -48,20 +47,23 @@ def init_app_extensions(app):
         if not app.testing:
             raise RuntimeError(f"No se pudo conectar a la base de datos: {e}")
 
+    # Los límites de peticiones se comparten entre procesos a través de MongoDB (app/rate_limits.py)
+    from app.rate_limits import configure_rate_limit_storage
+    configure_rate_limit_storage(app)
+    limiter.init_app(app)
+
     login_manager.init_app(app)
     login_manager.login_view = "auth.login"
     login_manager.login_message = "Por favor, inicia sesión para acceder a esta página."
     login_manager.login_message_category = "warning"
 
-    from app.auth.models import Persona
-    from bson.objectid import ObjectId
+    from app.auth.user_cache import load_cached_user
 
     @login_manager.user_loader
     def load_user(user_id):
+        # Caché por proceso validada con el 'security_stamp' del usuario (app/auth/user_cache.py)
         try:
-            user_data = mongo.db.personas.find_one({"_id": ObjectId(user_id)})
-            if user_data:
-                return Persona(**user_data)
+            return load_cached_user(user_id)
         except Exception as e:
             app.logger.error(f"Error en load_user para user_id {user_id}: {e}")
         return None
@@ -178,5 +180,14 @@ def create_app(config_class="development"):
 
     from app import commands as commands
     app.cli.add_command(commands.init_db_data_command)
+    app.cli.add_command(commands.ensure_indexes_command)
+    app.cli.add_command(commands.migrate_ticket_history_command)
+    app.cli.add_command(commands.reindex_ticket_search_command)
+    app.cli.add_command(commands.backfill_ticket_numbers_command)
+    app.cli.add_command(commands.backfill_username_lower_command)
+    app.cli.add_command(commands.process_export_jobs_command)
+    app.cli.add_command(commands.reconcile_ticket_stats_command)
+    app.cli.add_command(commands.run_mail_worker_command)
+    app.cli.add_command(commands.calibrate_password_cost_command)
 
     return app
\ No newline at end of file
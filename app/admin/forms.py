@@ -1,14 +1,21 @@
 from flask_wtf import FlaskForm
-from wtforms import SubmitField, StringField, SelectField, SelectMultipleField
+from wtforms import SubmitField, StringField, SelectField, SelectMultipleField, BooleanField
 from wtforms.validators import DataRequired, Length, ValidationError
 from wtforms.widgets import ListWidget, CheckboxInput
 from app import mongo # Importamos mongo
+from app.reference_data import get_categories, get_category_by_id, get_supervisors
 from slugify import slugify
 from bson.objectid import ObjectId
 
 class EmptyForm(FlaskForm):
     submit = SubmitField('Submit')
 
+class ExportJobForm(FlaskForm):
+    format = SelectField('Formato', choices=[('xlsx', 'Excel (.xlsx)'), ('csv', 'CSV'), ('ndjson', 'NDJSON')], validators=[DataRequired()])
+    gzip = BooleanField('Comprimir (gzip)')
+    notify = BooleanField('Avisarme por correo')
+    submit = SubmitField('Exportar en segundo plano')
+
 class CategoryForm(FlaskForm):
     name = StringField('Nombre de la categoría', validators=[DataRequired(message="Este campo es obligatorio"), Length(min=2, max=30, message='La categoría debe tener entre 2 y 30 caracteres')])
     submit = SubmitField('Guardar Categoría', render_kw={"class": "btn btn-primary confirm-submit-btn"})
@@ -39,9 +46,9 @@ class SupervisorAssignmentForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(SupervisorAssignmentForm, self).__init__(*args, **kwargs)
-        # Poblar choices dinámicamente desde la ruta
-        self.category.choices = [(str(c['_id']), c['name']) for c in mongo.db.categories.find().sort("name", 1)]
-        self.supervisor.choices = [("", "--- Seleccione un Supervisor ---")] + [(str(s['_id']), s['username']) for s in mongo.db.personas.find({"role": "supervisor"}).sort("username", 1)]
+        # Choices desde la caché de datos de referencia: construir el formulario no consulta la BD
+        self.category.choices = [(str(c['_id']), c['name']) for c in get_categories()]
+        self.supervisor.choices = [("", "--- Seleccione un Supervisor ---")] + [(str(s['_id']), s['username']) for s in get_supervisors()]
         # Los turnos son estáticos, pero los cargamos aquí para mantener la consistencia
         self.shift.choices = [
             ("", "--- Seleccione un Turno ---"),
@@ -57,26 +64,19 @@ class SupervisorAssignmentForm(FlaskForm):
         if not super(SupervisorAssignmentForm, self).validate(extra_validators):
             return False
 
-        # Validación de unicidad para cada categoría seleccionada
-        for category_id_str in self.category.data:
-            category_id = ObjectId(category_id_str)
-            existing_assignment = mongo.db.supervisor_assignments.find_one({
-                "category_id": category_id,
-                "shift_value": self.shift.data
-            })
-
-            if existing_assignment:
-                supervisor_id = existing_assignment.get('supervisor_id')
-                supervisor = mongo.db.personas.find_one({"_id": supervisor_id})
-                supervisor_name = supervisor['username'] if supervisor else 'desconocido'
-                
-                category = mongo.db.categories.find_one({"_id": category_id})
-                category_name = category['name'] if category else 'desconocida'
-
-                self.category.errors.append(
-                    f"La categoría '{category_name}' ya tiene una asignación para este turno (asignado a '{supervisor_name}'). "
-                    f"Bórrela si desea crear una nueva."
-                )
-                return False
-        
-        return True
+        # Unicidad de (categoría, turno) para todas las categorías seleccionadas en una sola consulta
+        category_ids = [ObjectId(category_id) for category_id in self.category.data]
+        existing = mongo.db.supervisor_assignments.find(
+            {"category_id": {"$in": category_ids}, "shift_value": self.shift.data},
+            {"category_id": 1, "supervisor_id": 1}
+        )
+        supervisor_names = {s['_id']: s['username'] for s in get_supervisors()}
+        for assignment in existing:
+            category = get_category_by_id(assignment['category_id'])
+            category_name = category['name'] if category else 'desconocida'
+            supervisor_name = supervisor_names.get(assignment.get('supervisor_id'), 'desconocido')
+            self.category.errors.append(
+                f"La categoría '{category_name}' ya tiene una asignación para este turno (asignado a '{supervisor_name}'). "
+                f"Bórrela si desea crear una nueva."
+            )
+        return not self.category.errors
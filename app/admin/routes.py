@@ -2,16 +2,23 @@ from flask import render_template, flash, redirect, url_for, Response, request
 from flask_login import login_required, current_user
 from app.admin import admin_bp
 from app import mongo
-from .forms import CategoryForm, EmptyForm, SupervisorAssignmentForm
+from .forms import CategoryForm, EmptyForm, SupervisorAssignmentForm, ExportJobForm
 from app.auth.decorators import admin_required, supervisor_or_admin_required
 from slugify import slugify
 import logging
 import pymongo
 from bson.objectid import ObjectId
 from datetime import datetime
-from io import BytesIO
-from openpyxl import Workbook
-from app.supervisor.forms import TicketFilterForm # Import from supervisor for now
+from app.supervisor.forms import TicketFilterForm, BulkTicketActionForm # Import from supervisor for now
+from app.pagination import strip_pagination_args
+from app.exports import (write_xlsx, spooled_file, iter_file_chunks, iter_csv, iter_ndjson, gzip_chunks, CountingIterator,
+                         EXPORT_BATCH_SIZE, XLSX_MIMETYPE, CSV_MIMETYPE, NDJSON_MIMETYPE, GZIP_MIMETYPE)
+from app.projections import ADMIN_LIST_PROJECTION, EXPORT_PROJECTION
+from app.ticket_query import TicketQuery, set_filter_choices
+from app.ticket_stats import get_ticket_stats
+from app.export_jobs import create_export_job, open_export_file, JOBS_COLLECTION, STATUS_PENDING, STATUS_RUNNING
+from app.reference_data import (get_categories, get_status_map, get_category_map, get_category_by_id, get_supervisors,
+                                 get_supervisor_assignments, invalidate as invalidate_reference_data)
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +28,7 @@ logger = logging.getLogger(__name__)
 def list_categories():
     form = EmptyForm()
     try:
-        categories = list(mongo.db.categories.find().sort("name", 1))
+        categories = get_categories()
     except pymongo.errors.PyMongoError as e:
         logger.error(f"Error al cargar categorías: {e}")
         flash("Error al cargar las categorías.", "danger")
@@ -43,6 +50,7 @@ def create_category():
 
             new_category = {"name": form.name.data, "value": generated_value}
             mongo.db.categories.insert_one(new_category)
+            invalidate_reference_data("categories")
             
             logger.info(f'Usuario {current_user.username} creó la categoría {form.name.data}.')
             flash(f'Categoría "{form.name.data}" creada exitosamente.', 'success')
@@ -81,6 +89,7 @@ def edit_category(category_id):
 
             update_data = {"$set": {"name": form.name.data, "value": new_value}}
             mongo.db.categories.update_one({"_id": ObjectId(category_id)}, update_data)
+            invalidate_reference_data("categories")
             
             logger.info(f'Usuario {current_user.username} actualizó la categoría {form.name.data}.')
             flash(f'Categoría "{form.name.data}" actualizada correctamente.', 'success')
@@ -108,6 +117,7 @@ def delete_category(category_id):
             return redirect(url_for('admin_bp.list_categories'))
 
         result = mongo.db.categories.delete_one({"_id": ObjectId(category_id)})
+        invalidate_reference_data("categories")
         if result.deleted_count == 1:
             flash('Categoría borrada exitosamente.', 'success')
         else:
@@ -127,37 +137,52 @@ def manage_assignments():
 
     if request.method == 'POST' and form.validate():
         if form.submit.data:
+            # Todas las asignaciones en un solo insert_many. El índice único category_shift_unique
+            # rechaza las que otro administrador haya creado tras la validación; el resto se guardan.
+            new_assignments = [
+                {
+                    "category_id": ObjectId(category_id_str),
+                    "shift_value": form.shift.data,
+                    "supervisor_id": ObjectId(form.supervisor.data)
+                }
+                for category_id_str in form.category.data
+            ]
             try:
-                # form.category.data is now a list of category IDs
-                assignments_count = 0
-                for category_id_str in form.category.data:
-                    # Opcional: Evitar duplicados antes de insertar (se asume que la forma maneja esto o se desea permitir duplicados)
-                    new_assignment = {
-                        "category_id": ObjectId(category_id_str),
-                        "shift_value": form.shift.data,
-                        "supervisor_id": ObjectId(form.supervisor.data)
-                    }
-                    mongo.db.supervisor_assignments.insert_one(new_assignment)
-                    assignments_count += 1
-                
-                flash(f'{assignments_count} asignación(es) creada(s) exitosamente.', 'success')
-                return redirect(url_for('admin_bp.manage_assignments'))
+                result = mongo.db.supervisor_assignments.insert_many(new_assignments, ordered=False)
+                assignments_count = len(result.inserted_ids)
+                duplicates = []
+            except pymongo.errors.BulkWriteError as e:
+                assignments_count = e.details.get("nInserted", 0)
+                duplicates = [new_assignments[error["index"]] for error in e.details.get("writeErrors", [])
+                              if error.get("code") == 11000]  # clave duplicada
+                if len(duplicates) != len(e.details.get("writeErrors", [])):
+                    logger.error(f"Error al crear las asignaciones: {e.details}")
+                    flash('Ocurrió un error al crear algunas asignaciones.', 'danger')
             except pymongo.errors.PyMongoError as e:
                 logger.error(f"Error al crear la asignación: {e}", exc_info=True)
                 flash('Ocurrió un error al crear la(s) asignación(es).', 'danger')
+                assignments_count = None
+
+            if assignments_count is not None:
+                if assignments_count:
+                    invalidate_reference_data("supervisor_assignments")
+                for assignment in duplicates:
+                    category = get_category_by_id(assignment["category_id"])
+                    flash(f"La categoría '{category['name'] if category else 'desconocida'}' ya tenía una asignación para este turno.", 'warning')
+                flash(f'{assignments_count} asignación(es) creada(s) exitosamente.', 'success')
+                return redirect(url_for('admin_bp.manage_assignments'))
 
     # Logic for GET request and POST request if validation fails
     try:
-        assignments_cursor = mongo.db.supervisor_assignments.find()
         assignments = []
         # Asegurarse de que shift_display_map esté disponible
         shift_display_map = dict(form.shift.choices) if form.shift.choices else {}
 
         # Cachear categorías y supervisores para evitar múltiples consultas en el bucle
-        all_categories = {c['_id']: c['name'] for c in mongo.db.categories.find({}, {"name": 1})}
-        all_supervisors = {p['_id']: p['username'] for p in mongo.db.personas.find({"role": "supervisor"}, {"username": 1})}
+        all_categories = {c['_id']: c['name'] for c in get_categories()}
+        all_supervisors = {p['_id']: p['username'] for p in get_supervisors()}
 
-        for assign in assignments_cursor:
+        for assign in get_supervisor_assignments():
             category_name = all_categories.get(assign.get('category_id'), 'Categoría no encontrada')
             supervisor_name = all_supervisors.get(assign.get('supervisor_id'), 'Supervisor no encontrado')
             
@@ -184,6 +209,7 @@ def delete_assignment(assignment_id):
     # La validación de CSRF se hace implícitamente con el formulario POST en Flask-WTF
     try:
         result = mongo.db.supervisor_assignments.delete_one({"_id": ObjectId(assignment_id)})
+        invalidate_reference_data("supervisor_assignments")
         if result.deleted_count == 1:
             flash('Asignación borrada exitosamente.', 'success')
         else:
@@ -200,269 +226,234 @@ def delete_assignment(assignment_id):
 def list_tickets():
     logger.debug(f"request.args: {request.args}")
     form = TicketFilterForm(request.args)
-    query = {}
     tickets = [] # Inicializar tickets aquí para asegurar que siempre esté definida
     status_map = {} # Inicializar status_map
 
     # Poblar los formularios de filtro ANTES de la validación
     try:
-        statuses = list(mongo.db.statuses.find().sort("name", 1))
-        form.status.choices = [('', 'Todos los Estados')] + [(s['value'], s['name']) for s in statuses]
-        categories = list(mongo.db.categories.find().sort("name", 1))
-        form.category.choices = [('', 'Todas las Categorías')] + [(c['value'], c['name']) for c in categories]
-
-        # Create status_map here
+        statuses, _ = set_filter_choices(form)
         status_map = {s['value']: s['name'] for s in statuses}
-        logger.debug(f"status_map creado: {status_map}")
-
     except pymongo.errors.PyMongoError as e:
         logger.error(f"Error al poblar los filtros: {e}")
         flash("Error al cargar opciones de filtro.", "warning")
-        status_map = {}
-
-    # Lógica de filtrado adaptada para MongoDB (ejemplo básico)
-    if form.validate():
-        logger.debug("Formulario de filtro validado correctamente.")
-        if form.status.data:
-            query['status_value'] = form.status.data
-            logger.debug(f"Filtro por estado: {form.status.data}")
-        if form.category.data:
-            query['category_value'] = form.category.data
-            logger.debug(f"Filtro por categoría: {form.category.data}")
-
-        # Filtros de texto
-        if form.ticket_id.data:
-            # Filtra por el ID de ticket (que es un ObjectId)
-            try:
-                # Intenta buscar por ID exacto si parece un ObjectId
-                query['_id'] = ObjectId(form.ticket_id.data.strip())
-            except Exception:
-                # Si no es un ObjectId válido, usa $regexMatch en su representación string
-                 query['$expr'] = {
-                    '$regexMatch': {
-                        'input': {'$toString': '$_id'},
-                        'regex': form.ticket_id.data,
-                        'options': 'i'
-                    }
-                }
-            logger.debug(f"Filtro por ID de ticket: {form.ticket_id.data}")
-            
-        if form.search_title.data:
-            query['title'] = {'$regex': form.search_title.data, '$options': 'i'}
-            logger.debug(f"Filtro por título: {form.search_title.data}")
-        
-        # Se asume que 'creator', 'operator', y 'supervisor' son subdocumentos con un campo 'username'
-        if form.creator_username.data:
-            query['creator.username'] = {'$regex': form.creator_username.data, '$options': 'i'}
-            logger.debug(f"Filtro por nombre de creador: {form.creator_username.data}")
-        if form.operator_username.data:
-            query['operator.username'] = {'$regex': form.operator_username.data, '$options': 'i'}
-            logger.debug(f"Filtro por nombre de operador: {form.operator_username.data}")
-        if form.supervisor_username.data:
-            query['supervisor.username'] = {'$regex': form.supervisor_username.data, '$options': 'i'}
-            logger.debug(f"Filtro por nombre de supervisor: {form.supervisor_username.data}")
-
-        # Filtros de fecha
-        if form.start_date.data or form.end_date.data:
-            date_query = {}
-            start_datetime = None
-            end_datetime = None
-
-            if form.start_date.data:
-                # Establecer la hora a 00:00:00 para la fecha de inicio
-                start_datetime = datetime.combine(form.start_date.data, datetime.min.time())
-                logger.debug(f"Filtro por fecha de inicio (datetime naive): {start_datetime}")
-            
-            if form.end_date.data:
-                # Establecer la hora a 23:59:59.999999 para la fecha de fin
-                end_datetime = datetime.combine(form.end_date.data, datetime.max.time())
-                logger.debug(f"Filtro por fecha de fin (datetime naive): {end_datetime}")
-
-            # Si solo se proporciona la fecha de inicio, filtrar por ese día completo
-            if start_datetime and not end_datetime:
-                end_datetime = datetime.combine(form.start_date.data, datetime.max.time())
-                logger.debug(f"Ajuste: Solo fecha de inicio, fin ajustado a: {end_datetime}")
-            
-            # Si solo se proporciona la fecha de fin, filtrar por ese día completo
-            if end_datetime and not start_datetime:
-                start_datetime = datetime.combine(form.end_date.data, datetime.min.time())
-                logger.debug(f"Ajuste: Solo fecha de fin, inicio ajustado a: {start_datetime}")
-
-            if start_datetime:
-                date_query['$gte'] = start_datetime
-            if end_datetime:
-                date_query['$lte'] = end_datetime
-            
-            if date_query: # Solo agregar si hay algo que filtrar por fecha
-                query['created_at'] = date_query
 
-    else:
-        logger.debug(f"Errores de validación del formulario de filtro: {form.errors}")
-
-    # --- Lógica de filtrado para supervisores --- 
-    # Un supervisor solo ve tickets asignados a él O no asignados.
-    if current_user.is_supervisor and not current_user.is_admin:
-        supervisor_filter = {
-            "$or": [
-                # Asignado al supervisor actual (por user_id en el subdocumento 'supervisor')
-                {"supervisor.user_id": ObjectId(current_user.id)},
-                # No asignado a nadie (el campo 'supervisor' es null/inexistente)
-                {"supervisor": None}
-            ]
-        }
-        # Si ya hay filtros en la query (del formulario), combinarlos con $and
-        if query:
-            query = {"$and": [query, supervisor_filter]}
-        else:
-            query = supervisor_filter
-    # --- Fin Lógica de filtrado para supervisores ---
+    # Contadores por estado (documentos materializados, sin count_documents por estado). Son
+    # globales: un supervisor solo ve sus tickets y los sin asignar, así que no se le muestran.
+    ticket_stats = None
+    if current_user.is_admin:
+        try:
+            ticket_stats = get_ticket_stats(mongo.db)
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error al cargar los contadores de tickets: {e}")
 
-    logger.debug(f"Consulta final de MongoDB: {query}")
+    # Filtros del formulario y visibilidad del rol (un supervisor solo ve tickets suyos o sin asignar)
+    ticket_query = TicketQuery(form, current_user)
+    for warning in ticket_query.warnings:
+        flash(warning, "warning")
+    if form.errors:
+        logger.debug(f"Errores de validación del formulario de filtro: {form.errors}")
+    logger.debug(f"Consulta final de MongoDB: {ticket_query.filter}")
 
+    page = None
     try:
-        tickets = list(mongo.db.tickets.find(query).sort("created_at", -1))
-        logger.info(f'Usuario {current_user.username} consultó los tickets. Se encontraron {len(tickets)} tickets.')
+        page = ticket_query.page(mongo.db.tickets, request.args, ADMIN_LIST_PROJECTION)
+        tickets = page.items
+        logger.info(f'Usuario {current_user.username} consultó los tickets. Se muestran {len(tickets)} tickets.')
+    except pymongo.errors.ExecutionTimeout:
+        logger.warning(f"Consulta de tickets cancelada por tiempo: {ticket_query.filter}")
+        flash("La consulta ha tardado demasiado. Acote los filtros (por ejemplo, por fecha o estado).", "warning")
     except pymongo.errors.PyMongoError as e:
         logger.error(f"Error al buscar tickets: {e}")
         flash("Error al cargar los tickets.", "danger")
 
-    # Pasar los argumentos de la solicitud actual (filtros) para generar el enlace de exportación
-    export_url_args = request.args.copy()
+    # Formulario de acciones masivas (operadores y estados para sus desplegables)
+    bulk_form = None
+    try:
+        bulk_form = BulkTicketActionForm().load_choices()
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error al cargar opciones de la acción masiva: {e}")
+
+    # Pasar los argumentos de la solicitud actual (filtros) para generar el enlace de exportación.
+    # Se descartan los de paginación para exportar todos los tickets filtrados, no solo la página actual.
+    export_url_args = strip_pagination_args(request.args)
     
-    return render_template('admin/list_tickets.html', tickets=tickets, form=form, export_url_args=export_url_args, status_map=status_map)
+    return render_template('admin/list_tickets.html', tickets=tickets, form=form, export_url_args=export_url_args, export_job_form=ExportJobForm(), bulk_form=bulk_form, ticket_stats=ticket_stats, status_map=status_map, page=page)
+
+def _export_query():
+    """
+    Consulta de los tickets a exportar: los filtros de list_tickets (tomados de la URL) y,
+    para supervisores, la misma restricción de visibilidad que en el listado.
+    Compartida por todos los formatos de exportación.
+    """
+    form = TicketFilterForm(request.args)
+    try:
+        set_filter_choices(form)
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error al poblar los filtros para exportación: {e}")
+        # Continuar sin flash, ya que es un endpoint de descarga.
+    return TicketQuery(form, current_user)
 
 @admin_bp.route('/export_tickets_to_xlsx', methods=['GET'])
 @login_required
 @supervisor_or_admin_required
 def export_tickets_to_xlsx():
-    # Reutilizar la lógica de filtrado de list_tickets para exportar solo los tickets filtrados.
-    # Se debe recrear el proceso de filtrado.
-    
-    # 1. Preparar el formulario de filtro con los argumentos de la URL (filtros)
-    form = TicketFilterForm(request.args)
-    query = {}
-    
-    # 2. Poblar los choices para que la validación funcione (es importante que el formulario tenga los datos de choices)
+    ticket_query = _export_query()
+
+    # Generar el XLSX recorriendo el cursor por lotes (sin cargar todos los tickets en memoria)
+    output = spooled_file()
     try:
-        statuses = list(mongo.db.statuses.find().sort("name", 1))
-        form.status.choices = [('', 'Todos los Estados')] + [(s['value'], s['name']) for s in statuses]
-        categories = list(mongo.db.categories.find().sort("name", 1))
-        form.category.choices = [('', 'Todas las Categorías')] + [(c['value'], c['name']) for c in categories]
+        category_map = get_category_map()
+        status_map = get_status_map()
+        cursor = ticket_query.cursor(mongo.db.tickets, EXPORT_PROJECTION, batch_size=EXPORT_BATCH_SIZE)
+        exported = write_xlsx(cursor, output, category_map, status_map)
     except pymongo.errors.PyMongoError as e:
-        logger.error(f"Error al poblar los filtros para exportación: {e}")
-        # Continuar sin flash, ya que es un endpoint de descarga.
+        output.close()
+        logger.error(f"Error al exportar tickets: {e}")
+        flash("Error al generar el reporte de tickets.", "danger")
+        return redirect(url_for('admin_bp.list_tickets')) # Redirección si falla la DB
 
-    # 3. Re-aplicar la lógica de filtrado (idéntica a list_tickets)
-    if form.validate():
-        if form.status.data:
-            query['status_value'] = form.status.data
-        if form.category.data:
-            query['category_value'] = form.category.data
+    logger.info(f'Usuario {current_user.username} ha generado un reporte de tickets en ".xlsx" con {exported} tickets.')
 
-        # Filtros de texto
-        if form.ticket_id.data:
-            try:
-                query['_id'] = ObjectId(form.ticket_id.data.strip())
-            except Exception:
-                 query['$expr'] = {
-                    '$regexMatch': {
-                        'input': {'$toString': '$_id'},
-                        'regex': form.ticket_id.data,
-                        'options': 'i'
-                    }
-                }
-        if form.search_title.data:
-            query['title'] = {'$regex': form.search_title.data, '$options': 'i'}
-        if form.creator_username.data:
-            query['creator.username'] = {'$regex': form.creator_username.data, '$options': 'i'}
-        if form.operator_username.data:
-            query['operator.username'] = {'$regex': form.operator_username.data, '$options': 'i'}
-        if form.supervisor_username.data:
-            query['supervisor.username'] = {'$regex': form.supervisor_username.data, '$options': 'i'}
-
-        # Filtros de fecha (misma lógica que list_tickets)
-        if form.start_date.data or form.end_date.data:
-            date_query = {}
-            start_datetime = None
-            end_datetime = None
-
-            if form.start_date.data:
-                start_datetime = datetime.combine(form.start_date.data, datetime.min.time())
-            if form.end_date.data:
-                end_datetime = datetime.combine(form.end_date.data, datetime.max.time())
-
-            if start_datetime and not end_datetime:
-                end_datetime = datetime.combine(form.start_date.data, datetime.max.time())
-            if end_datetime and not start_datetime:
-                start_datetime = datetime.combine(form.end_date.data, datetime.min.time())
-
-            if start_datetime:
-                date_query['$gte'] = start_datetime
-            if end_datetime:
-                date_query['$lte'] = end_datetime
-            
-            if date_query:
-                query['created_at'] = date_query
-    
-    # 4. Re-aplicar la lógica de restricción por rol de supervisor
-    if current_user.is_supervisor and not current_user.is_admin:
-        supervisor_filter = {
-            "$or": [
-                {"supervisor.user_id": ObjectId(current_user.id)},
-                {"supervisor": None}
-            ]
+    # Enviar el fichero por trozos
+    size = output.tell()
+    return Response(
+        iter_file_chunks(output),
+        mimetype=XLSX_MIMETYPE,
+        headers={
+            "Content-Disposition": f"attachment;filename=tickets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+            "Content-Length": str(size)
         }
-        if query:
-            query = {"$and": [query, supervisor_filter]}
-        else:
-            query = supervisor_filter
+    )
 
-    # 5. Obtener los tickets
+
+def _stream_export(extension, mimetype, chunks_for):
+    """
+    Respuesta en streaming para los formatos de texto (CSV y NDJSON): las filas se envían a
+    medida que llegan del cursor. Con ?gzip=1 se comprimen sobre la marcha (fichero .gz).
+    """
+    ticket_query = _export_query()
     try:
-        tickets_to_export = list(mongo.db.tickets.find(query).sort("created_at", -1))
-        
-        # Obtener mapas para la visualización de nombres de categoría y estado
-        category_map = {c['value']: c['name'] for c in mongo.db.categories.find()}
-        status_map = {s['value']: s['name'] for s in mongo.db.statuses.find()}
-        
+        category_map = get_category_map()
+        status_map = get_status_map()
+        cursor = ticket_query.cursor(mongo.db.tickets, EXPORT_PROJECTION, batch_size=EXPORT_BATCH_SIZE)
     except pymongo.errors.PyMongoError as e:
         logger.error(f"Error al exportar tickets: {e}")
         flash("Error al generar el reporte de tickets.", "danger")
-        return redirect(url_for('admin_bp.list_tickets')) # Redirección si falla la DB
+        return redirect(url_for('admin_bp.list_tickets'))
+
+    username = current_user.username
+    counter = CountingIterator(cursor)
+
+    def generate():
+        try:
+            yield from chunks_for(counter, category_map, status_map)
+        except pymongo.errors.PyMongoError as e:
+            # Las cabeceras ya se enviaron: se corta la descarga para que el fichero no parezca completo.
+            logger.error(f"Error al exportar tickets en \".{extension}\" tras {counter.count} tickets: {e}")
+            raise
+        finally:
+            cursor.close()
+        logger.info(f'Usuario {username} ha generado un reporte de tickets en ".{extension}" con {counter.count} tickets.')
+
+    filename = f"tickets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    body = generate()
+    if request.args.get('gzip') == '1':
+        body = gzip_chunks(body)
+        filename += ".gz"
+        mimetype = GZIP_MIMETYPE
+
+    return Response(body, mimetype=mimetype, headers={"Content-Disposition": f"attachment;filename={filename}"})
+
+@admin_bp.route('/export_tickets_to_csv', methods=['GET'])
+@login_required
+@supervisor_or_admin_required
+def export_tickets_to_csv():
+    return _stream_export("csv", CSV_MIMETYPE, iter_csv)
+
+@admin_bp.route('/export_tickets_to_ndjson', methods=['GET'])
+@login_required
+@supervisor_or_admin_required
+def export_tickets_to_ndjson():
+    return _stream_export("ndjson", NDJSON_MIMETYPE, iter_ndjson)
 
-    # 6. Generar el archivo XLSX
-    workbook = Workbook()
-    worksheet = workbook.active
-    worksheet.title = "Tickets"
-
-    headers = ['ID', 'Título', 'Descripción', 'Creado Por', 'Categoría', 'Estado', 'Operador Asignado', 'Supervisor Asignado', 'Fecha Creación']
-    worksheet.append(headers)
-
-    for ticket in tickets_to_export:
-        category_name = category_map.get(ticket.get('category_value'), ticket.get('category_value', 'N/A'))
-        status_name = status_map.get(ticket.get('status_value'), ticket.get('status_value', 'N/A'))
-        
-        row_data = [
-            str(ticket['_id']),
-            ticket.get('title', 'N/A'),
-            ticket.get('description', 'N/A'),
-            (ticket.get('creator') or {}).get('username', 'N/A'),
-            category_name,
-            status_name,
-            (ticket.get('operator') or {}).get('username', 'N/A'),
-            (ticket.get('supervisor') or {}).get('username', 'N/A'),
-            ticket.get('created_at').strftime('%d/%m/%Y %H:%M') if ticket.get('created_at') else 'N/A'
-        ]
-        worksheet.append(row_data)
-
-    output = BytesIO()
-    workbook.save(output)
-    output.seek(0)
-
-    logger.info(f'Usuario {current_user.username} ha generado un reporte de tickets en ".xlsx" con {len(tickets_to_export)} tickets.')
+@admin_bp.route('/export_jobs/new', methods=['POST'])
+@login_required
+@supervisor_or_admin_required
+def request_export_job():
+    # Los filtros llegan en la URL, igual que en las exportaciones directas
+    form = ExportJobForm()
+    if not form.validate_on_submit():
+        flash("Formato de exportación no válido.", "danger")
+        return redirect(url_for('admin_bp.list_tickets', **strip_pagination_args(request.args)))
+
+    ticket_query = _export_query()
+    try:
+        job_id = create_export_job(
+            mongo.db, ticket_query.filter, form.format.data, current_user,
+            gzip=form.gzip.data,
+            notify_email=current_user.email if form.notify.data else None,
+            filters=strip_pagination_args(request.args)
+        )
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error al crear el trabajo de exportación: {e}")
+        flash("Error al solicitar la exportación.", "danger")
+        return redirect(url_for('admin_bp.list_tickets', **strip_pagination_args(request.args)))
+
+    logger.info(f'Usuario {current_user.username} ha solicitado la exportación {job_id} en ".{form.format.data}".')
+    flash("Exportación en curso. Puede seguir su progreso en esta página.", "info")
+    return redirect(url_for('admin_bp.export_job_status', job_id=str(job_id)))
+
+def _get_export_job(job_id):
+    """Trabajo de exportación visible para el usuario actual (propio, o cualquiera si es admin), o None."""
+    try:
+        job = mongo.db[JOBS_COLLECTION].find_one({"_id": ObjectId(job_id)}, {"query": 0})
+    except Exception as e:
+        logger.error(f"Error al buscar el trabajo de exportación {job_id}: {e}")
+        return None
+    if job and not current_user.is_admin and str(job["requested_by"]["user_id"]) != current_user.id:
+        return None
+    return job
+
+@admin_bp.route('/export_jobs')
+@login_required
+@supervisor_or_admin_required
+def export_jobs():
+    try:
+        jobs = list(mongo.db[JOBS_COLLECTION].find(
+            {"requested_by.user_id": ObjectId(current_user.id)}, {"query": 0}
+        ).sort("created_at", pymongo.DESCENDING).limit(50))
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error al cargar los trabajos de exportación: {e}")
+        flash("Error al cargar las exportaciones.", "danger")
+        jobs = []
+    return render_template('admin/export_jobs.html', title='Exportaciones', jobs=jobs)
+
+@admin_bp.route('/export_jobs/<string:job_id>')
+@login_required
+@supervisor_or_admin_required
+def export_job_status(job_id):
+    job = _get_export_job(job_id)
+    if not job:
+        flash("Exportación no encontrada.", "danger")
+        return redirect(url_for('admin_bp.export_jobs'))
+    in_progress = job["status"] in (STATUS_PENDING, STATUS_RUNNING)
+    return render_template('admin/export_job_status.html', title='Exportación', job=job, in_progress=in_progress)
+
+@admin_bp.route('/export_jobs/<string:job_id>/download')
+@login_required
+@supervisor_or_admin_required
+def download_export_job(job_id):
+    job = _get_export_job(job_id)
+    grid_out = open_export_file(mongo.db, job) if job else None
+    if grid_out is None:
+        flash("El fichero de la exportación no está disponible (no ha terminado o ha caducado).", "warning")
+        return redirect(url_for('admin_bp.export_jobs'))
 
     return Response(
-        output.read(),
-        mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment;filename=tickets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"}
-    )
\ No newline at end of file
+        iter_file_chunks(grid_out),
+        mimetype=job["mimetype"],
+        headers={
+            "Content-Disposition": f"attachment;filename={job['filename']}",
+            "Content-Length": str(grid_out.length)
+        }
+    )
@@ -96,6 +96,10 @@ class ProfileEditForm(FlaskForm):
     secondSurname = StringField('Segundo Apellido', validators=[Optional(), Length(max=100)], render_kw={'readonly': True, 'disabled': True})
     role = StringField('Rol', render_kw={'readonly': True, 'disabled': True})
 
+class NotificationPreferencesForm(FlaskForm):
+    notification_digest = BooleanField('Recibir las notificaciones de tickets en un resumen periódico')
+    submit = SubmitField('Guardar Preferencias')
+
 class ChangePasswordForm(FlaskForm):
     old_password = PasswordField('Contraseña Actual', validators=[DataRequired(message="Este campo es obligatorio")])
     new_password = PasswordField(
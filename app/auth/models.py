@@ -32,7 +32,7 @@
 # --- Nuevos Modelos adaptados para PyMongo (basado en referencia) ---
 
 from app import mongo
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.auth.passwords import hash_password, verify_password
 from flask_login import UserMixin
 from itsdangerous import URLSafeTimedSerializer as TimedSerializer
 from flask import current_app
@@ -50,7 +50,7 @@ class Role:
         return f"<Role '{self.name}'>"
 
 class Persona(UserMixin):
-    def __init__(self, username, email, name, firstSurname, password="", _id=None, middleName="", secondSurname="", role="cliente", password_hash=None, password_changed_at=None, two_factor_code=None, two_factor_code_expiration=None, **kwargs):
+    def __init__(self, username, email, name, firstSurname, password="", _id=None, middleName="", secondSurname="", role="cliente", password_hash=None, password_changed_at=None, two_factor_code=None, two_factor_code_expiration=None, security_stamp=None, notification_digest=False, **kwargs):
         self.username = username
         self.email = email
         self.name = name
@@ -72,15 +72,17 @@ class Persona(UserMixin):
         self.password_changed_at = password_changed_at
         self.two_factor_code = two_factor_code
         self.two_factor_code_expiration = two_factor_code_expiration
+        # Cambia al cambiar la contraseña o editar el usuario e invalida sus sesiones (ver app/auth/user_cache.py)
+        self.security_stamp = security_stamp
+        # Recibir las notificaciones de tickets en un resumen periódico (ver app/notifications.py)
+        self.notification_digest = notification_digest
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
         self.password_changed_at = datetime.utcnow()
 
     def check_password(self, password):
-        if self.password_hash:
-            return check_password_hash(self.password_hash, password)
-        return False
+        return verify_password(self.password_hash, password)
 
     def generate_2fa_code(self):
         """Genera un código 2FA de 6 dígitos y establece su expiración."""
@@ -117,8 +119,11 @@ class Persona(UserMixin):
         except Exception:
             return None
 
-    # get_id es requerido por Flask-Login
+    # get_id es requerido por Flask-Login. Incluye el security_stamp para que las sesiones
+    # (y cookies "Recuérdame") anteriores a un cambio de contraseña dejen de ser válidas.
     def get_id(self):
+        if self.security_stamp:
+            return f"{self.id}:{self.security_stamp}"
         return self.id
 
     # --- MÉTODOS DE PROPIEDAD PARA ROLES ---
@@ -0,0 +1,119 @@
+# app/auth/passwords.py
+
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+logger = logging.getLogger(__name__)
+
+# --- Hash de contraseñas ---
+# El hash (scrypt de Werkzeug) es deliberadamente costoso: calculado en el hilo de la
+# petición, unos pocos logins simultáneos bloquean el worker (--threads=2). Por eso se
+# calcula en un pool de PASSWORD_HASH_WORKERS procesos y el hilo de la petición solo
+# espera el resultado. Con PASSWORD_HASH_WORKERS = 0 (tests, scripts) se calcula en el hilo.
+#
+# El coste es el parámetro N de scrypt. PASSWORD_HASH_COST lo fija (si no se define, el
+# de Werkzeug). `flask calibrate-password-cost` mide con calibrate_password_cost() el mayor
+# N (potencia de 2, entre MIN_COST y MAX_COST) cuyo hash tarda como mucho
+# PASSWORD_HASH_TARGET_MS en esta máquina y muestra el valor que conviene configurar; no
+# se calibra al arrancar, para no retrasar cada proceso ni que cada instancia use otro N.
+# Los hashes guardados con otro algoritmo o con un N menor que el actual se recalculan
+# en el siguiente login correcto del usuario (needs_rehash).
+
+DEFAULT_COST = 2 ** 15  # el de Werkzeug
+MIN_COST = 2 ** 14
+MAX_COST = 2 ** 17  # 128 MB de memoria por hash
+SCRYPT_R = 8
+SCRYPT_P = 1
+DEFAULT_WORKERS = 2
+DEFAULT_TARGET_MS = 250
+
+
+def hash_method(cost):
+    return f"scrypt:{cost}:{SCRYPT_R}:{SCRYPT_P}"
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+def password_cost():
+    """Coste (N de scrypt) con el que se generan los hashes nuevos."""
+    if not has_app_context():
+        return DEFAULT_COST
+    return current_app.config.get("PASSWORD_HASH_COST") or DEFAULT_COST
+
+
+def _executor():
+    """Pool de procesos de la aplicación actual, o None si PASSWORD_HASH_WORKERS es 0."""
+    if not has_app_context():
+        return None
+    workers = current_app.config.get("PASSWORD_HASH_WORKERS", DEFAULT_WORKERS)
+    if not workers:
+        return None
+    executor = current_app.extensions.get("password_hasher")
+    if executor is None:
+        # 'spawn': el proceso web tiene hilos, y hacer fork de un proceso con hilos no es seguro
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        current_app.extensions["password_hasher"] = executor
+    return executor
+
+
+def _run(fn, *args):
+    executor = _executor()
+    if executor is None:
+        return fn(*args)
+    return executor.submit(fn, *args).result()
+
+
+def hash_password(password):
+    """Hash de `password` con el coste actual."""
+    return _run(_hash, password, hash_method(password_cost()))
+
+
+def hash_passwords(passwords):
+    """Hashes de varias contraseñas, calculados en paralelo si hay pool (p. ej. altas masivas)."""
+    method = hash_method(password_cost())
+    executor = _executor()
+    if executor is None:
+        return [_hash(password, method) for password in passwords]
+    return list(executor.map(_hash, passwords, [method] * len(passwords)))
+
+
+def verify_password(password_hash, password):
+    """True si `password` corresponde a `password_hash`."""
+    if not password_hash:
+        return False
+    return _run(_verify, password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """True si el hash usa otro algoritmo o un coste menor que el actual (nunca para rebajarlo)."""
+    method, *params = password_hash.split("$", 1)[0].split(":")
+    if method != "scrypt":
+        return True
+    try:
+        cost = int(params[0]) if params else DEFAULT_COST
+    except ValueError:
+        return True
+    return cost < password_cost()
+
+
+def calibrate_password_cost(target_ms=DEFAULT_TARGET_MS, min_cost=MIN_COST, max_cost=MAX_COST):
+    """Mayor coste entre min_cost y max_cost cuyo hash tarda como mucho target_ms milisegundos."""
+    cost = min_cost
+    while cost < max_cost:
+        start = time.perf_counter()
+        _hash("calibración", hash_method(cost * 2))
+        if (time.perf_counter() - start) * 1000 > target_ms:
+            break
+        cost *= 2
+    return cost
+
@@ -2,59 +2,47 @@ from flask import render_template, redirect, url_for, flash, request, session
 from app.auth import auth_bp
 from app.auth.forms import (
     RegistrationForm, LoginForm, ResetPasswordForm, RequestResetPasswordForm, 
-    ChangePasswordForm, ProfileEditForm, UserEditForm, Verify2FAForm
+    ChangePasswordForm, ProfileEditForm, UserEditForm, Verify2FAForm, NotificationPreferencesForm
 )
 from app.auth.models import Persona
 from app import mongo, limiter
 import logging
 from app.auth.decorators import admin_required
-from werkzeug.security import generate_password_hash
+from app.auth.passwords import hash_password, needs_rehash
 from bson.objectid import ObjectId
 from flask_login import login_user, logout_user, login_required, current_user
 from datetime import datetime
-from threading import Thread
 from flask import current_app
-from flask_mail import Message
-from app import mail
+from app.email import queue_email, PRIORITY_HIGH
+from app.reference_data import get_roles, invalidate as invalidate_reference_data
+from app.auth.user_cache import new_security_stamp, forget_user
 
 logger = logging.getLogger(__name__)
 
-def send_async_email(app, msg):
-    """Función auxiliar para enviar el correo en un hilo separado con manejo de errores."""
-    with app.app_context():
-        try:
-            mail.send(msg)
-            logger.info(f"Correo enviado exitosamente a {msg.recipients}")
-        except Exception as e:
-            logger.error(
-                f"Error al enviar correo a {msg.recipients}: {e}", exc_info=True
-            )
-
 def send_2fa_code_email(user):
-    """Envía el código 2FA al usuario."""
-    msg = Message(
+    """Envía el código 2FA al usuario (con prioridad sobre las notificaciones)."""
+    queue_email(
         "Tu Código de Verificación",
+        [user.email],
+        "email/2fa_code.html",
+        text_template="email/2fa_code.txt",
+        priority=PRIORITY_HIGH,
         sender=current_app.config["ADMINS"][0],
-        recipients=[user.email],
+        user={"username": user.username, "two_factor_code": user.two_factor_code},
     )
-    msg.body = render_template("email/2fa_code.txt", user=user)
-    msg.html = render_template("email/2fa_code.html", user=user)
-    Thread(
-        target=send_async_email, args=(current_app._get_current_object(), msg)
-    ).start()
 
 def send_password_reset_email_wrapper(user):
     token = user.get_reset_password_token()
-    msg = Message(
+    queue_email(
         "Restablecer Contraseña - [TuApp]",
+        [user.email],
+        "email/reset_password.html",
+        text_template="email/reset_password.txt",
+        priority=PRIORITY_HIGH,
         sender=current_app.config["ADMINS"][0],
-        recipients=[user.email],
+        user={"username": user.username},
+        token=token,
     )
-    msg.body = render_template("email/reset_password.txt", user=user, token=token)
-    msg.html = render_template("email/reset_password.html", user=user, token=token)
-    Thread(
-        target=send_async_email, args=(current_app._get_current_object(), msg)
-    ).start()
 
 
 
@@ -64,7 +52,7 @@ def send_password_reset_email_wrapper(user):
 def register():
     form = RegistrationForm()
     try:
-        roles = mongo.db.roles.find()
+        roles = get_roles()
         role_choices = [(r["value"], r["name"]) for r in roles]
         form.role.choices = [("", "--- Seleccione una opción ---")] + role_choices
     except Exception as e:
@@ -90,6 +78,9 @@ def register():
             user_dict.pop("id", None)  # Remove id if it exists, as MongoDB will create it
 
             mongo.db.personas.insert_one(user_dict)
+            if user.role == "supervisor":
+                # La lista de supervisores de los formularios de asignación sale de la caché
+                invalidate_reference_data("supervisor_assignments")
             flash("Usuario registrado con éxito", "success")
             return redirect(url_for("auth.list_users"))
         except Exception as e:
@@ -131,6 +122,15 @@ def login():
             )
             return redirect(url_for("auth.login"))
 
+        # Hash con parámetros anteriores: se recalcula ahora que se conoce la contraseña
+        if needs_rehash(user.password_hash):
+            user.password_hash = hash_password(form.password.data)
+            mongo.db.personas.update_one(
+                {"_id": ObjectId(user.id), "password_hash": user_data["password_hash"]},
+                {"$set": {"password_hash": user.password_hash}},
+            )
+            logger.info(f"Hash de contraseña actualizado para el usuario '{user.username}'.")
+
         # --- INICIO LÓGICA 2FA ---
         user.generate_2fa_code()
         mongo.db.personas.update_one(
@@ -228,9 +228,11 @@ def reset_password(token):
                 "$set": {
                     "password_hash": user.password_hash,
                     "password_changed_at": datetime.utcnow(),
+                    "security_stamp": new_security_stamp(),
                 }
             },
         )
+        forget_user(user.id)
         flash("Tu contraseña ha sido restablecida. Ya puedes iniciar sesión.", "success")
         return redirect(url_for("auth.login"))
     return render_template("reset_password.html", title="Restablecer Contraseña", form=form)
@@ -242,8 +244,29 @@ def edit_profile():
 
     if request.method == 'GET':
         form.role.data = current_user.role
+    preferences_form = NotificationPreferencesForm(notification_digest=current_user.notification_digest)
 
-    return render_template("edit_profile.html", title="Ver Perfil", form=form)
+    return render_template("edit_profile.html", title="Ver Perfil", form=form, preferences_form=preferences_form)
+
+@auth_bp.route("/profile/notifications", methods=["POST"])
+@login_required
+def notification_preferences():
+    form = NotificationPreferencesForm()
+    if form.validate_on_submit():
+        mongo.db.personas.update_one(
+            {"_id": ObjectId(current_user.id)},
+            {"$set": {"notification_digest": form.notification_digest.data}},
+        )
+        # El user_loader cachea el usuario: se descarta para leer la nueva preferencia
+        forget_user(current_user.id)
+        if current_user.role == "supervisor":
+            # La tabla de enrutado de tickets guarda la preferencia de cada supervisor
+            invalidate_reference_data("supervisor_assignments")
+        if form.notification_digest.data:
+            flash("Recibirás las notificaciones de tickets en un resumen periódico.", "success")
+        else:
+            flash("Recibirás una notificación por cada ticket.", "success")
+    return redirect(url_for("auth.edit_profile"))
 
 @auth_bp.route("/profile/change_password", methods=["GET", "POST"])
 @login_required
@@ -260,9 +283,11 @@ def change_password():
                     "$set": {
                         "password_hash": current_user.password_hash,
                         "password_changed_at": datetime.utcnow(),
+                        "security_stamp": new_security_stamp(),
                     }
                 },
             )
+            forget_user(current_user.id)
             flash("Tu contraseña ha sido actualizada. Vuelve a iniciar sesión.", "success")
             logout_user()
             return redirect(url_for("auth.login"))
@@ -289,7 +314,7 @@ def edit_user(user_id):
     form = UserEditForm(original_username=user.username, original_email=user.email, obj=user)
     
     try:
-        roles = mongo.db.roles.find()
+        roles = get_roles()
         form.role.choices = [(r["value"], r["name"]) for r in roles]
         if request.method == 'GET':
             form.role.data = user.role # Pre-seleccionar el rol actual
@@ -308,10 +333,17 @@ def edit_user(user_id):
             "role": form.role.data,
         }
         if form.password.data:
-            update_data["password_hash"] = generate_password_hash(form.password.data)
+            update_data["password_hash"] = hash_password(form.password.data)
             update_data["password_changed_at"] = datetime.utcnow()
         
+        # Un nuevo sello cierra las sesiones abiertas del usuario para que vea su nuevo rol o contraseña
+        update_data["security_stamp"] = new_security_stamp()
+
         mongo.db.personas.update_one({"_id": ObjectId(user_id)}, {"$set": update_data})
+        forget_user(user_id)
+        if "supervisor" in (user.role, form.role.data):
+            # La tabla de enrutado de tickets y la lista de supervisores guardan su nombre y correo
+            invalidate_reference_data("supervisor_assignments")
         flash(f"Perfil del usuario {user.username} actualizado correctamente.", "success")
         return redirect(url_for("auth.list_users"))
 
@@ -0,0 +1,101 @@
+# app/auth/user_cache.py
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from bson.objectid import ObjectId
+from flask import current_app
+from app import mongo
+
+# --- Caché de usuarios para Flask-Login ---
+# El user_loader se ejecuta en cada petición autenticada. En lugar de consultar
+# 'personas' cada vez, cada proceso guarda los últimos USER_CACHE_SIZE usuarios cargados
+# durante USER_CACHE_TTL segundos.
+#
+# Cada persona tiene un 'security_stamp' que cambia al cambiar o restablecer la contraseña
+# y al editar el usuario. El identificador de sesión que guarda Flask-Login (y la cookie
+# "Recuérdame") es "<_id>:<security_stamp>" (ver Persona.get_id):
+#   - si el sello de la sesión no coincide con el de la caché, se vuelve a leer la BD;
+#   - si tampoco coincide con el de la BD, la sesión se da por revocada.
+# En el proceso que hace el cambio la entrada se descarta al momento; en el resto de
+# workers, una sesión antigua deja de ser válida en, como mucho, USER_CACHE_TTL segundos.
+
+DEFAULT_SIZE = 1024
+DEFAULT_TTL = 60
+
+
+def new_security_stamp():
+    return secrets.token_hex(16)
+
+
+class UserCache:
+    """Caché LRU con caducidad de objetos Persona, por _id (string)."""
+
+    def __init__(self, maxsize=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, loaded_at = entry
+            if time.monotonic() - loaded_at >= self.ttl:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, user):
+        with self._lock:
+            self._entries[user.id] = (user, time.monotonic())
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+
+def _cache():
+    cache = current_app.extensions.get("user_cache")
+    if cache is None:
+        cache = UserCache(
+            current_app.config.get("USER_CACHE_SIZE", DEFAULT_SIZE),
+            current_app.config.get("USER_CACHE_TTL", DEFAULT_TTL)
+        )
+        current_app.extensions["user_cache"] = cache
+    return cache
+
+
+def load_cached_user(session_id):
+    """
+    Devuelve la Persona de un identificador de sesión "<_id>:<security_stamp>", o None si
+    el usuario no existe o su sello ha cambiado desde que se inició la sesión.
+    """
+    from app.auth.models import Persona
+
+    user_id, _, stamp = session_id.partition(":")
+    cache = _cache()
+    user = cache.get(user_id)
+    if user is None or (user.security_stamp or "") != stamp:
+        user_data = mongo.db.personas.find_one({"_id": ObjectId(user_id)})
+        if not user_data:
+            cache.discard(user_id)
+            return None
+        user = Persona(**user_data)
+        cache.put(user)
+
+    if (user.security_stamp or "") != stamp:
+        return None
+    return user
+
+
+def forget_user(user_id):
+    """Descarta un usuario de la caché de este proceso (tras modificarlo)."""
+    _cache().discard(user_id)
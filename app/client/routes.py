@@ -8,10 +8,12 @@ from datetime import datetime, timezone
 from app.auth.decorators import role_required, client_required
 import logging
 from bson.objectid import ObjectId
-from bson.errors import InvalidId
 import pymongo
-from app.utils import log_ticket_history
-from app.email import send_notification_email # Importar funciones centralizadas
+from app.pagination import strip_pagination_args
+from app.projections import CLIENT_LIST_PROJECTION
+from app.ticket_query import TicketQuery, set_filter_choices
+from app.ticket_service import create_ticket as create_new_ticket, update_ticket
+from app.reference_data import get_statuses, get_categories, get_status
 
 logger = logging.getLogger(__name__)
 
@@ -21,11 +23,11 @@ logger = logging.getLogger(__name__)
 def create_ticket():
     form = CreateTicketForm()
     try:
-        categories = list(mongo.db.categories.find().sort("name", 1))
+        categories = get_categories()
         form.category.choices = [(cat["value"], cat["name"]) for cat in categories]
         category_map = {c['value']: c['name'] for c in categories}
 
-        statuses = list(mongo.db.statuses.find().sort("name", 1))
+        statuses = get_statuses()
         status_map = {s['value']: s['name'] for s in statuses}
 
     except pymongo.errors.PyMongoError as e:
@@ -36,81 +38,24 @@ def create_ticket():
 
     if form.validate_on_submit():
         try:
-            pending_status = mongo.db.statuses.find_one({"value": "pending"})
+            pending_status = get_status("pending")
             if not pending_status:
                 flash('Error crítico: El estado inicial "Pendiente" no existe.', 'danger')
                 return redirect(url_for('client_bp.create_ticket'))
 
-            # --- Nueva lógica de asignación de supervisor --- 
-            category_value = form.category.data
-            shift_value = form.shift.data
-            
-            category_doc = mongo.db.categories.find_one({"value": category_value})
-            category_id = category_doc['_id'] if category_doc else None
-
-            assigned_supervisor_data = None
-            recipients = []
-
-            if category_id:
-                assignment = mongo.db.supervisor_assignments.find_one({
-                    "category_id": category_id,
-                    "shift_value": shift_value
-                })
-
-                if assignment:
-                    supervisor_id = assignment.get('supervisor_id')
-                    assigned_supervisor_data = mongo.db.personas.find_one({"_id": supervisor_id})
-                    if assigned_supervisor_data:
-                        recipients = [assigned_supervisor_data['email']]
-                        logger.info(f"Ticket asignado automáticamente al supervisor '{assigned_supervisor_data['username']}' por regla.")
-
-            # --- Lógica de Fallback: si no se encontró asignación ---
-            if not assigned_supervisor_data:
+            # Supervisor por regla (categoría y turno), ticket, historial, contadores y aviso en un solo viaje
+            _, supervisor = create_new_ticket(
+                current_user,
+                title=form.title.data,
+                description=form.description.data,
+                category_value=form.category.data,
+                shift=form.shift.data,
+                status_value=pending_status['value'],
+                status_map=status_map,
+                category_map=category_map
+            )
+            if not supervisor:
                 flash('No se encontró una asignación de supervisor específica para este turno y categoría. El ticket queda pendiente de asignación.', 'info')
-                logger.info("Ticket no asignado a un supervisor específico por regla. Queda pendiente.")
-
-            # --- Fin de la nueva lógica de asignación ---
-
-            assigned_supervisor_id = assigned_supervisor_data['_id'] if assigned_supervisor_data else None
-            assigned_supervisor_username = assigned_supervisor_data['username'] if assigned_supervisor_data else None
-
-            new_ticket = {
-                "title": form.title.data,
-                "description": form.description.data,
-                "category_value": form.category.data,
-                "shift": form.shift.data,
-                "status_value": pending_status['value'],
-                "creator": {
-                    "user_id": ObjectId(current_user.id),
-                    "username": current_user.username
-                },
-                "supervisor": {
-                    "user_id": assigned_supervisor_id,
-                    "username": assigned_supervisor_username
-                } if assigned_supervisor_id else None,
-                "operator": None,
-                "created_at": datetime.now(timezone.utc),
-                "updated_at": datetime.now(timezone.utc),
-                "history": []
-            }
-            
-            result = mongo.db.tickets.insert_one(new_ticket)
-            ticket_id = result.inserted_id
-
-            log_ticket_history(str(ticket_id), "Creación de Ticket", current_user, "Ticket creado por el cliente.")
-
-            # --- ENVÍO DE CORREO --- 
-            if recipients:
-                send_notification_email(
-                    subject=f"Nuevo Ticket Creado: #{ticket_id}",
-                    recipients=recipients,
-                    template='emails/ticket_created.html',
-                    ticket=new_ticket,
-                    supervisor_name=assigned_supervisor_username, # Será None si no hay asignado
-                    client_name=current_user.username,
-                    status_map=status_map,
-                    category_map=category_map
-                )
 
             flash('¡Ticket creado exitosamente!', 'success')
             if current_user.role == 'cliente':
@@ -132,14 +77,9 @@ def create_ticket():
 @client_required
 def client_tickets():
     form = TicketFilterForm(request.args)
-    query = {"creator.user_id": ObjectId(current_user.id)}
-    
-    try:
-        statuses = list(mongo.db.statuses.find().sort("name", 1))
-        form.status.choices = [('', 'Todos los Estados')] + [(s['value'], s['name']) for s in statuses]
-        categories = list(mongo.db.categories.find().sort("name", 1))
-        form.category.choices = [('', 'Todas las Categorías')] + [(c['value'], c['name']) for c in categories]
 
+    try:
+        statuses, categories = set_filter_choices(form)
         status_map = {s['value']: s['name'] for s in statuses}
         category_map = {c['value']: c['name'] for c in categories}
 
@@ -149,56 +89,27 @@ def client_tickets():
         status_map = {}
         category_map = {}
 
-    # Lógica de filtrado para MongoDB
-    if form.ticket_id.data:
-        try:
-            query["_id"] = ObjectId(form.ticket_id.data)
-        except InvalidId:
-            flash("ID de Ticket inválido.", "warning")
-    if form.search_title.data:
-        query["title"] = {"$regex": form.search_title.data, "$options": "i"}
-    if form.category.data:
-        query["category_value"] = form.category.data
-    if form.status.data:
-        query["status_value"] = form.status.data
-    if form.operator_username.data:
-        query["operator.username"] = {"$regex": form.operator_username.data, "$options": "i"}
-    if form.supervisor_username.data:
-        query["supervisor.username"] = {"$regex": form.supervisor_username.data, "$options": "i"}
-    
-    if form.start_date.data or form.end_date.data:
-        date_query = {}
-        if form.start_date.data and form.end_date.data:
-            # Range query if both dates are provided
-            date_query["$gte"] = datetime.combine(form.start_date.data, datetime.min.time())
-            date_query["$lte"] = datetime.combine(form.end_date.data, datetime.max.time())
-        elif form.start_date.data:
-            # Exact day query for start_date
-            start = datetime.combine(form.start_date.data, datetime.min.time())
-            end = datetime.combine(form.start_date.data, datetime.max.time())
-            date_query["$gte"] = start
-            date_query["$lte"] = end
-        elif form.end_date.data:
-            # Exact day query for end_date
-            start = datetime.combine(form.end_date.data, datetime.min.time())
-            end = datetime.combine(form.end_date.data, datetime.max.time())
-            date_query["$gte"] = start
-            date_query["$lte"] = end
-
-        if date_query:
-            query["created_at"] = date_query
-
+    # Filtros del formulario sobre los tickets creados por el cliente
+    ticket_query = TicketQuery(form, current_user)
+    for warning in ticket_query.warnings:
+        flash(warning, "warning")
 
+    page = None
     try:
-        tickets = list(mongo.db.tickets.find(query).sort("created_at", -1))
-        logger.info(f'Usuario {current_user.username} consultó sus tickets. Se encontraron {len(tickets)} tickets.')
+        page = ticket_query.page(mongo.db.tickets, request.args, CLIENT_LIST_PROJECTION)
+        tickets = page.items
+        logger.info(f'Usuario {current_user.username} consultó sus tickets. Se muestran {len(tickets)} tickets.')
+    except pymongo.errors.ExecutionTimeout:
+        logger.warning(f"Consulta de tickets cancelada por tiempo: {ticket_query.filter}")
+        flash("La consulta ha tardado demasiado. Acote los filtros (por ejemplo, por fecha o estado).", "warning")
+        tickets = []
     except pymongo.errors.PyMongoError as e:
         logger.error(f"Error al buscar tickets para el cliente {current_user.username}: {e}")
         flash("Error al cargar los tickets.", "danger")
         tickets = []
 
-    filters_active = any(key != '_' for key in request.args.keys())
-    return render_template('client/client_tickets.html', title='Mis Tickets', tickets=tickets, form=form, status_map=status_map, category_map=category_map, filters_active=filters_active)
+    filters_active = any(key != '_' for key in strip_pagination_args(request.args).keys())
+    return render_template('client/client_tickets.html', title='Mis Tickets', tickets=tickets, form=form, status_map=status_map, category_map=category_map, filters_active=filters_active, page=page)
 
 @client_bp.route('/client/ticket/<string:ticket_id>/manage', methods=['GET', 'POST'])
 @login_required
@@ -224,9 +135,9 @@ def client_manage_completed_ticket(ticket_id):
     category_map = {}
 
     try:
-        statuses = list(mongo.db.statuses.find().sort("name", 1))
+        statuses = get_statuses()
         status_map = {s['value']: s['name'] for s in statuses}
-        categories = list(mongo.db.categories.find())
+        categories = get_categories()
         category_map = {c['value']: c['name'] for c in categories}
     except pymongo.errors.PyMongoError as e:
         logger.error(f"Error al cargar datos para la página de gestión: {e}")
@@ -234,19 +145,23 @@ def client_manage_completed_ticket(ticket_id):
 
     if form.validate_on_submit():
         try:
-            rejected_status = mongo.db.statuses.find_one({"value": "rejected"})
+            rejected_status = get_status("rejected")
             if not rejected_status:
                 flash('Error: El estado "Rechazado" no está configurado.', 'danger')
                 return redirect(url_for('client_bp.client_tickets'))
 
-            update_data = {
-                "status_value": rejected_status['value'],
-                "updated_at": datetime.now(timezone.utc)
-            }
-            mongo.db.tickets.update_one({"_id": ObjectId(ticket_id)}, {"$set": update_data})
+            # El motivo del rechazo queda en el historial y se añade al índice de búsqueda.
+            # El filtro incluye el estado leído para que la transición solo se cuente una vez.
+            updated = update_ticket(
+                ticket, current_user, "Rechazo de Resolución", form.note.data,
+                set_fields={"status_value": rejected_status['value']},
+                search_text=form.note.data,
+                expected={"status_value": ticket['status_value']}
+            )
+            if not updated:
+                flash('El ticket ha cambiado mientras lo gestionabas. Revisa su estado actual.', 'warning')
+                return redirect(url_for('client_bp.client_tickets'))
 
-            log_ticket_history(ticket_id, "Rechazo de Resolución", current_user, form.note.data)
-            
             flash(f'Ticket #{ticket_id} rechazado exitosamente. El operador ha sido notificado.', 'success')
             return redirect(url_for('client_bp.client_tickets'))
 
@@ -281,7 +196,7 @@ def client_add_description(ticket_id):
     is_ticket_editable_by_client = (ticket['status_value'] not in ['completed', 'closed', 'cancelled'])
 
     try:
-        statuses = list(mongo.db.statuses.find().sort("name", 1))
+        statuses = get_statuses()
         status_map = {s['value']: s['name'] for s in statuses}
     except pymongo.errors.PyMongoError as e:
         logger.error(f"Error al cargar estados: {e}")
@@ -294,13 +209,11 @@ def client_add_description(ticket_id):
             # Añadir la nueva descripción al campo existente o crear uno nuevo
             updated_description = ticket.get('description', '') + f"\n\n--- Nota de {current_user.username} ({datetime.now(timezone.utc).strftime('%d/%m/%Y %H:%M')}) ---\n{new_text}"
             
-            update_data = {
-                "description": updated_description,
-                "updated_at": datetime.now(timezone.utc)
-            }
-            mongo.db.tickets.update_one({"_id": ObjectId(ticket_id)}, {"$set": update_data})
-
-            log_ticket_history(ticket_id, "Nota adicional del cliente", current_user, f"Cliente añadió nota: {new_text}")
+            update_ticket(
+                ticket, current_user, "Nota adicional del cliente", f"Cliente añadió nota: {new_text}",
+                set_fields={"description": updated_description},
+                search_text=new_text
+            )
 
             flash('Nota agregada exitosamente al ticket.', 'success')
             return redirect(url_for('client_bp.client_tickets'))
@@ -331,7 +244,7 @@ def close_ticket(ticket_id):
         return redirect(url_for('client_bp.client_tickets'))
 
     try:
-        closed_status = mongo.db.statuses.find_one({"value": "closed"})
+        closed_status = get_status("closed")
         if not closed_status:
             flash('Error: El estado "Cerrado" no está configurado.', 'danger')
             return redirect(url_for('client_bp.client_tickets'))
@@ -342,12 +255,16 @@ def close_ticket(ticket_id):
 
         update_data = {
             "status_value": closed_status['value'],
-            "description": updated_description,
-            "updated_at": datetime.now(timezone.utc)
+            "description": updated_description
         }
-        mongo.db.tickets.update_one({"_id": ObjectId(ticket_id)}, {"$set": update_data})
-
-        log_ticket_history(ticket_id, "Ticket cerrado por el cliente", current_user, "Cliente da conformidad al cierre.")
+        updated = update_ticket(
+            ticket, current_user, "Ticket cerrado por el cliente", "Cliente da conformidad al cierre.",
+            set_fields=update_data,
+            expected={"status_value": ticket['status_value']}
+        )
+        if not updated:
+            flash('El ticket ha cambiado entretanto. Revisa su estado actual.', 'warning')
+            return redirect(url_for('client_bp.client_tickets'))
 
         # --- ENVÍO DE CORREO AL OPERADOR ---
         # Adaptar la lógica de envío de correo para usar los datos del ticket de MongoDB
@@ -1,11 +1,23 @@
 # app/commands.py
 
+from flask import current_app
 from flask.cli import with_appcontext
 from app import mongo
 from app.auth.models import Persona
+from app.auth.passwords import hash_passwords, calibrate_password_cost, DEFAULT_TARGET_MS
+from app.indexes import ensure_indexes, explain_route_queries
+from app.search import ticket_search_fields, load_search_notes
+from app.ticket_ids import reserve_block
+from app.export_jobs import process_export_job, purge_expired_exports
+from app.ticket_stats import rebuild_ticket_stats
+from app.email import process_outbox, outbox_metrics, DEFAULT_BATCH_SIZE as MAIL_BATCH_SIZE
+from app.notifications import flush_due_digests
 import click
 import pymongo
+from pymongo import UpdateOne
+from bson.objectid import ObjectId
 import secrets
+import time
 import string
 from datetime import datetime
 
@@ -74,38 +86,331 @@ def init_db_data_command():
             {'username': 'cliente', 'name': 'Cliente', 'firstSurname': 'Demo', 'email': 'cliente@example.com', 'role': 'cliente'},
         ]
 
+        new_users = []
         for user_data_item in users_to_create_data:
-            username = user_data_item['username']
-            if not mongo.db.personas.find_one({"username": username}):
-                print(f"Creando usuario '{username}'...")
-                
-                alphabet = string.ascii_letters + string.digits + string.punctuation
-                password = ''.join(secrets.choice(alphabet) for i in range(12))
-                
-                user = Persona(
-                    username=username,
-                    name=user_data_item['name'],
-                    firstSurname=user_data_item['firstSurname'],
-                    email=user_data_item['email'],
-                    role=user_data_item['role'],
-                    password=password,
-                    password_changed_at=datetime.utcnow(),
-                    two_factor_code=None,
-                    two_factor_code_expiration=None
-                )
-                
-                user_dict = user.__dict__
-                user_dict.pop("id", None)
-                mongo.db.personas.insert_one(user_dict)
-                
-                print(f"Usuario '{username}' creado con éxito.")
-                print(f"  -> Contraseña para '{username}': {password}")
+            if mongo.db.personas.find_one({"username": user_data_item['username']}):
+                print(f"El usuario '{user_data_item['username']}' ya existe.")
             else:
-                print(f"El usuario '{username}' ya existe.")
+                new_users.append(user_data_item)
+
+        # Los hashes de todas las contraseñas se calculan en paralelo (pool de app/auth/passwords.py)
+        alphabet = string.ascii_letters + string.digits + string.punctuation
+        passwords = [''.join(secrets.choice(alphabet) for i in range(12)) for _ in new_users]
+        password_hashes = hash_passwords(passwords)
+
+        for user_data_item, password, password_hash in zip(new_users, passwords, password_hashes):
+            username = user_data_item['username']
+            print(f"Creando usuario '{username}'...")
+
+            user = Persona(
+                username=username,
+                name=user_data_item['name'],
+                firstSurname=user_data_item['firstSurname'],
+                email=user_data_item['email'],
+                role=user_data_item['role'],
+                password_hash=password_hash,
+                password_changed_at=datetime.utcnow(),
+                two_factor_code=None,
+                two_factor_code_expiration=None
+            )
+
+            user_dict = user.__dict__
+            user_dict.pop("id", None)
+            mongo.db.personas.insert_one(user_dict)
+
+            print(f"Usuario '{username}' creado con éxito.")
+            print(f"  -> Contraseña para '{username}': {password}")
 
         print("\nCarga de datos iniciales finalizada con éxito.")
 
     except pymongo.errors.PyMongoError as e:
         print(f"\nERROR: Ocurrió un error de base de datos durante la inicialización: {e}")
     except Exception as e:
-        print(f"\nERROR: Ocurrió un error inesperado durante la inicialización: {e}")
\ No newline at end of file
+        print(f"\nERROR: Ocurrió un error inesperado durante la inicialización: {e}")
+
+@click.command("ensure-indexes")
+@with_appcontext
+def ensure_indexes_command():
+    """Crea los índices declarados en app/indexes.py y muestra qué consultas de las rutas siguen haciendo COLLSCAN."""
+    print("Creando índices de MongoDB (en segundo plano)...")
+
+    try:
+        for collection_name, index_name, error in ensure_indexes(mongo.db):
+            if error:
+                print(f"  [ERROR] {collection_name}.{index_name}: {error}")
+            else:
+                print(f"  [OK]    {collection_name}.{index_name}")
+
+        print("\nInforme de explain() de las consultas de las rutas:")
+        collscan_routes = []
+        for route, stages, error in explain_route_queries(mongo.db):
+            if error:
+                print(f"  [??]       {route}: no se pudo ejecutar explain() ({error})")
+            elif "COLLSCAN" in stages:
+                collscan_routes.append(route)
+                print(f"  [COLLSCAN] {route}")
+            else:
+                print(f"  [IXSCAN]   {route} ({', '.join(sorted(stages))})")
+
+        if collscan_routes:
+            print(f"\n{len(collscan_routes)} consulta(s) siguen recorriendo la colección completa.")
+        else:
+            print("\nTodas las consultas analizadas usan índices.")
+
+    except pymongo.errors.PyMongoError as e:
+        print(f"\nERROR: Ocurrió un error de base de datos al crear los índices: {e}")
+
+
+@click.command("migrate-ticket-history")
+@click.option("--batch-size", default=500, show_default=True, help="Número de tickets procesados por lote.")
+@with_appcontext
+def migrate_ticket_history_command(batch_size):
+    """Mueve el historial embebido en 'tickets.history' a la colección 'ticket_history'."""
+    print("Migrando el historial embebido de los tickets a la colección 'ticket_history'...")
+
+    def flush(entries, ticket_ids):
+        # Primero se escriben las entradas y solo después se elimina el array embebido,
+        # de modo que una interrupción nunca pierde historial. Las entradas conservan su
+        # 'entry_id' como _id, así que relanzar el comando no crea duplicados: los errores
+        # de clave duplicada de entradas ya migradas se ignoran.
+        if entries:
+            try:
+                mongo.db.ticket_history.insert_many(entries, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+        mongo.db.tickets.update_many({"_id": {"$in": ticket_ids}}, {"$unset": {"history": ""}})
+
+    try:
+        migrated_tickets = 0
+        migrated_entries = 0
+        entries = []
+        ticket_ids = []
+
+        cursor = mongo.db.tickets.find({"history": {"$exists": True}}, {"history": 1}).batch_size(batch_size)
+        for ticket in cursor:
+            for entry in ticket.get("history") or []:
+                entry = dict(entry)
+                entry["_id"] = entry.pop("entry_id", None) or ObjectId()
+                entry["ticket_id"] = ticket["_id"]
+                entries.append(entry)
+            ticket_ids.append(ticket["_id"])
+
+            if len(ticket_ids) >= batch_size:
+                flush(entries, ticket_ids)
+                migrated_tickets += len(ticket_ids)
+                migrated_entries += len(entries)
+                print(f"  {migrated_tickets} tickets migrados ({migrated_entries} entradas)...")
+                entries, ticket_ids = [], []
+
+        if ticket_ids:
+            flush(entries, ticket_ids)
+            migrated_tickets += len(ticket_ids)
+            migrated_entries += len(entries)
+
+        print(f"\nMigración finalizada: {migrated_tickets} tickets, {migrated_entries} entradas de historial.")
+
+    except pymongo.errors.PyMongoError as e:
+        print(f"\nERROR: Ocurrió un error de base de datos durante la migración: {e}")
+
+
+@click.command("reindex-ticket-search")
+@click.option("--batch-size", default=500, show_default=True, help="Número de tickets procesados por lote.")
+@with_appcontext
+def reindex_ticket_search_command(batch_size):
+    """Recalcula el índice de búsqueda ('title_tokens' y 'search_tokens') de todos los tickets."""
+    print("Recalculando el índice de búsqueda de los tickets...")
+
+    def flush(tickets):
+        notes = load_search_notes(mongo.db, [t["_id"] for t in tickets])
+
+        operations = [
+            UpdateOne({"_id": t["_id"]}, {"$set": ticket_search_fields(
+                t.get("title", ""), t.get("description", ""), t.get("observation", ""), notes.get(t["_id"], [])
+            )})
+            for t in tickets
+        ]
+        mongo.db.tickets.bulk_write(operations, ordered=False)
+
+    try:
+        indexed = 0
+        batch = []
+        cursor = mongo.db.tickets.find({}, {"title": 1, "description": 1, "observation": 1}).batch_size(batch_size)
+        for ticket in cursor:
+            batch.append(ticket)
+            if len(batch) >= batch_size:
+                flush(batch)
+                indexed += len(batch)
+                print(f"  {indexed} tickets indexados...")
+                batch = []
+
+        if batch:
+            flush(batch)
+            indexed += len(batch)
+
+        print(f"\nÍndice de búsqueda recalculado para {indexed} tickets.")
+
+    except pymongo.errors.PyMongoError as e:
+        print(f"\nERROR: Ocurrió un error de base de datos al recalcular el índice de búsqueda: {e}")
+
+
+@click.command("backfill-ticket-numbers")
+@click.option("--batch-size", default=500, show_default=True, help="Número de tickets procesados por lote.")
+@with_appcontext
+def backfill_ticket_numbers_command(batch_size):
+    """Asigna un número de ticket ('ticket_number') a los tickets que aún no lo tienen, por orden de creación."""
+    print("Asignando números a los tickets existentes...")
+    try:
+        numbered = 0
+        while True:
+            batch = list(mongo.db.tickets.find({"ticket_number": {"$exists": False}}, {"_id": 1})
+                         .sort([("created_at", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)])
+                         .limit(batch_size))
+            if not batch:
+                break
+
+            # Un bloque del contador por lote: los números no chocan con los de las altas en curso
+            first, _ = reserve_block(mongo.db, len(batch))
+            operations = [
+                UpdateOne({"_id": ticket["_id"], "ticket_number": {"$exists": False}}, {"$set": {"ticket_number": first + i}})
+                for i, ticket in enumerate(batch)
+            ]
+            mongo.db.tickets.bulk_write(operations, ordered=False)
+            numbered += len(batch)
+            print(f"  {numbered} tickets numerados...")
+
+        print(f"\nNumeración finalizada: {numbered} tickets.")
+
+    except pymongo.errors.PyMongoError as e:
+        print(f"\nERROR: Ocurrió un error de base de datos al numerar los tickets: {e}")
+
+
+@click.command("backfill-username-lower")
+@click.option("--batch-size", default=500, show_default=True, help="Número de tickets procesados por lote.")
+@with_appcontext
+def backfill_username_lower_command(batch_size):
+    """Añade 'username_lower' a los subdocumentos creator/operator/supervisor de los tickets existentes."""
+    print("Normalizando los nombres de usuario de los tickets...")
+    roles = ("creator", "operator", "supervisor")
+    # Tickets con algún usuario asignado al que todavía le falta la copia normalizada
+    pending = {"$or": [
+        {f"{role}.username": {"$type": "string"}, f"{role}.username_lower": {"$exists": False}} for role in roles
+    ]}
+    try:
+        updated = 0
+        last_id = None
+        while True:
+            query = pending if last_id is None else {"$and": [pending, {"_id": {"$gt": last_id}}]}
+            batch = list(mongo.db.tickets.find(query, {role: 1 for role in roles}).sort("_id", pymongo.ASCENDING).limit(batch_size))
+            if not batch:
+                break
+
+            operations = []
+            for ticket in batch:
+                changes = {
+                    f"{role}.username_lower": ticket[role]["username"].lower()
+                    for role in roles
+                    if isinstance(ticket.get(role), dict) and isinstance(ticket[role].get("username"), str)
+                }
+                operations.append(UpdateOne({"_id": ticket["_id"]}, {"$set": changes}))
+            mongo.db.tickets.bulk_write(operations, ordered=False)
+
+            updated += len(batch)
+            last_id = batch[-1]["_id"]
+            print(f"  {updated} tickets actualizados...")
+
+        print(f"\nNormalización finalizada: {updated} tickets.")
+
+    except pymongo.errors.PyMongoError as e:
+        print(f"\nERROR: Ocurrió un error de base de datos al normalizar los nombres de usuario: {e}")
+
+
+@click.command("process-export-jobs")
+@click.option("--limit", default=0, show_default=True, help="Máximo de trabajos a procesar (0 = todos los pendientes).")
+@with_appcontext
+def process_export_jobs_command(limit):
+    """Borra las exportaciones caducadas y procesa los trabajos pendientes o con la concesión vencida."""
+    try:
+        purged = purge_expired_exports(mongo.db)
+        if purged:
+            print(f"{purged} exportaciones caducadas borradas.")
+
+        processed = 0
+        while not limit or processed < limit:
+            job = process_export_job(mongo.db)
+            if job is None:
+                break
+            processed += 1
+            print(f"  Trabajo {job['_id']} ({job['format']}) procesado.")
+
+        print(f"\n{processed} trabajos de exportación procesados.")
+
+    except pymongo.errors.PyMongoError as e:
+        print(f"\nERROR: Ocurrió un error de base de datos al procesar las exportaciones: {e}")
+
+
+@click.command("reconcile-ticket-stats")
+@with_appcontext
+def reconcile_ticket_stats_command():
+    """Reconstruye los contadores de tickets por estado y categoría ('ticket_stats') desde cero."""
+    try:
+        stats = rebuild_ticket_stats(mongo.db)
+        print(f"Contadores reconstruidos: {stats['total']} tickets.")
+        for value, count in sorted(stats["by_status"].items()):
+            print(f"  {value}: {count}")
+
+    except pymongo.errors.PyMongoError as e:
+        print(f"\nERROR: Ocurrió un error de base de datos al reconstruir los contadores: {e}")
+
+
+@click.command("run-mail-worker")
+@click.option("--batch-size", default=MAIL_BATCH_SIZE, show_default=True, help="Correos reclamados y enviados por conexión SMTP.")
+@click.option("--poll-interval", default=5.0, show_default=True, help="Segundos de espera cuando la bandeja está vacía.")
+@click.option("--once", is_flag=True, help="Vacía la bandeja de salida y termina (p. ej. desde un cron).")
+@with_appcontext
+def run_mail_worker_command(batch_size, poll_interval, once):
+    """Envía los correos de la bandeja de salida ('email_outbox'), con reintentos, y los resúmenes de notificaciones."""
+    total_sent = total_failed = 0
+    try:
+        while True:
+            try:
+                digests = flush_due_digests(mongo.db)
+                if digests:
+                    print(f"  {digests} resúmenes de notificaciones encolados.")
+                sent, failed = process_outbox(mongo.db, batch_size)
+            except pymongo.errors.PyMongoError as e:
+                print(f"ERROR: Ocurrió un error de base de datos al leer la bandeja de salida: {e}")
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                print(f"  Lote: {sent} enviados, {failed} fallidos.")
+            elif once:
+                break
+            else:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+    print(f"\n{total_sent} correos enviados, {total_failed} fallidos.")
+    try:
+        pending = outbox_metrics(mongo.db)
+        print("Bandeja de salida: " + ", ".join(f"{status}: {count}" for status, count in sorted(pending.items())))
+    except pymongo.errors.PyMongoError:
+        pass
+
+
+@click.command("calibrate-password-cost")
+@click.option("--target-ms", type=int, default=None, help="Milisegundos por hash (por defecto, PASSWORD_HASH_TARGET_MS).")
+@with_appcontext
+def calibrate_password_cost_command(target_ms):
+    """Mide en esta máquina el coste de hash de contraseñas y muestra el valor para PASSWORD_HASH_COST."""
+    target_ms = target_ms if target_ms is not None else current_app.config.get("PASSWORD_HASH_TARGET_MS", DEFAULT_TARGET_MS)
+    print(f"Calibrando el coste de hash de contraseñas (objetivo {target_ms} ms)...")
+    start = time.perf_counter()
+    cost = calibrate_password_cost(target_ms)
+    print(f"Calibración terminada en {(time.perf_counter() - start) * 1000:.0f} ms.")
+    print(f"PASSWORD_HASH_COST={cost}")
@@ -1,28 +1,339 @@
 from flask_mail import Message
-from app import mail # Importa la instancia de Mail de tu app principal
-from flask import render_template, current_app # CAMBIO CLAVE: Importar url_for aquí también
+from app import mail, mongo # Importa la instancia de Mail de tu app principal
+from flask import render_template, current_app, request, has_request_context
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from bson.objectid import ObjectId
+import atexit
+import logging
+import queue
 import threading
 
-def send_email_async(app, msg):
-    """Función auxiliar para enviar correos en un hilo separado."""
-    with app.app_context():
+logger = logging.getLogger(__name__)
+
+# --- Bandeja de salida de correo ---
+# Ningún correo se envía ni se renderiza durante la petición: queue_email() guarda en la
+# colección 'email_outbox' el asunto, los destinatarios, la plantilla y su contexto, y
+# vuelve. Así un correo no se pierde si el proceso termina (Cloud Run escala a cero, un
+# worker de gunicorn se reinicia) antes de enviarlo.
+#
+# Un correo se reclama con find_one_and_update (pendiente -> enviando), que además aplaza
+# su next_attempt_at LEASE_SECONDS: si el proceso que lo reclamó muere, otro lo vuelve a
+# reclamar pasado ese tiempo. Se reclaman por prioridad (PRIORITY_HIGH para los códigos
+# 2FA y el restablecimiento de contraseña, antes que las notificaciones) y por antigüedad.
+# Si el envío falla se reintenta con espera exponencial (MAIL_RETRY_SECONDS, el doble en
+# cada intento) hasta MAIL_MAX_ATTEMPTS intentos; después queda en estado 'error'.
+#
+# Quién envía:
+#   - `flask run-mail-worker` atiende la bandeja de forma continua (o la vacía con --once);
+#   - además, cada proceso web tiene una cola acotada (MAIL_QUEUE_SIZE) con MAIL_WORKERS
+#     hilos a los que se avisa de cada correo nuevo para enviarlo enseguida. Si la cola está
+#     llena el aviso se descarta, pero el correo sigue en la bandeja para el worker.
+# Ambos envían por una misma conexión SMTP (mail.connect()) hasta MAIL_BATCH_SIZE correos.
+# Con MAIL_WORKERS = 0 no hay hilos y solo envía el worker (tests, scripts).
+
+OUTBOX_COLLECTION = "email_outbox"
+
+STATUS_PENDING = "pendiente"
+STATUS_SENDING = "enviando"
+STATUS_SENT = "enviado"
+STATUS_FAILED = "error"
+
+# Menor valor = antes
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 500
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_QUEUE_TIMEOUT = 2
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_RETRY_SECONDS = 30
+MAX_RETRY_SECONDS = 3600
+LEASE_SECONDS = 300
+DRAIN_TIMEOUT = 30
+
+_STOP = object()
+
+
+def outbox_document(subject, recipients, template, text_template=None, priority=PRIORITY_NORMAL, sender=None,
+                    base_url=None, **context):
+    """
+    Documento de la bandeja de salida para un correo (con su _id ya asignado), sin guardarlo.
+    Las plantillas se renderizan al enviarlo, así que `context` debe poder guardarse en
+    MongoDB (diccionarios, no objetos Persona). `base_url` es la URL de los enlaces; por
+    defecto, la de la petición actual.
+    """
+    now = datetime.now(timezone.utc)
+    return {
+        "_id": ObjectId(),
+        "subject": subject,
+        "recipients": list(recipients),
+        "sender": sender or current_app.config.get('MAIL_DEFAULT_SENDER') or current_app.config.get('MAIL_USERNAME'),
+        "template": template,
+        "text_template": text_template,
+        "context": context,
+        # Los enlaces (url_for(..., _external=True)) se construyen con la URL de esta petición
+        "base_url": base_url or (request.url_root if has_request_context() else None),
+        "priority": priority,
+        "status": STATUS_PENDING,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now,
+    }
+
+
+def dispatch_email(email_id):
+    """Avisa a los hilos de envío de este proceso de un correo ya guardado en la bandeja."""
+    if current_app.config.get("MAIL_WORKERS", DEFAULT_WORKERS):
+        _mail_queue().submit(email_id)
+
+
+def queue_email(subject, recipients, template, **kwargs):
+    """Guarda un correo en la bandeja de salida (ver outbox_document) y devuelve su _id."""
+    email = outbox_document(subject, recipients, template, **kwargs)
+    mongo.db[OUTBOX_COLLECTION].insert_one(email)
+    dispatch_email(email["_id"])
+    return email["_id"]
+
+
+def claim_emails(db, limit, email_id=None):
+    """Reclama hasta `limit` correos listos para enviar (o solo `email_id`), por prioridad y antigüedad."""
+    now = datetime.now(timezone.utc)
+    query = {"status": {"$in": [STATUS_PENDING, STATUS_SENDING]}, "next_attempt_at": {"$lte": now}}
+    if email_id is not None:
+        query["_id"] = email_id
+    claimed = []
+    while len(claimed) < limit:
+        email = db[OUTBOX_COLLECTION].find_one_and_update(
+            query,
+            {"$set": {"status": STATUS_SENDING, "next_attempt_at": now + timedelta(seconds=LEASE_SECONDS)},
+             "$inc": {"attempts": 1}},
+            sort=[("priority", 1), ("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if email is None:
+            break
+        claimed.append(email)
+    return claimed
+
+
+def build_message(email):
+    """Renderiza las plantillas de un correo de la bandeja y devuelve el Message."""
+    with current_app.test_request_context(base_url=email.get("base_url")):
+        msg = Message(email["subject"], sender=email["sender"], recipients=email["recipients"])
+        msg.html = render_template(email["template"], **email.get("context", {}))
+        if email.get("text_template"):
+            msg.body = render_template(email["text_template"], **email.get("context", {}))
+    return msg
+
+
+def retry_delay(attempts):
+    """Espera antes del siguiente intento tras `attempts` intentos fallidos."""
+    base = current_app.config.get("MAIL_RETRY_SECONDS", DEFAULT_RETRY_SECONDS)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), MAX_RETRY_SECONDS))
+
+
+def _mark_sent(db, email):
+    # El contexto puede llevar códigos 2FA o tokens: no se conserva una vez enviado.
+    db[OUTBOX_COLLECTION].update_one(
+        {"_id": email["_id"]},
+        {"$set": {"status": STATUS_SENT, "sent_at": datetime.now(timezone.utc)}, "$unset": {"context": ""}}
+    )
+
+
+def _mark_failed(db, email, error):
+    attempts = email.get("attempts", 1)
+    if attempts >= current_app.config.get("MAIL_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS):
+        # Como al enviarlo, el contexto (códigos 2FA, tokens) no se conserva si ya no se reintentará
+        update = {"$set": {"status": STATUS_FAILED, "last_error": str(error)}, "$unset": {"context": ""}}
+        logger.error(f"Correo '{email['subject']}' para {email['recipients']} descartado tras {attempts} intentos: {error}")
+    else:
+        update = {"$set": {"status": STATUS_PENDING, "last_error": str(error),
+                           "next_attempt_at": datetime.now(timezone.utc) + retry_delay(attempts)}}
+        logger.warning(f"Error al enviar correo '{email['subject']}' a {email['recipients']} (intento {attempts}): {error}")
+    db[OUTBOX_COLLECTION].update_one({"_id": email["_id"]}, update)
+
+
+def deliver_emails(db, emails):
+    """
+    Envía correos ya reclamados por una misma conexión SMTP. Si uno falla, se programa su
+    reintento y el resto se envía con una conexión nueva. Un error al marcar como enviado un
+    correo que ya salió solo se registra: no cuenta como fallo ni provoca un reintento.
+    Devuelve (enviados, fallidos).
+    """
+    pending = list(emails)
+    sent = failed = 0
+    while pending:
         try:
-            mail.send(msg)
-            app.logger.info(f"Correo '{msg.subject}' enviado exitosamente a {msg.recipients}.")
+            with mail.connect() as connection:
+                while pending:
+                    connection.send(build_message(pending[0]))
+                    email = pending.pop(0)
+                    sent += 1
+                    logger.info(f"Correo '{email['subject']}' enviado exitosamente a {email['recipients']}.")
+                    try:
+                        _mark_sent(db, email)
+                    except Exception as e:
+                        logger.error(f"Correo {email['_id']} enviado, pero no se pudo marcar como enviado: {e}")
         except Exception as e:
-            current_app.logger.error(f"Error asíncrono al enviar correo '{msg.subject}' a {msg.recipients}: {str(e)}", exc_info=True)
+            if not pending:
+                # Ya se enviaron todos: el error es al cerrar la conexión
+                logger.warning(f"Error al cerrar la conexión SMTP: {e}")
+                break
+            email = pending.pop(0)
+            _mark_failed(db, email, e)
+            failed += 1
+    return sent, failed
+
+
+def process_outbox(db, batch_size=DEFAULT_BATCH_SIZE):
+    """Reclama y envía un lote de la bandeja de salida. Devuelve (enviados, fallidos)."""
+    return deliver_emails(db, claim_emails(db, batch_size))
+
+
+class MailQueue:
+    """Hilos que envían enseguida los correos nuevos de este proceso (ver arriba)."""
+
+    def __init__(self, app, workers=DEFAULT_WORKERS, maxsize=DEFAULT_QUEUE_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE, put_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._closed = False
+        self._counters = {"enqueued": 0, "sent": 0, "failed": 0, "rejected": 0, "high_water": 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"mail-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        atexit.register(self.shutdown)
+
+    def submit(self, email_id):
+        """
+        Avisa a los hilos de un correo nuevo de la bandeja. Devuelve False si la cola sigue
+        llena tras esperar put_timeout segundos; el correo lo enviará entonces el worker.
+        """
+        if self._closed:
+            self._count("rejected")
+            return False
+        self._start()
+        try:
+            self._queue.put(email_id, timeout=self.put_timeout)
+        except queue.Full:
+            self._count("rejected")
+            logger.warning(f"Cola de correo llena ({self._queue.maxsize}): el correo {email_id} queda para el worker.")
+            return False
+        depth = self._queue.qsize()
+        with self._lock:
+            self._counters["enqueued"] += 1
+            self._counters["high_water"] = max(self._counters["high_water"], depth)
+        if depth >= self._queue.maxsize * 0.8:
+            logger.warning(f"Cola de correo al {depth}/{self._queue.maxsize}.")
+        return True
+
+    def _next_batch(self, first):
+        """El aviso recibido más los que ya estén esperando, hasta batch_size."""
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                email_id = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if email_id is _STOP:
+                # Se devuelve a la cola para que este hilo termine tras el lote
+                self._queue.task_done()
+                self._queue.put(_STOP)
+                break
+            batch.append(email_id)
+        return batch
+
+    def _send_batch(self, batch):
+        db = mongo.db
+        # Un correo que ya reclamó otro proceso (p. ej. el worker) se omite
+        emails = [email for email_id in batch for email in claim_emails(db, 1, email_id=email_id)]
+        sent, failed = deliver_emails(db, emails)
+        self._count("sent", sent)
+        self._count("failed", failed)
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                first = self._queue.get()
+                if first is _STOP:
+                    self._queue.task_done()
+                    return
+                batch = self._next_batch(first)
+                try:
+                    self._send_batch(batch)
+                except Exception as e:
+                    logger.error(f"Error al enviar un lote de correos: {e}", exc_info=True)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+
+    def metrics(self):
+        with self._lock:
+            return {**self._counters, "depth": self._queue.qsize(), "maxsize": self._queue.maxsize, "workers": len(self._threads)}
+
+    def shutdown(self, timeout=DRAIN_TIMEOUT):
+        """Deja de aceptar avisos y espera (hasta `timeout` segundos) a que se envíen los pendientes."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            threads = list(self._threads)
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join(timeout)
+        metrics = self.metrics()
+        logger.info(f"Cola de correo cerrada: {metrics['sent']} enviados, {metrics['failed']} fallidos, "
+                    f"{metrics['rejected']} rechazados, ocupación máxima {metrics['high_water']}/{metrics['maxsize']}.")
+        if metrics["depth"]:
+            logger.warning(f"Cola de correo cerrada con {metrics['depth']} avisos sin atender; los enviará el worker.")
+
+
+def _mail_queue():
+    mail_queue = current_app.extensions.get("mail_queue")
+    if mail_queue is None:
+        mail_queue = MailQueue(
+            current_app._get_current_object(),
+            workers=current_app.config.get("MAIL_WORKERS", DEFAULT_WORKERS),
+            maxsize=current_app.config.get("MAIL_QUEUE_SIZE", DEFAULT_QUEUE_SIZE),
+            batch_size=current_app.config.get("MAIL_BATCH_SIZE", DEFAULT_BATCH_SIZE),
+            put_timeout=current_app.config.get("MAIL_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)
+        )
+        current_app.extensions["mail_queue"] = mail_queue
+    return mail_queue
+
+
+def outbox_metrics(db):
+    """Número de correos de la bandeja de salida por estado."""
+    return {group["_id"]: group["count"] for group in db[OUTBOX_COLLECTION].aggregate([
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ])}
+
 
 def send_notification_email(subject, recipients, template, **kwargs):
     """
-    Función de utilidad para enviar correos electrónicos.
+    Función de utilidad para enviar correos electrónicos (notificaciones, prioridad normal).
     """
-    msg = Message(subject,
-                  sender=current_app.config['MAIL_DEFAULT_SENDER'] or current_app.config['MAIL_USERNAME'],
-                  recipients=recipients)
-    msg.html = render_template(template, **kwargs)
-    
-    threading.Thread(target=send_email_async, args=(current_app._get_current_object(), msg)).start()
-    current_app.logger.debug(f"Email '{subject}' en cola para: {recipients}")
+    email_id = queue_email(subject, recipients, template, **kwargs)
+    current_app.logger.debug(f"Email '{subject}' en la bandeja de salida ({email_id}) para: {recipients}")
+    return email_id
 
 def send_password_reset_email(user):
     token = user.get_reset_password_token()
@@ -30,6 +341,7 @@ def send_password_reset_email(user):
         subject='Restablecer Contraseña - [TuApp]',
         recipients=[user.email],
         template='email/reset_password.html',
-        user=user,
+        priority=PRIORITY_HIGH,
+        user={"username": user.username},
         token=token
-    )
\ No newline at end of file
+    )
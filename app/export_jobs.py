@@ -0,0 +1,273 @@
+# app/export_jobs.py
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import gridfs
+import pymongo
+from bson import json_util
+from bson.objectid import ObjectId
+from flask import current_app, url_for, has_request_context
+from pymongo import ReturnDocument
+from app import mongo
+from app.email import send_notification_email
+from app.exports import (write_xlsx, iter_csv, iter_ndjson, gzip_chunks, spooled_file,
+                         EXPORT_BATCH_SIZE, XLSX_MIMETYPE, CSV_MIMETYPE, NDJSON_MIMETYPE, GZIP_MIMETYPE)
+from app.pagination import TICKET_SORT
+from app.projections import EXPORT_PROJECTION
+from app.reference_data import get_category_map, get_status_map
+
+logger = logging.getLogger(__name__)
+
+# --- Exportaciones en segundo plano ---
+# Las exportaciones muy grandes no se generan en la petición: la ruta registra un trabajo
+# en 'export_jobs' (con la consulta ya construida, incluida la restricción de visibilidad
+# del supervisor) y un pool de hilos del proceso lo ejecuta. El progreso se guarda en el
+# propio documento y el fichero terminado se guarda en GridFS (bucket 'export_files')
+# hasta 'expires_at'; purge_expired_exports() borra los ficheros y trabajos caducados.
+#
+# Un trabajo se reclama con find_one_and_update (pendiente -> en_proceso), así que lo
+# ejecuta un único proceso aunque haya varios. Al reclamarlo se le da una concesión de
+# LEASE_SECONDS que se renueva con cada actualización del progreso: si el proceso muere a
+# mitad, la concesión vence y otro proceso lo vuelve a reclamar. Tras EXPORT_JOB_MAX_ATTEMPTS
+# intentos el trabajo queda en 'error'. Con EXPORT_JOB_WORKERS = 0 no se crea el pool y los
+# trabajos se procesan con `flask process-export-jobs` (p. ej. desde un cron).
+
+JOBS_COLLECTION = "export_jobs"
+FILES_COLLECTION = "export_files"
+
+STATUS_PENDING = "pendiente"
+STATUS_RUNNING = "en_proceso"
+STATUS_DONE = "completado"
+STATUS_FAILED = "error"
+
+DEFAULT_WORKERS = 2
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_ATTEMPTS = 3
+LEASE_SECONDS = 600
+
+# Formatos: (extensión, mimetype)
+FORMATS = {
+    "xlsx": ("xlsx", XLSX_MIMETYPE),
+    "csv": ("csv", CSV_MIMETYPE),
+    "ndjson": ("ndjson", NDJSON_MIMETYPE),
+}
+
+
+def _files(db):
+    return gridfs.GridFS(db, collection=FILES_COLLECTION)
+
+
+def _executor():
+    """Pool de hilos de la aplicación actual, o None si EXPORT_JOB_WORKERS es 0."""
+    workers = current_app.config.get("EXPORT_JOB_WORKERS", DEFAULT_WORKERS)
+    if not workers:
+        return None
+    executor = current_app.extensions.get("export_jobs")
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export-job")
+        current_app.extensions["export_jobs"] = executor
+    return executor
+
+
+def create_export_job(db, query, export_format, user, gzip=False, notify_email=None, filters=None):
+    """
+    Registra un trabajo de exportación pendiente y lo envía al pool (si existe).
+    `query` es la consulta final sobre 'tickets'; se guarda serializada con json_util
+    porque contiene operadores ($and, $or...) que no pueden ser claves de un documento.
+    Devuelve el _id del trabajo.
+    """
+    purge_expired_exports(db)
+    job_id = ObjectId()
+    # El enlace del correo se construye aquí: el hilo que termina el trabajo no tiene petición.
+    status_url = url_for('admin_bp.export_job_status', job_id=str(job_id), _external=True) if has_request_context() else None
+    job = {
+        "_id": job_id,
+        "status": STATUS_PENDING,
+        "format": export_format,
+        "gzip": bool(gzip) and export_format != "xlsx",
+        "query": json_util.dumps(query),
+        "filters": filters or {},
+        "requested_by": {"user_id": ObjectId(user.id), "username": user.username},
+        "notify_email": notify_email,
+        "status_url": status_url,
+        "processed": 0,
+        "total": None,
+        "attempts": 0,
+        "created_at": datetime.now(timezone.utc),
+    }
+    db[JOBS_COLLECTION].insert_one(job)
+
+    executor = _executor()
+    if executor is not None:
+        executor.submit(run_export_job, current_app._get_current_object(), job_id)
+    return job_id
+
+
+def _lease_until():
+    return datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)
+
+
+def claim_export_job(db, job_id=None):
+    """
+    Pasa a 'en_proceso' un trabajo pendiente, o en proceso con la concesión vencida (el
+    indicado o el más antiguo), y cuenta el intento. Devuelve el trabajo o None.
+    """
+    now = datetime.now(timezone.utc)
+    query = {"$or": [
+        {"status": STATUS_PENDING},
+        {"status": STATUS_RUNNING, "lease_expires_at": {"$lte": now}},
+    ]}
+    if job_id is not None:
+        query["_id"] = job_id
+    return db[JOBS_COLLECTION].find_one_and_update(
+        query,
+        {"$set": {"status": STATUS_RUNNING, "started_at": now, "lease_expires_at": _lease_until()},
+         "$inc": {"attempts": 1}},
+        sort=[("created_at", pymongo.ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _track_progress(db, job_id, tickets, every=EXPORT_BATCH_SIZE):
+    """
+    Recorre `tickets` guardando en el trabajo cuántos se han procesado y renovando su
+    concesión (una escritura por lote).
+    """
+    processed = 0
+    for ticket in tickets:
+        yield ticket
+        processed += 1
+        if processed % every == 0:
+            db[JOBS_COLLECTION].update_one({"_id": job_id}, {"$set": {"processed": processed, "lease_expires_at": _lease_until()}})
+
+
+def _write_export(job, tickets, output, category_map, status_map):
+    """Escribe el informe del trabajo en `output`."""
+    if job["format"] == "xlsx":
+        write_xlsx(tickets, output, category_map, status_map)
+        return
+    chunks = (iter_csv if job["format"] == "csv" else iter_ndjson)(tickets, category_map, status_map)
+    if job.get("gzip"):
+        chunks = gzip_chunks(chunks)
+    for chunk in chunks:
+        output.write(chunk)
+
+
+def execute_export_job(db, job):
+    """Genera el fichero de un trabajo ya reclamado, lo guarda en GridFS y marca el trabajo como completado."""
+    job_id = job["_id"]
+    extension, mimetype = FORMATS[job["format"]]
+    filename = f"tickets_{job['created_at'].strftime('%Y%m%d_%H%M%S')}.{extension}"
+    if job.get("gzip"):
+        filename += ".gz"
+        mimetype = GZIP_MIMETYPE
+
+    query = json_util.loads(job["query"])
+    total = db.tickets.count_documents(query)
+    db[JOBS_COLLECTION].update_one({"_id": job_id}, {"$set": {"total": total, "lease_expires_at": _lease_until()}})
+
+    output = spooled_file()
+    try:
+        cursor = db.tickets.find(query, EXPORT_PROJECTION).sort(TICKET_SORT).batch_size(EXPORT_BATCH_SIZE)
+        tickets = _track_progress(db, job_id, cursor)
+        _write_export(job, tickets, output, get_category_map(), get_status_map())
+        output.seek(0)
+        file_id = _files(db).put(output, filename=filename, content_type=mimetype, metadata={"job_id": job_id})
+    finally:
+        output.close()
+
+    finished_at = datetime.now(timezone.utc)
+    ttl_hours = current_app.config.get("EXPORT_JOB_TTL_HOURS", DEFAULT_TTL_HOURS)
+    db[JOBS_COLLECTION].update_one({"_id": job_id}, {"$set": {
+        "status": STATUS_DONE,
+        "processed": total,
+        "file_id": file_id,
+        "filename": filename,
+        "mimetype": mimetype,
+        "finished_at": finished_at,
+        "expires_at": finished_at + timedelta(hours=ttl_hours),
+    }, "$unset": {"lease_expires_at": ""}})
+    return file_id
+
+
+def _notify(job, status):
+    if not job.get("notify_email"):
+        return
+    try:
+        send_notification_email(
+            subject='Exportación de tickets - [TuApp]',
+            recipients=[job["notify_email"]],
+            template='emails/export_job_finished.html',
+            job=job,
+            succeeded=status == STATUS_DONE
+        )
+    except Exception as e:
+        logger.error(f"Error al notificar el trabajo de exportación {job['_id']}: {e}")
+
+
+def _mark_failed(db, job, error):
+    db[JOBS_COLLECTION].update_one({"_id": job["_id"]}, {
+        "$set": {"status": STATUS_FAILED, "error": error, "finished_at": datetime.now(timezone.utc)},
+        "$unset": {"lease_expires_at": ""},
+    })
+
+
+def process_export_job(db, job_id=None):
+    """
+    Reclama y ejecuta un trabajo pendiente o abandonado (el indicado o el más antiguo).
+    Un trabajo que ya ha agotado sus intentos se marca como fallido sin ejecutarlo.
+    Devuelve el trabajo procesado, o None si no había ninguno.
+    """
+    job = claim_export_job(db, job_id)
+    if job is None:
+        return None
+    max_attempts = current_app.config.get("EXPORT_JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+    if job["attempts"] > max_attempts:
+        status = STATUS_FAILED
+        logger.error(f"Trabajo de exportación {job['_id']} abandonado tras {max_attempts} intentos.")
+        _mark_failed(db, job, f"Interrumpido {max_attempts} veces sin terminar.")
+        _notify(job, status)
+        return job
+    try:
+        execute_export_job(db, job)
+        status = STATUS_DONE
+        logger.info(f"Trabajo de exportación {job['_id']} completado para {job['requested_by']['username']}.")
+    except Exception as e:
+        status = STATUS_FAILED
+        logger.error(f"Error en el trabajo de exportación {job['_id']}: {e}", exc_info=True)
+        _mark_failed(db, job, str(e))
+    _notify(job, status)
+    return job
+
+
+def run_export_job(app, job_id):
+    """Punto de entrada de los hilos del pool."""
+    with app.app_context():
+        process_export_job(mongo.db, job_id)
+
+
+def purge_expired_exports(db, now=None):
+    """Borra los trabajos caducados y sus ficheros de GridFS. Devuelve cuántos trabajos se borraron."""
+    now = now or datetime.now(timezone.utc)
+    files = _files(db)
+    expired = list(db[JOBS_COLLECTION].find({"expires_at": {"$lte": now}}, {"file_id": 1}))
+    for job in expired:
+        if job.get("file_id"):
+            files.delete(job["file_id"])
+    if expired:
+        db[JOBS_COLLECTION].delete_many({"_id": {"$in": [job["_id"] for job in expired]}})
+    return len(expired)
+
+
+def open_export_file(db, job):
+    """Abre el fichero de un trabajo completado (GridOut), o None si no existe o ha caducado."""
+    if job.get("status") != STATUS_DONE or not job.get("file_id"):
+        return None
+    expires_at = job.get("expires_at")
+    if expires_at is not None and expires_at.replace(tzinfo=timezone.utc) <= datetime.now(timezone.utc):
+        return None
+    try:
+        return _files(db).get(job["file_id"])
+    except gridfs.errors.NoFile:
+        return None
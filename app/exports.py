@@ -0,0 +1,165 @@
+# app/exports.py
+
+import csv
+import io
+import json
+import tempfile
+import zlib
+from openpyxl import Workbook
+
+# --- Exportación de tickets ---
+# El informe se genera fila a fila a partir del cursor de MongoDB, sin cargar todos los
+# tickets en memoria. El XLSX es un ZIP que solo puede enviarse cuando está completo, así
+# que se escribe con un workbook en modo "write-only" sobre un fichero temporal (en memoria
+# mientras es pequeño, en disco a partir de SPOOL_MAX_SIZE) y se envía por trozos.
+# Los formatos de texto (CSV y NDJSON) no necesitan el fichero completo: se generan y se
+# envían a medida que el cursor devuelve los tickets, agrupados en trozos de ~CHUNK_SIZE,
+# y opcionalmente se comprimen con gzip sobre la marcha.
+
+EXPORT_HEADERS = ['ID', 'Nº Ticket', 'Título', 'Descripción', 'Creado Por', 'Categoría', 'Estado',
+                  'Operador Asignado', 'Supervisor Asignado', 'Fecha Creación']
+EXPORT_BATCH_SIZE = 1000
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MIMETYPE = "text/csv; charset=utf-8"
+NDJSON_MIMETYPE = "application/x-ndjson"
+GZIP_MIMETYPE = "application/gzip"
+
+
+def export_row(ticket, category_map, status_map):
+    """Fila del informe para un ticket (en el mismo orden que EXPORT_HEADERS)."""
+    return [
+        str(ticket['_id']),
+        ticket.get('ticket_number', 'N/A'),
+        ticket.get('title', 'N/A'),
+        ticket.get('description', 'N/A'),
+        (ticket.get('creator') or {}).get('username', 'N/A'),
+        category_map.get(ticket.get('category_value'), ticket.get('category_value', 'N/A')),
+        status_map.get(ticket.get('status_value'), ticket.get('status_value', 'N/A')),
+        (ticket.get('operator') or {}).get('username', 'N/A'),
+        (ticket.get('supervisor') or {}).get('username', 'N/A'),
+        ticket.get('created_at').strftime('%d/%m/%Y %H:%M') if ticket.get('created_at') else 'N/A'
+    ]
+
+
+def export_record(ticket, category_map, status_map):
+    """Registro JSON de un ticket: los mismos datos que export_row, con null en lugar de 'N/A' y fecha ISO 8601."""
+    created_at = ticket.get('created_at')
+    return {
+        "id": str(ticket['_id']),
+        "ticket_number": ticket.get('ticket_number'),
+        "title": ticket.get('title'),
+        "description": ticket.get('description'),
+        "creator": (ticket.get('creator') or {}).get('username'),
+        "category": category_map.get(ticket.get('category_value'), ticket.get('category_value')),
+        "status": status_map.get(ticket.get('status_value'), ticket.get('status_value')),
+        "operator": (ticket.get('operator') or {}).get('username'),
+        "supervisor": (ticket.get('supervisor') or {}).get('username'),
+        "created_at": created_at.isoformat() if created_at else None
+    }
+
+
+class CountingIterator:
+    """Envuelve un iterable (p. ej. un cursor) y cuenta los elementos consumidos."""
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self._iterator)
+        self.count += 1
+        return item
+
+
+def write_xlsx(tickets, fileobj, category_map, status_map):
+    """Escribe el informe XLSX de `tickets` (un cursor o iterable) en `fileobj`. Devuelve el número de filas."""
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Tickets")
+    worksheet.append(EXPORT_HEADERS)
+
+    count = 0
+    for ticket in tickets:
+        worksheet.append(export_row(ticket, category_map, status_map))
+        count += 1
+
+    workbook.save(fileobj)
+    return count
+
+
+def spooled_file():
+    """Fichero temporal para el informe: en memoria hasta SPOOL_MAX_SIZE y en disco a partir de ahí."""
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+
+def iter_file_chunks(fileobj, chunk_size=CHUNK_SIZE):
+    """Lee `fileobj` desde el principio por trozos y lo cierra al terminar (o si se corta la descarga)."""
+    try:
+        fileobj.seek(0)
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def _iter_text_chunks(lines, chunk_size=CHUNK_SIZE):
+    """Agrupa las líneas en trozos de ~chunk_size bytes (UTF-8). El primer trozo se envía enseguida."""
+    buffer = []
+    size = 0
+    first = True
+    for line in lines:
+        data = line.encode("utf-8")
+        buffer.append(data)
+        size += len(data)
+        if first or size >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+            first = False
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _csv_lines(tickets, category_map, status_map):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_HEADERS)
+    yield out.getvalue()
+    for ticket in tickets:
+        out.seek(0)
+        out.truncate()
+        writer.writerow(export_row(ticket, category_map, status_map))
+        yield out.getvalue()
+
+
+def iter_csv(tickets, category_map, status_map):
+    """Informe CSV de `tickets`, en trozos de bytes, generado a medida que se recorre el cursor."""
+    return _iter_text_chunks(_csv_lines(tickets, category_map, status_map))
+
+
+def iter_ndjson(tickets, category_map, status_map):
+    """Informe NDJSON (un objeto JSON por línea) de `tickets`, en trozos de bytes."""
+    lines = (json.dumps(export_record(ticket, category_map, status_map), ensure_ascii=False) + "\n"
+             for ticket in tickets)
+    return _iter_text_chunks(lines)
+
+
+def gzip_chunks(chunks):
+    """
+    Comprime con gzip un flujo de trozos de bytes. Cada trozo se vacía del compresor
+    (Z_SYNC_FLUSH) para que el cliente lo reciba sin esperar al final del informe.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
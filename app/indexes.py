@@ -0,0 +1,172 @@
+# app/indexes.py
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+from bson.objectid import ObjectId
+from app.ticket_ids import ticket_id_filter
+
+# --- Declaración centralizada de índices ---
+# Cada colección declara aquí los índices que necesitan las consultas de las rutas.
+# Cualquier consulta nueva debería añadir su índice en este diccionario para que
+# `flask ensure-indexes` lo cree en todos los entornos.
+INDEXES = {
+    "tickets": [
+        # admin_bp.list_tickets (admin, sin filtros): orden por fecha de creación.
+        {"keys": [("created_at", DESCENDING), ("_id", DESCENDING)], "name": "created_at_id"},
+        # client_bp.client_tickets: tickets del creador ordenados por fecha.
+        {"keys": [("creator.user_id", ASCENDING), ("created_at", DESCENDING)], "name": "creator_created_at"},
+        # operator_bp.operator_tickets: tickets asignados al operador.
+        {"keys": [("operator.user_id", ASCENDING), ("created_at", DESCENDING)], "name": "operator_created_at"},
+        # admin_bp.list_tickets (supervisor): tickets propios o sin asignar.
+        {"keys": [("supervisor.user_id", ASCENDING), ("created_at", DESCENDING)], "name": "supervisor_created_at"},
+        # Rama {"supervisor": None} del mismo $or: sin él, la consulta completa es un COLLSCAN.
+        {"keys": [("supervisor", ASCENDING), ("created_at", DESCENDING)], "name": "supervisor_null_created_at"},
+        # Filtros por nombre de usuario: prefijo sobre la copia en minúsculas del nombre.
+        {"keys": [("creator.username_lower", ASCENDING), ("created_at", DESCENDING)], "name": "creator_username_created_at"},
+        {"keys": [("operator.username_lower", ASCENDING), ("created_at", DESCENDING)], "name": "operator_username_created_at"},
+        {"keys": [("supervisor.username_lower", ASCENDING), ("created_at", DESCENDING)], "name": "supervisor_username_created_at"},
+        # "Mis tickets" de cliente y operador filtrados por estado (TicketQuery: igualdad, orden, rango).
+        {"keys": [("creator.user_id", ASCENDING), ("status_value", ASCENDING), ("created_at", DESCENDING)], "name": "creator_status_created_at"},
+        {"keys": [("operator.user_id", ASCENDING), ("status_value", ASCENDING), ("created_at", DESCENDING)], "name": "operator_status_created_at"},
+        # Filtros por estado y categoría del listado (y delete_category).
+        {"keys": [("status_value", ASCENDING), ("created_at", DESCENDING)], "name": "status_created_at"},
+        {"keys": [("category_value", ASCENDING), ("created_at", DESCENDING)], "name": "category_created_at"},
+        # Filtro "ID": número de ticket exacto (los tickets antiguos pueden no tenerlo).
+        # El prefijo del ObjectId se resuelve como rango sobre el índice de '_id'.
+        {"keys": [("ticket_number", ASCENDING)], "name": "ticket_number_unique", "unique": True, "sparse": True},
+        # Búsqueda de texto (app/search.py): índice multikey sobre los tokens del ticket.
+        {"keys": [("search_tokens", ASCENDING), ("created_at", DESCENDING)], "name": "search_tokens_created_at"},
+    ],
+    "personas": [
+        # auth.login busca con $or por username o email: cada rama usa su índice.
+        {"keys": [("username", ASCENDING)], "name": "username_unique", "unique": True},
+        {"keys": [("email", ASCENDING)], "name": "email_unique", "unique": True},
+        # Listas de supervisores/operadores ordenadas por nombre de usuario.
+        {"keys": [("role", ASCENDING), ("username", ASCENDING)], "name": "role_username"},
+    ],
+    "categories": [
+        {"keys": [("value", ASCENDING)], "name": "value_unique", "unique": True},
+        {"keys": [("name", ASCENDING)], "name": "name"},
+    ],
+    "statuses": [
+        {"keys": [("value", ASCENDING)], "name": "value_unique", "unique": True},
+        {"keys": [("name", ASCENDING)], "name": "name"},
+    ],
+    "ticket_history": [
+        # operator_bp.ticket_history: historial de un ticket, del más reciente al más antiguo.
+        {"keys": [("ticket_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], "name": "ticket_timestamp"},
+    ],
+    "supervisor_assignments": [
+        # La tabla de enrutado busca la asignación por (categoría, turno); el índice único
+        # protege también el insert_many de admin_bp.manage_assignments frente a duplicados.
+        {"keys": [("category_id", ASCENDING), ("shift_value", ASCENDING)], "name": "category_shift_unique", "unique": True},
+        {"keys": [("supervisor_id", ASCENDING)], "name": "supervisor_id"},
+    ],
+    "export_jobs": [
+        # admin_bp.export_jobs: trabajos del usuario, del más reciente al más antiguo.
+        {"keys": [("requested_by.user_id", ASCENDING), ("created_at", DESCENDING)], "name": "requested_by_created_at"},
+        # claim_export_job: trabajo pendiente (o en proceso con la concesión vencida) más antiguo.
+        {"keys": [("status", ASCENDING), ("created_at", ASCENDING)], "name": "status_created_at"},
+        # purge_expired_exports: trabajos caducados.
+        {"keys": [("expires_at", ASCENDING)], "name": "expires_at", "sparse": True},
+    ],
+    "email_outbox": [
+        # claim_emails: correos listos para enviar, por prioridad y antigüedad.
+        {"keys": [("status", ASCENDING), ("priority", ASCENDING), ("next_attempt_at", ASCENDING)], "name": "status_priority_next_attempt"},
+        # Los correos enviados se borran a los 7 días (los fallidos se conservan para revisarlos).
+        {"keys": [("sent_at", ASCENDING)], "name": "sent_at_ttl", "expireAfterSeconds": 7 * 24 * 3600},
+    ],
+    # Límites de peticiones (app/rate_limits.py): `limits` crea el mismo índice TTL la primera vez.
+    "rate_limit_counters": [
+        {"keys": [("expireAt", ASCENDING)], "name": "expireAt_1", "expireAfterSeconds": 0},
+    ],
+    "rate_limit_windows": [
+        {"keys": [("expireAt", ASCENDING)], "name": "expireAt_1", "expireAfterSeconds": 0},
+    ],
+    "notification_digests": [
+        # flush_due_digests: avisos de un destinatario y avisos reclamados por un flush.
+        {"keys": [("recipient.user_id", ASCENDING), ("created_at", ASCENDING)], "name": "recipient_created_at"},
+        {"keys": [("flush_id", ASCENDING)], "name": "flush_id"},
+    ],
+}
+
+
+def ensure_indexes(db):
+    """
+    Crea (si no existen) todos los índices declarados en INDEXES.
+    Los índices se construyen en segundo plano para no bloquear la colección.
+    Devuelve una lista de tuplas (colección, nombre, error) con el resultado de cada índice;
+    `error` es None si el índice se creó o ya existía.
+    """
+    results = []
+    for collection_name, index_specs in INDEXES.items():
+        collection = db[collection_name]
+        for spec in index_specs:
+            options = {k: v for k, v in spec.items() if k != "keys"}
+            try:
+                # 'background' se ignora a partir de MongoDB 4.2, donde todas las
+                # construcciones de índices ya evitan bloquear la colección.
+                collection.create_index(spec["keys"], background=True, **options)
+                results.append((collection_name, spec["name"], None))
+            except PyMongoError as e:
+                results.append((collection_name, spec["name"], e))
+    return results
+
+
+def route_queries():
+    """
+    Consultas representativas de las rutas, usadas para el informe de explain().
+    Los valores concretos no importan: solo interesa la forma de la consulta.
+    """
+    sample_id = ObjectId()
+    by_date = [("created_at", DESCENDING)]
+    return [
+        ("admin_bp.list_tickets (admin)", "tickets", {}, by_date),
+        ("admin_bp.list_tickets (supervisor)", "tickets",
+         {"$or": [{"supervisor.user_id": sample_id}, {"supervisor": None}]}, by_date),
+        ("client_bp.client_tickets", "tickets", {"creator.user_id": sample_id}, by_date),
+        ("operator_bp.operator_tickets", "tickets", {"operator.user_id": sample_id}, by_date),
+        ("operator_bp.operator_tickets (status)", "tickets",
+         {"operator.user_id": sample_id, "status_value": "in_progress"}, by_date),
+        ("admin_bp.list_tickets (ticket_id)", "tickets", ticket_id_filter("1042"), by_date),
+        ("admin_bp.list_tickets (creator_username)", "tickets",
+         {"creator.username_lower": {"$gte": "ana", "$lt": "anb"}}, by_date),
+        ("auth.login", "personas", {"$or": [{"username": "usuario"}, {"email": "usuario"}]}, None),
+        ("client_bp.create_ticket (supervisor_assignments)", "supervisor_assignments",
+         {"category_id": sample_id, "shift_value": "weekday_morning"}, None),
+        ("operator_bp.ticket_history", "ticket_history", {"ticket_id": sample_id},
+         [("timestamp", DESCENDING), ("_id", DESCENDING)]),
+    ]
+
+
+def _plan_stages(plan):
+    """Recorre un plan de ejecución y devuelve el conjunto de etapas ('stage') que contiene."""
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= _plan_stages(item)
+    return stages
+
+
+def explain_route_queries(db):
+    """
+    Ejecuta explain() sobre cada consulta de route_queries() y devuelve una lista de
+    tuplas (ruta, etapas del plan ganador, error).
+    """
+    report = []
+    for route, collection_name, query, sort in route_queries():
+        try:
+            cursor = db[collection_name].find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            explanation = cursor.explain()
+            winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+            report.append((route, _plan_stages(winning_plan), None))
+        except Exception as e:
+            report.append((route, set(), e))
+    return report
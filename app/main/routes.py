@@ -2,6 +2,13 @@
 from flask import render_template, redirect, url_for
 from flask_login import current_user
 from app.main import main_bp # Importa el Blueprint que acabas de crear
+from app import mongo
+from app.reference_data import get_status_map
+from app.ticket_stats import get_ticket_stats
+import logging
+import pymongo
+
+logger = logging.getLogger(__name__)
 
 @main_bp.route('/')
 @main_bp.route('/index')
@@ -10,4 +17,16 @@ def home():
         return redirect(url_for('auth.login'))
         
     user=current_user
-    return render_template('index.html', title='Inicio', user=user)
\ No newline at end of file
+
+    # Contadores por estado para administradores (una lectura por _id). Son globales, así
+    # que no se muestran a los supervisores, que solo ven sus tickets y los sin asignar.
+    ticket_stats = None
+    status_map = {}
+    if current_user.is_admin:
+        try:
+            ticket_stats = get_ticket_stats(mongo.db)
+            status_map = get_status_map()
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error al cargar los contadores de tickets: {e}")
+
+    return render_template('index.html', title='Inicio', user=user, ticket_stats=ticket_stats, status_map=status_map)
\ No newline at end of file
@@ -0,0 +1,99 @@
+# app/notifications.py
+
+from datetime import datetime, timedelta, timezone
+from bson.objectid import ObjectId
+from flask import current_app, request, has_request_context
+from app.email import queue_email
+from app.reference_data import get_category_map, get_status_map
+
+# --- Resumen periódico de notificaciones de tickets ---
+# Un supervisor de una categoría/turno con mucho movimiento recibe un correo por cada
+# ticket creado, y un operador uno por cada asignación. Quien activa la preferencia
+# 'notification_digest' (en su perfil) no recibe esos correos sueltos: app.ticket_service
+# (notification) guarda cada aviso en 'notification_digests', en el mismo lote que el
+# cambio del ticket, y flush_due_digests() los agrupa en un único correo por destinatario
+# (emails/ticket_digest.html) cuando el aviso más antiguo tiene NOTIFICATION_DIGEST_MINUTES
+# minutos. `flask run-mail-worker` lo llama en cada vuelta.
+#
+# Los avisos de un destinatario se reclaman con update_many (flush_id) antes de generar
+# el resumen, así que dos workers no envían el mismo aviso. Si un worker muere a mitad,
+# los avisos reclamados vuelven a estar disponibles pasado CLAIM_TIMEOUT.
+
+DIGEST_COLLECTION = "notification_digests"
+DIGEST_TEMPLATE = "emails/ticket_digest.html"
+
+DIGEST_TICKET_CREATED = "ticket_created"
+DIGEST_TICKET_ASSIGNED = "ticket_assigned"
+DIGEST_TICKET_UPDATED = "ticket_updated"
+
+DEFAULT_DIGEST_MINUTES = 60
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def wants_digest(recipient):
+    """True si el usuario (documento de 'personas') prefiere recibir las notificaciones en un resumen."""
+    return bool(recipient and recipient.get("notification_digest"))
+
+
+def digest_entry(recipient, kind, ticket):
+    """Documento de 'notification_digests' con el aviso de `ticket` para `recipient` (con su _id), sin guardarlo."""
+    return {
+        "_id": ObjectId(),
+        "recipient": {"user_id": recipient["_id"], "username": recipient["username"], "email": recipient["email"]},
+        "kind": kind,
+        "ticket": {
+            "_id": ticket["_id"],
+            "ticket_number": ticket.get("ticket_number"),
+            "title": ticket.get("title"),
+            "category_value": ticket.get("category_value"),
+            "status_value": ticket.get("status_value"),
+        },
+        "base_url": request.url_root if has_request_context() else None,
+        "flush_id": None,
+        "created_at": datetime.now(timezone.utc),
+    }
+
+
+def _available(cutoff):
+    """Avisos sin reclamar, o reclamados por un worker que no terminó antes de `cutoff`."""
+    return {"$or": [{"flush_id": None}, {"claimed_at": {"$lte": cutoff}}]}
+
+
+def flush_due_digests(db, now=None):
+    """
+    Encola un correo por cada destinatario cuyo aviso más antiguo tenga al menos
+    NOTIFICATION_DIGEST_MINUTES minutos, y borra sus avisos. Devuelve cuántos resúmenes se encolaron.
+    """
+    now = now or datetime.now(timezone.utc)
+    minutes = current_app.config.get("NOTIFICATION_DIGEST_MINUTES", DEFAULT_DIGEST_MINUTES)
+    due = db[DIGEST_COLLECTION].aggregate([
+        {"$match": _available(now - CLAIM_TIMEOUT)},
+        {"$group": {"_id": "$recipient.user_id", "oldest": {"$min": "$created_at"}}},
+        {"$match": {"oldest": {"$lte": now - timedelta(minutes=minutes)}}},
+    ])
+
+    flushed = 0
+    for group in due:
+        flush_id = ObjectId()
+        db[DIGEST_COLLECTION].update_many(
+            {"recipient.user_id": group["_id"], **_available(now - CLAIM_TIMEOUT)},
+            {"$set": {"flush_id": flush_id, "claimed_at": now}}
+        )
+        items = list(db[DIGEST_COLLECTION].find({"flush_id": flush_id}).sort("created_at", 1))
+        if not items:
+            continue
+
+        recipient = items[-1]["recipient"]
+        queue_email(
+            f"Resumen de tickets ({len(items)}) - [TuApp]",
+            [recipient["email"]],
+            DIGEST_TEMPLATE,
+            base_url=items[-1].get("base_url"),
+            username=recipient["username"],
+            items=[{"kind": item["kind"], "ticket": item["ticket"], "created_at": item["created_at"]} for item in items],
+            category_map=get_category_map(),
+            status_map=get_status_map()
+        )
+        db[DIGEST_COLLECTION].delete_many({"flush_id": flush_id})
+        flushed += 1
+    return flushed
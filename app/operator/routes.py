@@ -9,7 +9,13 @@ from app.auth.decorators import operator_required
 import logging
 from bson.objectid import ObjectId
 import pymongo
-from app.utils import log_ticket_history
+from urllib.parse import urlsplit
+from app.pagination import paginate, strip_pagination_args, HISTORY_SORT
+from app.projections import OPERATOR_LIST_PROJECTION
+from app.search import rebuild_search_fields
+from app.reference_data import get_statuses
+from app.ticket_query import TicketQuery, set_filter_choices
+from app.ticket_service import update_ticket
 
 logger = logging.getLogger(__name__)
 
@@ -18,24 +24,10 @@ logger = logging.getLogger(__name__)
 @operator_required
 def operator_tickets():
     form = TicketFilterForm(request.args)
-    query = {"operator.user_id": ObjectId(current_user.id)}
-
-    # Aquí se añadiría la lógica de filtrado del formulario si es necesario
-
-    try:
-        tickets = list(mongo.db.tickets.find(query).sort("created_at", -1))
-        logger.info(f'Usuario {current_user.username} consultó sus tickets asignados. Se encontraron {len(tickets)} tickets.')
-    except pymongo.errors.PyMongoError as e:
-        logger.error(f"Error al buscar tickets para el operador {current_user.username}: {e}")
-        flash("Error al cargar los tickets asignados.", "danger")
-        tickets = []
 
     # Poblar los formularios de filtro (solo categorías y estados)
     try:
-        statuses = list(mongo.db.statuses.find().sort("name", 1))
-        form.status.choices = [('', 'Todos los Estados')] + [(s['value'], s['name']) for s in statuses]
-        categories = list(mongo.db.categories.find().sort("name", 1))
-        form.category.choices = [('', 'Todas las Categorías')] + [(c['value'], c['name']) for c in categories]
+        statuses, _ = set_filter_choices(form)
 
         # Crear status_map para la plantilla
         status_map = {s['value']: s['name'] for s in statuses}
@@ -45,7 +37,27 @@ def operator_tickets():
         flash("Error al cargar opciones de filtro.", "warning")
         status_map = {}
 
-    return render_template('operator/operator_tickets.html', title='Mis Tickets Asignados', tickets=tickets, form=form, status_map=status_map)
+    # Filtros del formulario sobre los tickets asignados al operador
+    ticket_query = TicketQuery(form, current_user)
+    for warning in ticket_query.warnings:
+        flash(warning, "warning")
+
+    page = None
+    try:
+        page = ticket_query.page(mongo.db.tickets, request.args, OPERATOR_LIST_PROJECTION)
+        tickets = page.items
+        logger.info(f'Usuario {current_user.username} consultó sus tickets asignados. Se muestran {len(tickets)} tickets.')
+    except pymongo.errors.ExecutionTimeout:
+        logger.warning(f"Consulta de tickets cancelada por tiempo: {ticket_query.filter}")
+        flash("La consulta ha tardado demasiado. Acote los filtros (por ejemplo, por fecha o estado).", "warning")
+        tickets = []
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error al buscar tickets para el operador {current_user.username}: {e}")
+        flash("Error al cargar los tickets asignados.", "danger")
+        tickets = []
+
+    filters_active = any(key != '_' for key in strip_pagination_args(request.args).keys())
+    return render_template('operator/operator_tickets.html', title='Mis Tickets Asignados', tickets=tickets, form=form, status_map=status_map, filters_active=filters_active, page=page)
 
 @operator_bp.route('/operator_ticket_detail/<string:ticket_id>', methods=['GET', 'POST'])
 @login_required
@@ -75,7 +87,7 @@ def operator_ticket_detail(ticket_id):
 
     # Poblar SelectField de estados
     try:
-        statuses = list(mongo.db.statuses.find().sort("name", 1))
+        statuses = get_statuses()
         # Filtrar estados permitidos para el operador
         form.status.choices = [('', '--- Seleccione un Estado ---')] + [(s['value'], s['name']) for s in statuses if s['value'] in assignable_status_values]
         status_map = {s['value']: s['name'] for s in statuses}
@@ -93,8 +105,7 @@ def operator_ticket_detail(ticket_id):
         try:
             new_status_value = form.status.data
             update_data = {
-                "status_value": new_status_value,
-                "updated_at": datetime.now(timezone.utc)
+                "status_value": new_status_value
             }
             if form.operator_notes.data:
                 update_data['observation'] = form.operator_notes.data
@@ -105,9 +116,19 @@ def operator_ticket_detail(ticket_id):
             elif new_status_value not in ['completed', 'cancelled'] and ticket.get('completed_at'):
                 update_data['completed_at'] = None
 
-            mongo.db.tickets.update_one({"_id": ObjectId(ticket_id)}, {"$set": update_data})
+            if 'observation' in update_data:
+                # La observación se reemplaza: el índice de búsqueda se recalcula
+                update_data.update(rebuild_search_fields(mongo.db, ticket, observation=update_data['observation']))
 
-            log_ticket_history(ticket_id, "Actualización de Ticket por Operador", current_user, f"Estado cambiado a {new_status_value}")
+            # El filtro incluye el estado leído: si otro usuario lo cambió entretanto, no se sobrescribe
+            updated = update_ticket(
+                ticket, current_user, "Actualización de Ticket por Operador", f"Estado cambiado a {new_status_value}",
+                set_fields=update_data,
+                expected={"status_value": ticket['status_value']}
+            )
+            if not updated:
+                flash('El ticket ha cambiado mientras lo editabas. Revisa su estado actual.', 'warning')
+                return redirect(url_for('operator_bp.operator_ticket_detail', ticket_id=ticket_id))
 
             # Lógica de envío de correos (simplificada, a refactorizar)
             # send_notification_email(...)
@@ -125,7 +146,7 @@ def operator_ticket_detail(ticket_id):
 @login_required
 def ticket_history(ticket_id):
     try:
-        ticket = mongo.db.tickets.find_one({"_id": ObjectId(ticket_id)})
+        ticket = mongo.db.tickets.find_one({"_id": ObjectId(ticket_id)}, {"title": 1})
         if not ticket:
             flash('Ticket no encontrado.', 'danger')
             return redirect(url_for('main.home'))
@@ -133,16 +154,44 @@ def ticket_history(ticket_id):
         # La lógica de permisos debería estar aquí. 
         # Por ahora, se asume que si el usuario llega aquí, tiene permiso.
 
-        # El historial está incrustado en el propio ticket
-        history_records = ticket.get('history', [])
+        # El historial se guarda en la colección 'ticket_history' y se lee paginado.
+        # El enlace de vuelta se conserva en la URL para no perderlo al cambiar de página.
+        referrer_url = _back_url()
+        args = request.args.to_dict()
+        args['back'] = referrer_url
+        page = paginate(mongo.db.ticket_history, {"ticket_id": ObjectId(ticket_id)}, args, sort=HISTORY_SORT)
+        history_records = page.items
         
         logger.info(f'Usuario {current_user.username} consultó el historial del ticket {ticket_id}.')
 
-        referrer_url = request.referrer or url_for('main.home')
-
-        return render_template('ticket_history.html', ticket=ticket, history_records=history_records, referrer_url=referrer_url)
+        return render_template('ticket_history.html', ticket=ticket, history_records=history_records, referrer_url=referrer_url, page=page)
 
     except Exception as e:
         logger.error(f"Error al cargar el historial del ticket {ticket_id}: {e}", exc_info=True)
         flash("Error al cargar el historial del ticket.", "danger")
-        return redirect(url_for('main.home'))
\ No newline at end of file
+        return redirect(url_for('main.home'))
+
+def _back_url():
+    """
+    Devuelve la ruta relativa a la que vuelve el botón "Volver": el parámetro 'back' si
+    es una ruta local, o el referrer si apunta a esta misma aplicación.
+    """
+    back = request.args.get('back', '')
+    if _is_local_path(back):
+        return back
+    if request.referrer:
+        referrer = urlsplit(request.referrer)
+        if referrer.netloc == request.host:
+            return referrer.path + (f"?{referrer.query}" if referrer.query else "")
+    return url_for('main.home')
+
+def _is_local_path(url):
+    """
+    Indica si `url` es una ruta de esta aplicación. Los navegadores tratan '\\' como '/',
+    así que '/\\evil.com' equivaldría a '//evil.com': se rechazan las barras invertidas y
+    cualquier URL con esquema o dominio.
+    """
+    if not url or '\\' in url:
+        return False
+    parts = urlsplit(url)
+    return not parts.scheme and not parts.netloc and parts.path.startswith('/')
@@ -0,0 +1,185 @@
+# app/pagination.py
+
+import base64
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+
+# Parámetros de la URL reservados para la paginación.
+AFTER_ARG = "after"
+BEFORE_ARG = "before"
+PAGE_SIZE_ARG = "per_page"
+PAGINATION_ARGS = (AFTER_ARG, BEFORE_ARG, PAGE_SIZE_ARG)
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+PAGE_SIZE_OPTIONS = (25, 50, 100)
+
+# Orden de los listados de tickets. El _id desempata tickets creados en el mismo
+# milisegundo, de modo que la clave (created_at, _id) es única y estable.
+TICKET_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+# Orden del historial de un ticket: la entrada más reciente primero.
+HISTORY_SORT = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+
+
+class Page:
+    """
+    Resultado de una consulta paginada por cursor (keyset).
+    Los tokens `next_token`/`prev_token` codifican la clave de ordenación del último/primer
+    documento de la página y son None cuando no hay página siguiente/anterior.
+    """
+    size_options = PAGE_SIZE_OPTIONS
+
+    def __init__(self, items, page_size, next_token=None, prev_token=None, base_args=None):
+        self.items = items
+        self.page_size = page_size
+        self.next_token = next_token
+        self.prev_token = prev_token
+        self.base_args = base_args or {}
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_token is not None
+
+    @property
+    def next_args(self):
+        """Argumentos de URL para la página siguiente, conservando los filtros."""
+        return {**self.base_args, PAGE_SIZE_ARG: self.page_size, AFTER_ARG: self.next_token}
+
+    @property
+    def prev_args(self):
+        """Argumentos de URL para la página anterior, conservando los filtros."""
+        return {**self.base_args, PAGE_SIZE_ARG: self.page_size, BEFORE_ARG: self.prev_token}
+
+    def size_args(self, page_size):
+        """Argumentos de URL para volver a la primera página con otro tamaño de página."""
+        return {**self.base_args, PAGE_SIZE_ARG: page_size}
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def strip_pagination_args(args):
+    """Devuelve una copia de los argumentos de la URL sin los parámetros de paginación."""
+    return {key: value for key, value in args.items() if key not in PAGINATION_ARGS}
+
+
+def get_page_size(args):
+    """Lee el tamaño de página de la URL, acotado entre 1 y MAX_PAGE_SIZE."""
+    try:
+        page_size = int(args.get(PAGE_SIZE_ARG, DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def encode_cursor(document, sort):
+    """Codifica los valores de la clave de ordenación de un documento en un token opaco para la URL."""
+    values = [document.get(field) for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token, sort):
+    """Decodifica un token generado por encode_cursor. Devuelve None si el token no es válido."""
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))
+    except Exception:
+        return None
+    if not isinstance(values, list) or len(values) != len(sort):
+        return None
+    return values
+
+
+def keyset_filter(sort, values, backwards=False):
+    """
+    Construye el filtro que selecciona los documentos posteriores (o anteriores, si
+    `backwards`) a la clave `values` según el orden `sort`.
+    Para [(a, -1), (b, -1)] hacia delante produce:
+        {"$or": [{a: {"$lt": va}}, {a: va, b: {"$lt": vb}}]}
+    """
+    clauses = []
+    for position, (field, direction) in enumerate(sort):
+        descending = direction == DESCENDING
+        operator = "$lt" if descending != backwards else "$gt"
+        clause = {prev_field: values[i] for i, (prev_field, _) in enumerate(sort[:position])}
+        clause[field] = {operator: values[position]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+def _reverse(sort):
+    return [(field, ASCENDING if direction == DESCENDING else DESCENDING) for field, direction in sort]
+
+
+def _combine(query, extra):
+    if not query:
+        return extra
+    return {"$and": [query, extra]}
+
+
+def _fetch(collection, query, keyset, sort, limit, projection, computed_fields, max_time_ms=None):
+    """
+    Ejecuta la consulta de una página. Si hay campos calculados (p. ej. la relevancia de
+    una búsqueda) se usa una agregación para poder ordenar y filtrar por ellos.
+    El $sort por un campo calculado no puede usar un índice y ordena en memoria todos los
+    documentos que cumplen el filtro, así que antes se reducen con la proyección a los
+    campos de la página y de la clave de ordenación, y se permite usar disco.
+    """
+    if computed_fields:
+        pipeline = [{"$match": query or {}}, {"$addFields": computed_fields}]
+        if projection:
+            lean = {**projection, **{field: 1 for field, _ in sort}, **{field: 1 for field in computed_fields}}
+            pipeline.append({"$project": lean})
+        if keyset is not None:
+            pipeline.append({"$match": keyset})
+        pipeline += [{"$sort": dict(sort)}, {"$limit": limit}]
+        options = {"maxTimeMS": max_time_ms} if max_time_ms else {}
+        return list(collection.aggregate(pipeline, allowDiskUse=True, **options))
+
+    effective_query = _combine(query, keyset) if keyset is not None else query
+    cursor = collection.find(effective_query, projection).sort(sort).limit(limit)
+    if max_time_ms:
+        cursor = cursor.max_time_ms(max_time_ms)
+    return list(cursor)
+
+
+def paginate(collection, query, args, sort=TICKET_SORT, projection=None, computed_fields=None, max_time_ms=None):
+    """
+    Devuelve una Page de `collection` filtrada por `query` usando paginación por cursor.
+    El coste de cada página es constante: la consulta salta directamente a la clave del
+    token mediante el índice de ordenación en lugar de usar skip().
+    `computed_fields` ({campo: expresión}) permite ordenar por campos calculados que
+    formen parte de `sort`; en ese caso el coste por página deja de ser constante,
+    porque cada página ordena de nuevo todos los documentos que cumplen `query`.
+    `max_time_ms` limita el tiempo de servidor de la consulta (pymongo.errors.ExecutionTimeout).
+    """
+    page_size = get_page_size(args)
+    base_args = strip_pagination_args(args)
+
+    after = decode_cursor(args[AFTER_ARG], sort) if args.get(AFTER_ARG) else None
+    before = decode_cursor(args[BEFORE_ARG], sort) if args.get(BEFORE_ARG) else None
+
+    if before is not None:
+        # Página anterior: se recorre en orden inverso y se da la vuelta al resultado.
+        items = _fetch(collection, query, keyset_filter(sort, before, backwards=True), _reverse(sort),
+                       page_size + 1, projection, computed_fields, max_time_ms)
+        has_prev = len(items) > page_size
+        items = list(reversed(items[:page_size]))
+        has_next = True
+    else:
+        keyset = keyset_filter(sort, after) if after is not None else None
+        items = _fetch(collection, query, keyset, sort, page_size + 1, projection, computed_fields, max_time_ms)
+        has_next = len(items) > page_size
+        items = items[:page_size]
+        has_prev = after is not None
+
+    next_token = encode_cursor(items[-1], sort) if items and has_next else None
+    prev_token = encode_cursor(items[0], sort) if items and has_prev else None
+    return Page(items, page_size, next_token=next_token, prev_token=prev_token, base_args=base_args)
@@ -0,0 +1,50 @@
+# app/projections.py
+
+# --- Proyecciones de los listados de tickets ---
+# Los listados solo muestran identificador, título, usuarios, categoría, estado y fechas.
+# Se usan proyecciones de inclusión para no transferir campos que crecen con la vida
+# del ticket, como el historial embebido ('history') o la descripción con las notas
+# añadidas por el cliente.
+
+# admin/list_tickets.html
+ADMIN_LIST_PROJECTION = {
+    "ticket_number": 1,
+    "title": 1,
+    "creator": 1,
+    "category_value": 1,
+    "status_value": 1,
+    "supervisor": 1,
+    "operator": 1,
+    "created_at": 1,
+    "updated_at": 1,
+}
+
+# client/client_tickets.html
+CLIENT_LIST_PROJECTION = {
+    "ticket_number": 1,
+    "title": 1,
+    "category_value": 1,
+    "status_value": 1,
+    "supervisor": 1,
+    "operator": 1,
+    "created_at": 1,
+    "updated_at": 1,
+}
+
+# operator/operator_tickets.html
+OPERATOR_LIST_PROJECTION = {
+    "ticket_number": 1,
+    "title": 1,
+    "creator": 1,
+    "category_value": 1,
+    "status_value": 1,
+    "created_at": 1,
+    "updated_at": 1,
+}
+
+# admin_bp.export_tickets_to_xlsx: igual que el listado más la descripción, que sí
+# forma parte del informe.
+EXPORT_PROJECTION = {
+    **ADMIN_LIST_PROJECTION,
+    "description": 1,
+}
@@ -0,0 +1,38 @@
+# app/rate_limits.py
+
+from app import mongo
+
+# --- Almacenamiento de los límites de peticiones (Flask-Limiter) ---
+# Con el almacenamiento por defecto (memoria) cada worker de gunicorn y cada instancia de
+# Cloud Run lleva sus propios contadores: el "10 per minute" del login se convierte en
+# 10 x N y se reinicia con cada arranque. Si RATELIMIT_STORAGE_URI no está definida, los
+# contadores se guardan en la propia base de datos de la aplicación, con el backend
+# MongoDB de `limits`: cada ventana es un documento de 'rate_limit_counters' que se
+# incrementa con una única actualización atómica (find_one_and_update con upsert) y que
+# caduca con un índice TTL sobre 'expireAt'. Así el límite es el mismo en todo el clúster.
+#
+# Si MongoDB no responde, RATELIMIT_IN_MEMORY_FALLBACK_ENABLED hace que Flask-Limiter
+# aplique temporalmente los límites en memoria en lugar de fallar la petición.
+# Para usar otro almacenamiento (p. ej. redis://) basta con definir RATELIMIT_STORAGE_URI.
+
+COUNTERS_COLLECTION = "rate_limit_counters"
+WINDOWS_COLLECTION = "rate_limit_windows"
+
+
+def configure_rate_limit_storage(app):
+    """
+    Apunta Flask-Limiter a la base de datos de la aplicación (salvo que RATELIMIT_STORAGE_URI
+    ya esté configurada). Debe llamarse después de mongo.init_app y antes de limiter.init_app.
+    """
+    if app.config.get("RATELIMIT_STORAGE_URI") or not app.config.get("MONGO_URI"):
+        return
+    database_name = mongo.db.name if mongo.db is not None else "limits"
+    app.config["RATELIMIT_STORAGE_URI"] = app.config["MONGO_URI"]
+    app.config.setdefault("RATELIMIT_STORAGE_OPTIONS", {
+        "database_name": database_name,
+        "counter_collection_name": COUNTERS_COLLECTION,
+        "window_collection_name": WINDOWS_COLLECTION,
+        # Cliente propio de `limits`: pocas conexiones, y sin esperar 30 s si el servidor no responde
+        "maxPoolSize": app.config.get("RATELIMIT_STORAGE_POOL_SIZE", 10),
+        "serverSelectionTimeoutMS": 2000,
+    })
@@ -0,0 +1,192 @@
+# app/reference_data.py
+
+import threading
+import time
+from flask import current_app
+from pymongo import ASCENDING
+from app import mongo
+
+# --- Caché en memoria de los datos de referencia ---
+# Estados, categorías, roles y asignaciones de supervisores casi nunca cambian, pero
+# casi todas las rutas los necesitan (choices de los formularios, mapas valor -> nombre,
+# búsquedas por valor). Cada proceso guarda una copia de cada colección.
+#
+# Invalidación entre procesos: el documento 'reference_data' de la colección
+# 'cache_versions' guarda un contador por colección. Las rutas que modifican estos
+# datos llaman a invalidate(), que incrementa el contador. Cada proceso lee ese único
+# documento como mucho una vez cada REFERENCE_DATA_CHECK_INTERVAL_MS y recarga (de forma
+# perezosa, al pedirla) la colección cuyo contador haya cambiado. Así, un cambio hecho en
+# un worker se ve en todos los demás en, como mucho, ese intervalo, sin volver a leer
+# las colecciones completas mientras no cambien.
+# REFERENCE_DATA_TTL es una red de seguridad para escrituras hechas fuera de la
+# aplicación (p. ej. desde la consola de MongoDB), que no incrementan el contador.
+
+REFERENCE_COLLECTIONS = ("statuses", "categories", "roles", "supervisor_assignments")
+VERSIONS_COLLECTION = "cache_versions"
+VERSIONS_ID = "reference_data"
+DEFAULT_TTL = 300
+DEFAULT_CHECK_INTERVAL_MS = 1000
+
+
+class _Snapshot:
+    """Copia de una colección de referencia, ordenada por nombre e indexada por valor y por _id."""
+
+    def __init__(self, docs, version):
+        self.docs = docs
+        self.version = version
+        self.by_value = {doc.get("value"): doc for doc in docs}
+        self.by_id = {doc["_id"]: doc for doc in docs}
+        self.loaded_at = time.monotonic()
+        # Tablas derivadas (p. ej. la de enrutado de tickets), construidas al pedirlas
+        self.derived = {}
+
+
+class ReferenceDataCache:
+
+    def __init__(self, ttl=DEFAULT_TTL, check_interval_ms=DEFAULT_CHECK_INTERVAL_MS):
+        self.ttl = ttl
+        self.check_interval = check_interval_ms / 1000
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._versions = {}
+        self._checked_at = None
+
+    def _current_versions(self, db):
+        """Versiones de las colecciones, releídas de la BD como mucho una vez por intervalo."""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            doc = db[VERSIONS_COLLECTION].find_one({"_id": VERSIONS_ID}) or {}
+            with self._lock:
+                self._versions = {name: doc.get(name, 0) for name in REFERENCE_COLLECTIONS}
+                self._checked_at = now
+        return self._versions
+
+    def snapshot(self, db, collection_name):
+        version = self._current_versions(db).get(collection_name, 0)
+        snapshot = self._snapshots.get(collection_name)
+        if (snapshot is None or snapshot.version != version
+                or time.monotonic() - snapshot.loaded_at >= self.ttl):
+            # La consulta se hace fuera del lock: dos recargas simultáneas solo cuestan
+            # una consulta de más, y así una base de datos lenta no bloquea al resto.
+            snapshot = _Snapshot(list(db[collection_name].find().sort("name", ASCENDING)), version)
+            with self._lock:
+                self._snapshots[collection_name] = snapshot
+        return snapshot
+
+    def invalidate(self, db, *collection_names):
+        names = collection_names or REFERENCE_COLLECTIONS
+        # Primero se publica el cambio para el resto de procesos...
+        db[VERSIONS_COLLECTION].update_one(
+            {"_id": VERSIONS_ID}, {"$inc": {name: 1 for name in names}}, upsert=True
+        )
+        # ...y después se descarta la copia local y se fuerza a releer las versiones.
+        with self._lock:
+            for name in names:
+                self._snapshots.pop(name, None)
+            self._checked_at = None
+
+
+def _cache():
+    cache = current_app.extensions.get("reference_data")
+    if cache is None:
+        cache = ReferenceDataCache(
+            current_app.config.get("REFERENCE_DATA_TTL", DEFAULT_TTL),
+            current_app.config.get("REFERENCE_DATA_CHECK_INTERVAL_MS", DEFAULT_CHECK_INTERVAL_MS)
+        )
+        current_app.extensions["reference_data"] = cache
+    return cache
+
+
+def _snapshot(collection_name):
+    return _cache().snapshot(mongo.db, collection_name)
+
+
+def invalidate(*collection_names):
+    """Invalida, en todos los procesos, la caché de las colecciones indicadas (o de todas)."""
+    _cache().invalidate(mongo.db, *collection_names)
+
+
+# Listas ordenadas por nombre. Se devuelve una lista nueva para que quien la reciba
+# pueda modificarla; los documentos son compartidos y no deben modificarse.
+
+def get_statuses():
+    return list(_snapshot("statuses").docs)
+
+
+def get_categories():
+    return list(_snapshot("categories").docs)
+
+
+def get_roles():
+    return list(_snapshot("roles").docs)
+
+
+# Búsquedas por valor o por _id. Devuelven None si no existe.
+
+def get_status(value):
+    return _snapshot("statuses").by_value.get(value)
+
+
+def get_category(value):
+    return _snapshot("categories").by_value.get(value)
+
+
+def get_category_by_id(category_id):
+    return _snapshot("categories").by_id.get(category_id)
+
+
+# Mapas valor -> nombre para mostrar en las plantillas.
+
+def get_status_map():
+    return {value: doc["name"] for value, doc in _snapshot("statuses").by_value.items()}
+
+
+def get_category_map():
+    return {value: doc["name"] for value, doc in _snapshot("categories").by_value.items()}
+
+
+def get_supervisor_assignments():
+    return list(_snapshot("supervisor_assignments").docs)
+
+
+# --- Tabla de enrutado de tickets y lista de supervisores ---
+# (categoría _id, turno) -> supervisor al que se asigna un ticket nuevo, con los datos que
+# necesita el alta (nombre, correo y preferencia de resumen), y la lista de supervisores
+# de los formularios de asignación. Se construyen a partir de la copia de
+# 'supervisor_assignments' con una sola consulta a 'personas' cada una y se descartan con
+# ella: al cambiar las asignaciones, o al crear o editar a un supervisor (las rutas que lo
+# hacen invalidan 'supervisor_assignments'), o pasado REFERENCE_DATA_TTL.
+
+ROUTE_PERSONA_FIELDS = {"username": 1, "email": 1, "notification_digest": 1}
+
+
+def _build_routing_table(assignments):
+    supervisor_ids = {a.get("supervisor_id") for a in assignments if a.get("supervisor_id")}
+    supervisors = {p["_id"]: p for p in mongo.db.personas.find(
+        {"_id": {"$in": list(supervisor_ids)}}, ROUTE_PERSONA_FIELDS)} if supervisor_ids else {}
+    table = {}
+    for assignment in assignments:
+        supervisor = supervisors.get(assignment.get("supervisor_id"))
+        if supervisor:
+            table[(assignment.get("category_id"), assignment.get("shift_value"))] = supervisor
+    return table
+
+
+def _derived(name, build):
+    snapshot = _snapshot("supervisor_assignments")
+    table = snapshot.derived.get(name)
+    if table is None:
+        table = build(snapshot.docs)
+        snapshot.derived[name] = table
+    return table
+
+
+def get_supervisor_route(category_id, shift_value):
+    """Supervisor ({_id, username, email, notification_digest}) de una categoría (_id) y un turno, o None."""
+    return _derived("routes", _build_routing_table).get((category_id, shift_value))
+
+
+def get_supervisors():
+    """Usuarios con rol supervisor ({_id, username}), ordenados por nombre."""
+    return list(_derived("supervisors", lambda _: list(
+        mongo.db.personas.find({"role": "supervisor"}, {"username": 1}).sort("username", ASCENDING))))
@@ -0,0 +1,128 @@
+# app/search.py
+
+import re
+import unicodedata
+from pymongo import DESCENDING
+from app.pagination import TICKET_SORT
+
+# --- Índice de búsqueda mantenido por la aplicación ---
+# Cada ticket guarda dos arrays de tokens normalizados (minúsculas, sin tildes):
+#   - 'title_tokens': palabras del título, usadas para ordenar por relevancia.
+#   - 'search_tokens': palabras del título, la descripción, la observación y las notas
+#     del historial. Es un campo multikey indexado, de modo que la búsqueda es un
+#     recorrido de índice en lugar de una expresión regular sobre toda la colección.
+
+MIN_TOKEN_LENGTH = 2
+MAX_QUERY_TOKENS = 8
+
+# Tipos de cambio del historial cuyo detalle es una nota escrita por un usuario y, por
+# tanto, forma parte del texto buscable del ticket.
+NOTE_CHANGE_TYPES = ("Rechazo de Resolución", "Nota adicional del cliente")
+
+# Orden de los resultados de búsqueda: primero los más relevantes y, a igualdad de
+# relevancia, los más recientes.
+SEARCH_SORT = [("search_score", DESCENDING)] + TICKET_SORT
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text):
+    """Pasa el texto a minúsculas y elimina tildes y diacríticos."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(*texts):
+    """Devuelve los tokens únicos (en orden de aparición) de los textos indicados."""
+    tokens = []
+    seen = set()
+    for text in texts:
+        for token in _TOKEN_RE.findall(normalize(text)):
+            if len(token) >= MIN_TOKEN_LENGTH and token not in seen:
+                seen.add(token)
+                tokens.append(token)
+    return tokens
+
+
+def ticket_search_fields(title, description="", observation="", notes=()):
+    """Campos de búsqueda de un ticket, para incluirlos en el insert o en un $set."""
+    return {
+        "title_tokens": tokenize(title),
+        "search_tokens": tokenize(title, description, observation, *notes),
+    }
+
+
+def load_search_notes(db, ticket_ids):
+    """
+    Devuelve {ticket_id: [notas]} con las notas del historial que forman parte del texto
+    buscable de los tickets indicados. Se resuelve con una sola consulta para todo el lote.
+    """
+    notes = {}
+    cursor = db.ticket_history.find(
+        {"ticket_id": {"$in": list(ticket_ids)}, "change_type": {"$in": list(NOTE_CHANGE_TYPES)}},
+        {"ticket_id": 1, "details": 1}
+    )
+    for entry in cursor:
+        notes.setdefault(entry["ticket_id"], []).append(entry.get("details") or "")
+    return notes
+
+
+def rebuild_search_fields(db, ticket, **changes):
+    """
+    Recalcula los campos de búsqueda de `ticket` aplicando los valores nuevos de
+    `changes` (title, description, observation). Se usa cuando una edición reemplaza
+    un campo de texto: $addToSet solo puede añadir tokens, y los del texto anterior
+    deben dejar de encontrar el ticket.
+    """
+    fields = {field: changes.get(field, ticket.get(field, "")) for field in ("title", "description", "observation")}
+    notes = load_search_notes(db, [ticket["_id"]]).get(ticket["_id"], [])
+    return ticket_search_fields(fields["title"], fields["description"], fields["observation"], notes)
+
+
+def add_search_tokens(*texts):
+    """
+    Fragmento $addToSet que añade al índice de búsqueda los tokens de un texto nuevo
+    que se anexa al ticket (una nota, un motivo de rechazo...). Se combina con el $set
+    de la misma actualización. Si la actualización reemplaza un texto existente, usar
+    rebuild_search_fields() para que desaparezcan los tokens anteriores.
+    """
+    return {"search_tokens": {"$each": tokenize(*texts)}}
+
+
+def search_query(text):
+    """
+    Traduce el texto de búsqueda a un filtro sobre 'search_tokens'.
+    Todas las palabras deben aparecer en el ticket; la última se busca como prefijo
+    anclado para que funcione mientras el usuario escribe. Devuelve (filtro, tokens);
+    el filtro es None si el texto no contiene ninguna palabra buscable.
+    """
+    tokens = tokenize(text)[:MAX_QUERY_TOKENS]
+    if not tokens:
+        return None, []
+    *complete, prefix = tokens
+    condition = {"$regex": f"^{re.escape(prefix)}"}
+    if complete:
+        condition["$all"] = complete
+    return {"search_tokens": condition}, tokens
+
+
+def relevance_fields(tokens):
+    """
+    Campo calculado 'search_score' para paginate(): número de palabras del título que
+    coinciden con la búsqueda (la última palabra, como en search_query, cuenta como
+    prefijo). Los tickets cuyo título coincide se muestran primero.
+    """
+    *complete, prefix = tokens
+    # Los tokens solo contienen [a-z0-9], así que $substr (por bytes) equivale a caracteres.
+    matches_prefix = {"$eq": [{"$substr": ["$$token", 0, len(prefix)]}, prefix]}
+    return {
+        "search_score": {
+            "$size": {
+                "$filter": {
+                    "input": {"$ifNull": ["$title_tokens", []]},
+                    "as": "token",
+                    "cond": {"$or": [{"$in": ["$$token", complete]}, matches_prefix]},
+                }
+            }
+        }
+    }
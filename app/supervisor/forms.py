@@ -1,6 +1,9 @@
 from flask_wtf import FlaskForm
-from wtforms import TextAreaField, SelectField, SubmitField, StringField, DateField
+from wtforms import TextAreaField, SelectField, SelectMultipleField, SubmitField, StringField, DateField, BooleanField
 from wtforms.validators import DataRequired, Length, Optional
+from app import mongo
+from app.reference_data import get_statuses
+from app.ticket_service import BULK_ACTIONS, BULK_ASSIGN, BULK_STATUS
 
 class TicketEditForm(FlaskForm):
     description = TextAreaField('Descripción del Ticket', validators=[DataRequired(message="Este campo es obligatorio"), Length(min=10, max=500)])
@@ -15,16 +18,48 @@ class AssignTicketForm(FlaskForm):
     operator = SelectField('Asignar a:', validators=[DataRequired(message="Este campo es obligatorio")], choices=[])
     submit = SubmitField('Asignar Ticket', render_kw={"class": "btn btn-primary confirm-submit-btn"})
 
+class BulkTicketActionForm(FlaskForm):
+    # Los tickets seleccionados llegan de las casillas del listado; se validan al aplicar la acción
+    ticket_ids = SelectMultipleField('Tickets', choices=[], validate_choice=False,
+                                     validators=[DataRequired(message="Selecciona al menos un ticket.")])
+    action = SelectField('Acción', choices=list(BULK_ACTIONS.items()), validators=[DataRequired(message="Este campo es obligatorio")])
+    operator = SelectField('Operador', choices=[], validators=[Optional()])
+    status = SelectField('Estado', choices=[], validators=[Optional()])
+    submit = SubmitField('Aplicar a los seleccionados', render_kw={"class": "btn btn-primary btn-sm confirm-submit-btn"})
+
+    def load_choices(self):
+        """Operadores (una consulta) y estados (de la caché de datos de referencia)."""
+        operators = mongo.db.personas.find({"role": "operador"}, {"username": 1}).sort("username", 1)
+        self.operator.choices = [("", "--- Operador ---")] + [(str(p["_id"]), p["username"]) for p in operators]
+        self.status.choices = [("", "--- Estado ---")] + [(s["value"], s["name"]) for s in get_statuses()]
+        return self
+
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        if self.action.data == BULK_ASSIGN and not self.operator.data:
+            self.operator.errors.append("Selecciona el operador al que asignar los tickets.")
+            return False
+        if self.action.data == BULK_STATUS and not self.status.data:
+            self.status.errors.append("Selecciona el nuevo estado.")
+            return False
+        return True
+
+def _strip(value):
+    return value.strip() if isinstance(value, str) else value
+
 class TicketFilterForm(FlaskForm):
     class Meta:
         csrf = False
     ticket_id = StringField('ID', validators=[Optional(), Length(max=24)], render_kw={"placeholder": "Buscar por ID"})
-    search_title = StringField('Título', validators=[Optional(), Length(max=100)], render_kw={"placeholder": "Buscar en título"})
-    creator_username = StringField('Creador', validators=[Optional(), Length(max=64)], render_kw={"placeholder": "Buscar por usuario"})
-    category = SelectField('Categoría', choices=[])
-    status = SelectField('Estado', choices=[])
-    operator_username = StringField('Operador', validators=[Optional(), Length(max=64)], render_kw={"placeholder": "Buscar por operador"})
-    supervisor_username = StringField('Supervisor', validators=[Optional(), Length(max=64)], render_kw={"placeholder": "Buscar por supervisor"})
+    search_title = StringField('Buscar', validators=[Optional(), Length(max=100)], render_kw={"placeholder": "Buscar en título, descripción y notas"})
+    creator_username = StringField('Creador', validators=[Optional(), Length(max=64)], filters=[_strip], render_kw={"placeholder": "Buscar por usuario"})
+    # Optional: un parámetro ausente en la URL no invalida el resto de filtros
+    category = SelectField('Categoría', choices=[], validators=[Optional()])
+    status = SelectField('Estado', choices=[], validators=[Optional()])
+    operator_username = StringField('Operador', validators=[Optional(), Length(max=64)], filters=[_strip], render_kw={"placeholder": "Buscar por operador"})
+    supervisor_username = StringField('Supervisor', validators=[Optional(), Length(max=64)], filters=[_strip], render_kw={"placeholder": "Buscar por supervisor"})
+    exact_users = BooleanField('Usuario exacto', validators=[Optional()])
     start_date = DateField('Fecha Desde', format='%Y-%m-%d', validators=[Optional()])
     end_date = DateField('Fecha Hasta', format='%Y-%m-%d', validators=[Optional()])
     submit = SubmitField('Aplicar Filtros')
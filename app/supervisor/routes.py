@@ -2,14 +2,17 @@ from flask import render_template, flash, redirect, url_for, request
 from flask_login import login_required, current_user
 from app.supervisor import supervisor_bp
 from app import mongo
-from .forms import TicketEditForm, AssignTicketForm
+from .forms import TicketEditForm, AssignTicketForm, BulkTicketActionForm
 from app.auth.decorators import supervisor_or_admin_required
-from datetime import datetime, timezone
 from bson.objectid import ObjectId
 import pymongo
 import logging
-from app.utils import log_ticket_history
-from app.email import send_notification_email
+from app.utils import user_ref
+from app.notifications import DIGEST_TICKET_ASSIGNED
+from app.search import rebuild_search_fields
+from app.reference_data import get_statuses, get_categories, get_status, get_category_map
+from app.ticket_service import (update_ticket, claim_ticket, notification, bulk_update_tickets,
+                                BULK_ACTIONS, BULK_TAKE, BULK_ASSIGN, BULK_STATUS, BULK_CLOSE)
 
 logger = logging.getLogger(__name__)
 
@@ -39,10 +42,10 @@ def edit_ticket(ticket_id):
 
     # Poblar SelectFields del formulario
     try:
-        statuses = list(mongo.db.statuses.find().sort("name", 1))
+        statuses = get_statuses()
         form.status.choices = [('', '--- Seleccione un Estado ---')] + [(s['value'], s['name']) for s in statuses]
 
-        categories = list(mongo.db.categories.find().sort("name", 1))
+        categories = get_categories()
         form.category.choices = [('', '--- Seleccione una Categoría ---')] + [(c['value'], c['name']) for c in categories]
 
         # Obtener supervisores y operadores para los SelectFields
@@ -69,21 +72,20 @@ def edit_ticket(ticket_id):
             update_data = {
                 "description": form.description.data,
                 "category_value": form.category.data,
-                "status_value": form.status.data,
-                "updated_at": datetime.now(timezone.utc)
+                "status_value": form.status.data
             }
 
             # Manejar asignación de supervisor
             if form.supervisor.data:
                 supervisor_obj = mongo.db.personas.find_one({"_id": ObjectId(form.supervisor.data)})
-                update_data['supervisor'] = {"user_id": supervisor_obj['_id'], "username": supervisor_obj['username']}
+                update_data['supervisor'] = user_ref(supervisor_obj['_id'], supervisor_obj['username'])
             else:
                 update_data['supervisor'] = None
 
             # Manejar asignación de operador
             if form.operator.data:
                 operator_obj = mongo.db.personas.find_one({"_id": ObjectId(form.operator.data)})
-                update_data['operator'] = {"user_id": operator_obj['_id'], "username": operator_obj['username']}
+                update_data['operator'] = user_ref(operator_obj['_id'], operator_obj['username'])
             else:
                 update_data['operator'] = None
 
@@ -91,9 +93,18 @@ def edit_ticket(ticket_id):
             if 'observation' in form and form.observation.data:
                 update_data['observation'] = form.observation.data
             
-            mongo.db.tickets.update_one({"_id": ObjectId(ticket_id)}, {"$set": update_data})
-
-            log_ticket_history(ticket_id, "Edición de Ticket", current_user, f"Ticket editado por {current_user.username}")
+            # La descripción y la observación se reemplazan: el índice de búsqueda se recalcula
+            update_data.update(rebuild_search_fields(mongo.db, ticket, **{
+                field: update_data[field] for field in ('description', 'observation') if field in update_data
+            }))
+            updated = update_ticket(
+                ticket, current_user, "Edición de Ticket", f"Ticket editado por {current_user.username}",
+                set_fields=update_data,
+                expected={"status_value": ticket.get('status_value'), "category_value": ticket.get('category_value')}
+            )
+            if not updated:
+                flash('El ticket ha cambiado mientras lo editabas. Revisa su estado actual.', 'warning')
+                return redirect(url_for('supervisor_bp.edit_ticket', ticket_id=ticket_id))
 
             # Lógica de envío de correos (simplificada, a refactorizar)
             # send_notification_email(...)
@@ -137,7 +148,7 @@ def assign_ticket(ticket_id):
         operators = list(mongo.db.personas.find({"role": "operador"}).sort("username", 1))
         form.operator.choices = [('', '--- Seleccionar Operador ---')] + [(str(p['_id']), p['username']) for p in operators]
         
-        statuses = list(mongo.db.statuses.find())
+        statuses = get_statuses()
         status_map = {s['value']: s['name'] for s in statuses}
 
     except pymongo.errors.PyMongoError as e:
@@ -156,29 +167,37 @@ def assign_ticket(ticket_id):
                 flash('Operador seleccionado no válido.', 'danger')
                 return render_template('supervisor/assign_ticket.html', title='Asignar Ticket', form=form, ticket=ticket, status_map=status_map)
 
-            assigned_status = mongo.db.statuses.find_one({"value": "in_progress"})
+            assigned_status = get_status("in_progress")
             if not assigned_status:
                 flash('Error: El estado "En Progreso" no está configurado.', 'danger')
                 return redirect(url_for('admin_bp.list_tickets'))
 
             update_data = {
-                "operator": {"user_id": operator_obj['_id'], "username": operator_obj['username']},
-                "status_value": assigned_status['value'],
-                "updated_at": datetime.now(timezone.utc)
+                "operator": user_ref(operator_obj['_id'], operator_obj['username']),
+                "status_value": assigned_status['value']
             }
-            mongo.db.tickets.update_one({"_id": ObjectId(ticket_id)}, {"$set": update_data})
-
-            log_ticket_history(ticket_id, "Asignación de Operador", current_user, f"Ticket asignado a {operator_obj['username']}")
-
-            # --- ENVÍO DE CORREO AL OPERADOR ASIGNADO ---
-            send_notification_email(
-                subject='Ticket Asignado - [TuApp]',
-                recipients=[operator_obj['email']],
-                template='emails/ticket_assigned.html',
-                operator=operator_obj,
-                ticket=ticket,
-                supervisor=current_user
+            # --- CORREO AL OPERADOR ASIGNADO (o aviso en su resumen), en la misma escritura ---
+            operator_notification = notification(
+                operator_obj, DIGEST_TICKET_ASSIGNED, {**ticket, **update_data},
+                'Ticket Asignado - [TuApp]',
+                'emails/ticket_assigned.html',
+                operator_name=operator_obj['username'],
+                category_map=get_category_map(),
+                supervisor_name=current_user.username
             )
+            # Solo se asigna si el operador y el estado siguen como se leyeron: si otro supervisor
+            # lo asignó entretanto, gana el primero
+            claimed = claim_ticket(
+                ticket_id, "operator", update_data['operator'],
+                current_user, "Asignación de Operador", f"Ticket asignado a {operator_obj['username']}",
+                current=ticket.get('operator'),
+                set_fields={"status_value": update_data['status_value']},
+                expected={"status_value": ticket.get('status_value')},
+                notifications=[operator_notification]
+            )
+            if not claimed:
+                flash('El ticket ha cambiado mientras lo asignabas. Revisa su estado actual.', 'warning')
+                return redirect(url_for('admin_bp.list_tickets'))
 
             flash(f"Ticket {ticket_id} asignado a {operator_obj['username']} y estado cambiado a \"{assigned_status['name']}\".", 'success')
             return redirect(url_for('admin_bp.list_tickets'))
@@ -195,45 +214,79 @@ def assign_ticket(ticket_id):
 def take_ticket(ticket_id):
     logger.info(f"--- Intento de tomar ticket {ticket_id} por usuario {current_user.username} ---")
     try:
-        ticket = mongo.db.tickets.find_one({"_id": ObjectId(ticket_id)})
+        # Reclamación atómica: solo se asigna si el ticket sigue sin supervisor. Con varios
+        # supervisores tomando de la cola a la vez, exactamente uno lo consigue.
+        ticket = claim_ticket(
+            ticket_id, "supervisor", user_ref(current_user.id, current_user.username),
+            current_user, "Ticket Tomado", f"El supervisor {current_user.username} ha tomado el ticket."
+        )
+
+        if ticket:
+            logger.info(f"Take Ticket: Ticket {ticket_id} tomado por {current_user.username}.")
+            flash(f'Has tomado el ticket #{ticket_id}. Ahora está en tu lista de tickets.', 'success')
+        else:
+            # Solo quien pierde la reclamación hace esta segunda consulta, para explicar por qué
+            existing = mongo.db.tickets.find_one({"_id": ObjectId(ticket_id)}, {"supervisor": 1})
+            if not existing:
+                logger.warning(f"Take Ticket: Ticket {ticket_id} no encontrado en la base de datos.")
+                flash('Ticket no encontrado.', 'danger')
+            else:
+                logger.warning(f"Take Ticket: Ticket {ticket_id} ya está asignado a {(existing.get('supervisor') or {}).get('username')}.")
+                flash('Este ticket ya ha sido asignado a otro supervisor.', 'warning')
 
-        if not ticket:
-            logger.warning(f"Take Ticket: Ticket {ticket_id} no encontrado en la base de datos.")
-            flash('Ticket no encontrado.', 'danger')
-            return redirect(url_for('admin_bp.list_tickets'))
+    except Exception as e:
+        logger.error(f"Error excepcional al tomar el ticket {ticket_id}: {e}", exc_info=True)
+        flash('Ocurrió un error excepcional al intentar tomar el ticket.', 'danger')
 
-        logger.info(f"Take Ticket: Ticket {ticket_id} encontrado.")
+    return redirect(url_for('admin_bp.list_tickets'))
 
-        if ticket.get('supervisor'):
-            logger.warning(f"Take Ticket: Ticket {ticket_id} ya está asignado a {ticket.get('supervisor', {}).get('username')}.")
-            flash('Este ticket ya ha sido asignado a otro supervisor.', 'warning')
-            return redirect(url_for('admin_bp.list_tickets'))
+@supervisor_bp.route('/tickets/bulk', methods=['POST'])
+@login_required
+@supervisor_or_admin_required
+def bulk_tickets():
+    form = BulkTicketActionForm()
+    try:
+        form.load_choices()
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error al cargar opciones de la acción masiva: {e}")
+        flash("Error al cargar las opciones de la acción masiva.", "danger")
+        return redirect(url_for('admin_bp.list_tickets'))
 
-        # Asignar el supervisor actual al ticket
-        update_data = {
-            "supervisor": {
-                "user_id": ObjectId(current_user.id),
-                "username": current_user.username
-            },
-            "updated_at": datetime.now(timezone.utc)
-        }
-        logger.info(f"Take Ticket: Preparando la actualización para ticket {ticket_id} con los datos: {update_data}")
-
-        result = mongo.db.tickets.update_one({"_id": ObjectId(ticket_id)}, {"$set": update_data})
-        
-        logger.info(f"Take Ticket: Resultado de la actualización: matched_count={result.matched_count}, modified_count={result.modified_count}")
+    if not form.validate_on_submit():
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error, 'warning')
+        return redirect(request.referrer or url_for('admin_bp.list_tickets'))
 
-        if result.modified_count == 1:
-            # Registrar en el historial
-            log_ticket_history(ticket_id, "Ticket Tomado", current_user, f"El supervisor {current_user.username} ha tomado el ticket.")
-            logger.info(f"Take Ticket: Historial registrado para ticket {ticket_id}.")
-            flash(f'Has tomado el ticket #{ticket_id}. Ahora está en tu lista de tickets.', 'success')
-        else:
-            logger.error(f"Take Ticket: La actualización del ticket {ticket_id} no modificó ningún documento.")
-            flash('Hubo un problema al intentar asignar el ticket. No se pudo actualizar.', 'danger')
-        
+    action = form.action.data
+    operator = None
+    status = None
+    try:
+        if action == BULK_ASSIGN:
+            operator = mongo.db.personas.find_one({"_id": ObjectId(form.operator.data), "role": "operador"},
+                                                  {"username": 1, "email": 1, "notification_digest": 1})
+            if not operator:
+                flash('Operador seleccionado no válido.', 'danger')
+                return redirect(url_for('admin_bp.list_tickets'))
+            status = get_status("in_progress")
+        elif action == BULK_STATUS:
+            status = get_status(form.status.data)
+        elif action == BULK_CLOSE:
+            status = get_status("closed")
+        if action != BULK_TAKE and not status:
+            flash('Error: el estado de destino no está configurado.', 'danger')
+            return redirect(url_for('admin_bp.list_tickets'))
+
+        report = bulk_update_tickets(
+            form.ticket_ids.data, current_user, action, operator=operator, status=status,
+            status_map={s['value']: s['name'] for s in get_statuses()}, category_map=get_category_map()
+        )
     except Exception as e:
-        logger.error(f"Error excepcional al tomar el ticket {ticket_id}: {e}", exc_info=True)
-        flash('Ocurrió un error excepcional al intentar tomar el ticket.', 'danger')
+        logger.error(f"Error en la acción masiva '{action}': {e}", exc_info=True)
+        flash('Ocurrió un error al aplicar la acción a los tickets seleccionados.', 'danger')
+        return redirect(url_for('admin_bp.list_tickets'))
 
-    return redirect(url_for('admin_bp.list_tickets'))
\ No newline at end of file
+    applied = sum(1 for entry in report if entry['ok'])
+    flash(f"{BULK_ACTIONS[action]}: {applied} de {len(report)} tickets modificados.", 'success' if applied == len(report) else 'warning')
+    return render_template('supervisor/bulk_report.html', title='Resultado de la acción masiva',
+                           action_name=BULK_ACTIONS[action], report=report)
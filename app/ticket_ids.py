@@ -0,0 +1,82 @@
+# app/ticket_ids.py
+
+import re
+import threading
+from bson.objectid import ObjectId
+from flask import current_app
+from pymongo import ReturnDocument
+
+# --- Identificadores cortos de los tickets ---
+# Cada ticket recibe un número correlativo ('ticket_number') fácil de dictar o escribir.
+# Los números se reservan por bloques en el documento contador de la colección
+# 'counters': cada proceso pide un bloque con un único $inc y lo consume en memoria,
+# de modo que las altas de tickets no compiten por el mismo documento.
+# Consecuencia: con varios workers la numeración no sigue exactamente el orden de
+# creación y, al reiniciar un proceso, los números que quedaban en su bloque se pierden.
+
+COUNTER_ID = "ticket_number"
+DEFAULT_BLOCK_SIZE = 20
+
+_HEX_RE = re.compile(r"[0-9a-f]{1,24}")
+# Hasta 18 dígitos cabe siempre en un entero de 64 bits de BSON
+MAX_TICKET_NUMBER_DIGITS = 18
+
+
+def reserve_block(db, size):
+    """Reserva `size` números consecutivos en el contador. Devuelve (primero, último)."""
+    counter = db.counters.find_one_and_update(
+        {"_id": COUNTER_ID},
+        {"$inc": {"seq": size}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    last = counter["seq"]
+    return last - size + 1, last
+
+
+class TicketNumberAllocator:
+    """Reparte los números de un bloque reservado y pide uno nuevo cuando se agota."""
+
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = None
+        self._last = None
+
+    def allocate(self, db):
+        with self._lock:
+            if self._next is None or self._next > self._last:
+                self._next, self._last = reserve_block(db, self.block_size)
+            number = self._next
+            self._next += 1
+            return number
+
+
+def next_ticket_number(db):
+    """Devuelve el siguiente número de ticket usando el asignador de la aplicación actual."""
+    allocator = current_app.extensions.get("ticket_numbers")
+    if allocator is None:
+        allocator = TicketNumberAllocator(current_app.config.get("TICKET_NUMBER_BLOCK_SIZE", DEFAULT_BLOCK_SIZE))
+        current_app.extensions["ticket_numbers"] = allocator
+    return allocator.allocate(db)
+
+
+def ticket_id_filter(text):
+    """
+    Traduce lo que el usuario escribe en el filtro "ID" a una consulta indexada:
+      - un prefijo hexadecimal del ObjectId se convierte en un rango sobre '_id'
+        (el orden de los ObjectId coincide con el de su representación hexadecimal);
+      - si además son solo dígitos (y caben en un entero de 64 bits), también se
+        busca como número de ticket.
+    Devuelve None si el texto no puede ser ni un número ni un prefijo de ID.
+    """
+    value = (text or "").strip().lstrip("#").lower()
+    if not _HEX_RE.fullmatch(value):
+        return None
+    id_range = {"_id": {
+        "$gte": ObjectId(value.ljust(24, "0")),
+        "$lte": ObjectId(value.ljust(24, "f")),
+    }}
+    if value.isdigit() and len(value) <= MAX_TICKET_NUMBER_DIGITS:
+        return {"$or": [{"ticket_number": int(value)}, id_range]}
+    return id_range
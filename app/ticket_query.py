@@ -0,0 +1,156 @@
+# app/ticket_query.py
+
+from datetime import datetime
+from bson.objectid import ObjectId
+from flask import current_app
+from app.pagination import paginate, TICKET_SORT
+from app.reference_data import get_statuses, get_categories
+from app.search import search_query, relevance_fields, SEARCH_SORT
+from app.ticket_ids import ticket_id_filter
+from app.utils import username_filter
+
+# --- Consulta de los listados y exportaciones de tickets ---
+# Todas las vistas de tickets (listado de admin/supervisor, "Mis tickets" del cliente y
+# del operador, y las exportaciones) traducen el TicketFilterForm con TicketQuery, de modo
+# que cada combinación de filtros produce siempre la misma forma de consulta y el mismo
+# plan. La consulta se construye en el orden de los índices compuestos de app/indexes.py
+# (igualdad, orden, rango):
+#   - igualdad: visibilidad del rol ('<rol>.user_id'), estado, categoría, número de ticket;
+#   - orden: TICKET_SORT (created_at, _id), o la relevancia si hay búsqueda de texto;
+#   - rango: fechas, prefijos de nombre de usuario ('username_lower') y del ID, y el
+#     prefijo de la búsqueda (expresión regular anclada y escapada).
+# Cada consulta lleva además un presupuesto de tiempo (maxTimeMS) para que un filtro que
+# no encuentre índice falle pronto en lugar de ocupar el servidor.
+
+DEFAULT_MAX_TIME_MS = 5000
+
+# Filtros de nombre de usuario que ofrece cada rol (los que no son él mismo).
+USERNAME_FILTERS = {
+    "admin": ("creator", "operator", "supervisor"),
+    "supervisor": ("creator", "operator", "supervisor"),
+    "operador": ("creator",),
+    "cliente": ("operator", "supervisor"),
+}
+
+
+def set_filter_choices(form):
+    """Rellena los choices de estado y categoría del formulario. Devuelve (estados, categorías)."""
+    statuses = get_statuses()
+    categories = get_categories()
+    form.status.choices = [('', 'Todos los Estados')] + [(s['value'], s['name']) for s in statuses]
+    form.category.choices = [('', 'Todas las Categorías')] + [(c['value'], c['name']) for c in categories]
+    return statuses, categories
+
+
+def visibility_filter(user):
+    """Tickets que `user` puede ver según su rol ({} para el administrador)."""
+    if user.is_admin:
+        return {}
+    user_id = ObjectId(user.id)
+    if user.is_supervisor:
+        # Tickets propios o sin supervisor asignado (índices supervisor_created_at y supervisor_null_created_at)
+        return {"$or": [{"supervisor.user_id": user_id}, {"supervisor": None}]}
+    if user.is_operator:
+        return {"operator.user_id": user_id}
+    return {"creator.user_id": user_id}
+
+
+def date_range(start_date, end_date):
+    """
+    Rango sobre 'created_at' para las fechas del filtro. Con una sola fecha se filtra
+    ese día completo. Devuelve None si no hay fechas.
+    """
+    if not start_date and not end_date:
+        return None
+    start_date = start_date or end_date
+    end_date = end_date or start_date
+    return {
+        "$gte": datetime.combine(start_date, datetime.min.time()),
+        "$lte": datetime.combine(end_date, datetime.max.time())
+    }
+
+
+class TicketQuery:
+    """
+    Consulta, orden y opciones de un listado de tickets a partir de un TicketFilterForm
+    (ya con sus choices) y del usuario actual.
+    Si el formulario no es válido solo se aplica la visibilidad del rol.
+    Los avisos para el usuario (p. ej. un ID inválido) quedan en `warnings`.
+    """
+
+    def __init__(self, form, user, max_time_ms=None):
+        self.form = form
+        self.user = user
+        self.max_time_ms = max_time_ms if max_time_ms is not None else current_app.config.get(
+            "TICKET_QUERY_MAX_TIME_MS", DEFAULT_MAX_TIME_MS)
+        self.search_tokens = []
+        self.warnings = []
+        self.filter = self._build()
+
+    def _build(self):
+        form = self.form
+        visibility = visibility_filter(self.user)
+        if not form.validate():
+            return visibility
+
+        equality = {}
+        ranges = {}
+
+        # Igualdad: la visibilidad del rol primero (salvo el $or del supervisor, que va al final)
+        if "$or" not in visibility:
+            equality.update(visibility)
+        if form.status.data:
+            equality["status_value"] = form.status.data
+        if form.category.data:
+            equality["category_value"] = form.category.data
+        if form.ticket_id.data:
+            # Número de ticket (igualdad) o prefijo del ObjectId (rango sobre _id)
+            id_filter = ticket_id_filter(form.ticket_id.data)
+            if id_filter:
+                equality.update(id_filter)
+            else:
+                self.warnings.append("ID de Ticket inválido.")
+
+        # Rango
+        if form.search_title.data:
+            search_filter, self.search_tokens = search_query(form.search_title.data)
+            if search_filter:
+                ranges.update(search_filter)
+        for role_field in USERNAME_FILTERS.get(self.user.role, ()):
+            user_filter = username_filter(role_field, getattr(form, f"{role_field}_username").data, form.exact_users.data)
+            if user_filter:
+                ranges.update(user_filter)
+        created_at = date_range(form.start_date.data, form.end_date.data)
+        if created_at:
+            ranges["created_at"] = created_at
+
+        query = {**equality, **ranges}
+        if "$or" in visibility:
+            return {"$and": [query, visibility]} if query else visibility
+        return query
+
+    @property
+    def sort(self):
+        return SEARCH_SORT if self.search_tokens else TICKET_SORT
+
+    @property
+    def computed_fields(self):
+        """Relevancia de la búsqueda de texto, o None si no hay búsqueda."""
+        return relevance_fields(self.search_tokens) if self.search_tokens else None
+
+    def page(self, collection, args, projection):
+        """Página de resultados (ver app.pagination.paginate)."""
+        return paginate(collection, self.filter, args, sort=self.sort, projection=projection,
+                        computed_fields=self.computed_fields, max_time_ms=self.max_time_ms)
+
+    def cursor(self, collection, projection, batch_size=None, max_time_ms=None):
+        """
+        Cursor con todos los resultados en el orden del listado (para exportaciones).
+        Sin presupuesto de tiempo salvo que se indique: una exportación recorre todos los resultados.
+        """
+        cursor = collection.find(self.filter, projection).sort(TICKET_SORT)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        if max_time_ms:
+            cursor = cursor.max_time_ms(max_time_ms)
+        return cursor
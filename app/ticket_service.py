@@ -0,0 +1,376 @@
+# app/ticket_service.py
+
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+from app import mongo
+from app.email import outbox_document, dispatch_email, OUTBOX_COLLECTION
+from app.notifications import (wants_digest, digest_entry, DIGEST_COLLECTION, DIGEST_TICKET_CREATED,
+                               DIGEST_TICKET_ASSIGNED, DIGEST_TICKET_UPDATED)
+from app.reference_data import get_category, get_supervisor_route
+from app.search import ticket_search_fields, add_search_tokens
+from app.ticket_ids import next_ticket_number
+from app.ticket_query import visibility_filter
+from app.ticket_stats import stats_update, stats_shard, STATS_COLLECTION
+from app.utils import build_history_entry, user_ref
+from app.write_batch import WriteBatch
+
+logger = logging.getLogger(__name__)
+
+# --- Alta y cambios de tickets ---
+# Crear un ticket no consulta la base de datos: la categoría y el supervisor que le
+# corresponde por (categoría, turno) salen de la caché de datos de referencia
+# (get_supervisor_route), y el número de ticket del bloque reservado (next_ticket_number).
+# Todo lo que escribe el alta -el ticket, su entrada de historial, los contadores de
+# 'ticket_stats' y el aviso al supervisor (correo en la bandeja de salida o entrada de su
+# resumen)- va en un único WriteBatch: un solo viaje a MongoDB (8.0+) y, como es ordenado,
+# el historial y el aviso no se escriben si falla la inserción del ticket.
+#
+# Los cambios posteriores (edición, asignación, actualización del operador, rechazo, notas,
+# cierre...) pasan por update_ticket(): primero la actualización condicionada del ticket y,
+# solo si se aplicó, la entrada de historial, los contadores y los avisos en un lote. Así
+# nunca se avisa (ni se cuenta) un cambio que no llegó a hacerse; lo peor, si el proceso
+# cae entre las dos escrituras, es un cambio sin su entrada de historial.
+#
+# Tomar un ticket o asignarle un operador es una reclamación: claim_ticket() la hace con un
+# find_one_and_update condicionado a que el puesto siga como se leyó (sin asignar, por
+# defecto). Si dos supervisores se adelantan a la vez, solo uno cumple el filtro; el otro
+# recibe None sin haber escrito nada. El historial y los avisos del ganador se escriben
+# después, en un lote.
+#
+# Las acciones masivas del listado (bulk_update_tickets) aplican el mismo cambio a varios
+# tickets: las actualizaciones condicionadas van en un lote y, después, solo para los
+# tickets que se modificaron, un segundo lote con sus entradas de historial, los contadores
+# y un único aviso por operador afectado.
+#
+# El historial sigue en 'ticket_history' (no dentro del ticket), como el resto de entradas.
+
+CREATED_CHANGE_TYPE = "Creación de Ticket"
+CREATED_DETAILS = "Ticket creado por el cliente."
+CREATED_EMAIL_TEMPLATE = "emails/ticket_created.html"
+
+
+def new_ticket(creator, title, description, category_value, shift, status_value, supervisor=None):
+    """Documento de un ticket nuevo (con su _id ya asignado), sin guardarlo."""
+    now = datetime.now(timezone.utc)
+    return {
+        "_id": ObjectId(),
+        "ticket_number": next_ticket_number(mongo.db),
+        "title": title,
+        "description": description,
+        "category_value": category_value,
+        "shift": shift,
+        "status_value": status_value,
+        "creator": user_ref(creator.id, creator.username),
+        "supervisor": user_ref(supervisor["_id"], supervisor["username"]) if supervisor else None,
+        "operator": None,
+        "created_at": now,
+        "updated_at": now,
+        **ticket_search_fields(title, description)
+    }
+
+
+def notification(recipient, digest_kind, ticket, subject, template, **context):
+    """
+    Escritura (colección, documento) que avisa a `recipient` de un cambio en `ticket`: una
+    entrada de su resumen si lo tiene activado o, si no, un correo de la bandeja de salida.
+    """
+    if wants_digest(recipient):
+        return DIGEST_COLLECTION, digest_entry(recipient, digest_kind, ticket)
+    return OUTBOX_COLLECTION, outbox_document(subject, [recipient["email"]], template, ticket=ticket, **context)
+
+
+def _dispatch(writes):
+    for collection_name, document in writes:
+        if collection_name == OUTBOX_COLLECTION:
+            dispatch_email(document["_id"])
+
+
+def _add_change_writes(batch, before, after, changed_by, change_type, details, notifications):
+    """Añade a `batch` la entrada de historial, los contadores y los avisos de un cambio. Devuelve la entrada."""
+    history_entry = build_history_entry(before["_id"], change_type, changed_by, details)
+    batch.insert_one("ticket_history", history_entry)
+    stats = stats_update(before.get("status_value"), after.get("status_value"),
+                         before.get("category_value"), after.get("category_value"))
+    if stats:
+        batch.update_one(STATS_COLLECTION, *stats, upsert=True)
+    for collection_name, document in notifications:
+        batch.insert_one(collection_name, document)
+    return history_entry
+
+
+def create_ticket(creator, title, description, category_value, shift, status_value, status_map=None, category_map=None):
+    """
+    Crea un ticket asignado al supervisor de su categoría y turno (si lo hay) y le avisa.
+    Devuelve (ticket, supervisor); supervisor es None si no hay regla de asignación.
+    `status_map` y `category_map` son para la plantilla del correo.
+    """
+    category = get_category(category_value)
+    supervisor = get_supervisor_route(category["_id"], shift) if category else None
+    ticket = new_ticket(creator, title, description, category_value, shift, status_value, supervisor)
+
+    batch = WriteBatch(mongo.db)
+    batch.insert_one("tickets", ticket)
+    batch.insert_one("ticket_history", build_history_entry(ticket["_id"], CREATED_CHANGE_TYPE, creator, CREATED_DETAILS))
+    stats = stats_update(new_status=status_value, new_category=category_value)
+    if stats:
+        batch.update_one(STATS_COLLECTION, *stats, upsert=True)
+
+    notifications = []
+    if supervisor:
+        notifications.append(notification(
+            supervisor, DIGEST_TICKET_CREATED, ticket,
+            f"Nuevo Ticket Creado: #{ticket['_id']}",
+            CREATED_EMAIL_TEMPLATE,
+            supervisor_name=supervisor["username"],
+            client_name=creator.username,
+            status_map=status_map or {},
+            category_map=category_map or {}
+        ))
+    for collection_name, document in notifications:
+        batch.insert_one(collection_name, document)
+
+    batch.execute()
+    _dispatch(notifications)
+
+    if supervisor:
+        logger.info(f"Ticket #{ticket['ticket_number']} asignado automáticamente al supervisor '{supervisor['username']}' por regla.")
+    else:
+        logger.info(f"Ticket #{ticket['ticket_number']} sin supervisor por regla. Queda pendiente.")
+    return ticket, supervisor
+
+
+def update_ticket(ticket, changed_by, change_type, details="", set_fields=None, search_text=None,
+                  expected=None, notifications=()):
+    """
+    Aplica un cambio a `ticket` (el documento leído) y registra su entrada de historial.
+
+    `set_fields` es el $set (updated_at se añade aquí) y `search_text`, un texto que se anexa
+    al índice de búsqueda. `expected` son condiciones del filtro además del _id, p. ej.
+    {"status_value": ticket["status_value"]} para no pisar un cambio concurrente.
+    `notifications` son escrituras creadas con notification().
+
+    Devuelve True si el ticket cumplía el filtro. Si no lo cumplía, no se escribe nada más:
+    el historial, los contadores y los avisos solo se escriben tras un cambio aplicado.
+    """
+    set_fields = dict(set_fields or {})
+    set_fields["updated_at"] = datetime.now(timezone.utc)
+    update = {"$set": set_fields}
+    if search_text:
+        update["$addToSet"] = add_search_tokens(search_text)
+
+    result = mongo.db.tickets.update_one({"_id": ticket["_id"], **(expected or {})}, update)
+    if not result.matched_count:
+        logger.info(f"El ticket {ticket['_id']} cambió antes de aplicar '{change_type}'; se descarta el cambio.")
+        return False
+
+    batch = WriteBatch(mongo.db)
+    _add_change_writes(batch, ticket, {**ticket, **set_fields}, changed_by, change_type, details, notifications)
+    batch.execute()
+    _dispatch(notifications)
+    return True
+
+
+def assigned_to(field, current):
+    """Filtro de que `field` ('supervisor' u 'operator') siga asignado a `current` (un user_ref, o None)."""
+    if current is None:
+        return {field: None}
+    return {f"{field}.user_id": current["user_id"]}
+
+
+def claim_ticket(ticket_id, field, assignee, changed_by, change_type, details="", current=None,
+                 set_fields=None, expected=None, notifications=()):
+    """
+    Asigna `assignee` (un user_ref) al puesto `field` del ticket si sigue asignado a
+    `current` (por defecto, a nadie) y cumple `expected`, en una sola operación atómica.
+    `set_fields` son otros campos que cambian a la vez (p. ej. el estado).
+
+    Devuelve el ticket ya actualizado, o None si no existe o ya no cumplía el filtro
+    (otro usuario se adelantó); en ese caso no se escribe nada más.
+    """
+    set_fields = {**(set_fields or {}), field: assignee, "updated_at": datetime.now(timezone.utc)}
+    # Se pide el documento anterior para calcular los contadores; el actualizado es {**anterior, **set_fields}
+    before = mongo.db.tickets.find_one_and_update(
+        {"_id": ObjectId(ticket_id), **assigned_to(field, current), **(expected or {})},
+        {"$set": set_fields},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
+        return None
+    ticket = {**before, **set_fields}
+
+    batch = WriteBatch(mongo.db)
+    _add_change_writes(batch, before, ticket, changed_by, change_type, details, notifications)
+    batch.execute()
+    _dispatch(notifications)
+    return ticket
+
+
+# --- Acciones masivas ---
+
+BULK_TAKE = "take"
+BULK_ASSIGN = "assign"
+BULK_STATUS = "status"
+BULK_CLOSE = "close"
+
+BULK_ACTIONS = {
+    BULK_TAKE: "Tomar",
+    BULK_ASSIGN: "Asignar a operador",
+    BULK_STATUS: "Cambiar estado",
+    BULK_CLOSE: "Cerrar",
+}
+BULK_EMAIL_TEMPLATE = "emails/tickets_bulk_updated.html"
+BULK_PROJECTION = {"ticket_number": 1, "title": 1, "category_value": 1, "status_value": 1, "supervisor": 1, "operator": 1}
+
+
+def _combined_stats(changes):
+    """Una sola actualización de los contadores para varias transiciones (antes, después), o None."""
+    inc = Counter()
+    for before, after in changes:
+        update = stats_update(before.get("status_value"), after.get("status_value"),
+                              before.get("category_value"), after.get("category_value"))
+        if update:
+            inc.update(update[1]["$inc"])
+    inc = {field: value for field, value in inc.items() if value}
+    return (stats_shard(), {"$inc": inc}) if inc else None
+
+
+def _bulk_change(ticket, action, changed_by, operator=None, status=None):
+    """
+    (set_fields, expected, change_type, details) de `action` sobre `ticket`, o un texto
+    con el motivo si no se puede aplicar a este ticket.
+    """
+    if action == BULK_TAKE:
+        if ticket.get("supervisor"):
+            return f"Ya está asignado a {ticket['supervisor']['username']}."
+        return ({"supervisor": user_ref(changed_by.id, changed_by.username)}, {"supervisor": None},
+                "Ticket Tomado", f"El supervisor {changed_by.username} ha tomado el ticket (acción masiva).")
+
+    expected = {"status_value": ticket.get("status_value")}
+    if action == BULK_ASSIGN:
+        return ({"operator": user_ref(operator["_id"], operator["username"]), "status_value": status["value"]},
+                {**expected, **assigned_to("operator", ticket.get("operator"))},
+                "Asignación de Operador", f"Ticket asignado a {operator['username']} (acción masiva)")
+    if ticket.get("status_value") == status["value"]:
+        return f"Ya está en estado \"{status['name']}\"."
+    if action == BULK_CLOSE:
+        return ({"status_value": status["value"]}, expected,
+                "Cierre de Ticket", f"Ticket cerrado por {changed_by.username} (acción masiva)")
+    return ({"status_value": status["value"]}, expected,
+            "Cambio de Estado", f"Estado cambiado a {status['value']} por {changed_by.username} (acción masiva)")
+
+
+def _bulk_notifications(changed, action, changed_by, operator, status_map, category_map):
+    """
+    Un aviso por operador afectado con todos sus tickets: el operador asignado, o el de
+    cada ticket que cambió de estado. Los que prefieren resumen reciben una entrada por ticket.
+    """
+    if action == BULK_TAKE:
+        return []
+    by_operator = {}
+    for ticket in changed:
+        if ticket.get("operator"):
+            by_operator.setdefault(ticket["operator"]["user_id"], []).append(ticket)
+    if not by_operator:
+        return []
+
+    if action == BULK_ASSIGN:
+        recipients = {operator["_id"]: operator}
+    else:
+        recipients = {p["_id"]: p for p in mongo.db.personas.find(
+            {"_id": {"$in": list(by_operator)}}, {"username": 1, "email": 1, "notification_digest": 1})}
+
+    kind = DIGEST_TICKET_ASSIGNED if action == BULK_ASSIGN else DIGEST_TICKET_UPDATED
+    writes = []
+    for user_id, tickets in by_operator.items():
+        recipient = recipients.get(user_id)
+        if not recipient:
+            continue
+        if wants_digest(recipient):
+            writes.extend((DIGEST_COLLECTION, digest_entry(recipient, kind, ticket)) for ticket in tickets)
+            continue
+        writes.append((OUTBOX_COLLECTION, outbox_document(
+            f"{len(tickets)} ticket(s) actualizados - [TuApp]",
+            [recipient["email"]],
+            BULK_EMAIL_TEMPLATE,
+            username=recipient["username"],
+            action=BULK_ACTIONS[action],
+            supervisor_name=changed_by.username,
+            tickets=[{field: ticket.get(field) for field in ("_id", "ticket_number", "title", "category_value", "status_value")}
+                     for ticket in tickets],
+            status_map=status_map or {},
+            category_map=category_map or {}
+        )))
+    return writes
+
+
+def bulk_update_tickets(ticket_ids, changed_by, action, operator=None, status=None, status_map=None, category_map=None):
+    """
+    Aplica `action` (BULK_*) a los tickets `ticket_ids` que `changed_by` puede ver.
+    `operator` es el documento del operador (BULK_ASSIGN) y `status`, el estado de destino
+    (BULK_ASSIGN, BULK_STATUS y BULK_CLOSE).
+
+    Devuelve un informe por ticket, en el orden de `ticket_ids`:
+    [{"ticket_id", "ticket_number", "title", "ok", "message"}].
+    """
+    ticket_ids = list(dict.fromkeys(ticket_ids))
+    report = {}
+    object_ids = []
+    for ticket_id in ticket_ids:
+        if ObjectId.is_valid(ticket_id):
+            object_ids.append(ObjectId(ticket_id))
+        else:
+            report[ticket_id] = {"ticket_id": ticket_id, "ok": False, "message": "ID de ticket no válido."}
+    object_ids = list(dict.fromkeys(object_ids))
+
+    visibility = visibility_filter(changed_by)
+    tickets = {t["_id"]: t for t in mongo.db.tickets.find({"_id": {"$in": object_ids}, **visibility}, BULK_PROJECTION)}
+
+    # Primer lote: solo las actualizaciones condicionadas de los tickets
+    updates = WriteBatch(mongo.db)
+    planned = []  # (ticket, después, datos del historial)
+    for object_id in object_ids:
+        ticket = tickets.get(object_id)
+        entry = {"ticket_id": str(object_id), "ticket_number": ticket and ticket.get("ticket_number"),
+                 "title": ticket and ticket.get("title")}
+        report[str(object_id)] = entry
+        if not ticket:
+            entry.update(ok=False, message="No encontrado o sin permiso para modificarlo.")
+            continue
+        change = _bulk_change(ticket, action, changed_by, operator, status)
+        if isinstance(change, str):
+            entry.update(ok=False, message=change)
+            continue
+        set_fields, expected, change_type, details = change
+        set_fields["updated_at"] = datetime.now(timezone.utc)
+        updates.update_one("tickets", {"_id": object_id, **expected, **visibility}, {"$set": set_fields})
+        planned.append((ticket, {**ticket, **set_fields}, (change_type, details)))
+
+    counts = updates.execute()
+
+    changed = []
+    for (before, after, _), matched in zip(planned, counts):
+        if matched:
+            changed.append((before, after))
+            report[str(before["_id"])].update(ok=True, message="Aplicado.")
+        else:
+            report[str(before["_id"])].update(ok=False, message="El ticket cambió mientras tanto; no se ha modificado.")
+
+    # Segundo lote, solo para los tickets modificados: historial, contadores y un aviso por operador
+    side_effects = WriteBatch(mongo.db)
+    for (before, _, (change_type, details)), matched in zip(planned, counts):
+        if matched:
+            side_effects.insert_one("ticket_history", build_history_entry(before["_id"], change_type, changed_by, details))
+    stats = _combined_stats(changed)
+    if stats:
+        side_effects.update_one(STATS_COLLECTION, *stats, upsert=True)
+    notifications = _bulk_notifications([after for _, after in changed], action, changed_by, operator, status_map, category_map)
+    for collection_name, document in notifications:
+        side_effects.insert_one(collection_name, document)
+    side_effects.execute()
+    _dispatch(notifications)
+
+    logger.info(f"Acción masiva '{action}' de {changed_by.username}: {len(changed)} de {len(report)} tickets modificados.")
+    return [report.get(ticket_id) or report[str(ObjectId(ticket_id))] for ticket_id in ticket_ids]
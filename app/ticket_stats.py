@@ -0,0 +1,103 @@
+# app/ticket_stats.py
+
+import random
+from collections import Counter
+from datetime import datetime, timezone
+
+# --- Contadores de tickets por estado y por categoría ---
+# Los paneles (inicio y listado de tickets) muestran cuántos tickets hay en cada estado.
+# En lugar de un count_documents por estado en cada carga, la colección 'ticket_stats'
+# guarda los contadores repartidos en STATS_SHARDS documentos:
+#   {"_id": "tickets:<n>", "total": n, "by_status": {valor: n}, "by_category": {valor: n}}
+# Cada alta o cambio de estado/categoría suma con un único $inc atómico en uno de ellos,
+# elegido al azar (stats_update, que app.ticket_service envía en el mismo lote que la
+# escritura del ticket), para que las escrituras concurrentes no compitan por el mismo
+# documento; leerlos es una consulta por _id que suma todos los fragmentos.
+# Los contadores son globales: solo se muestran a los administradores.
+# `flask reconcile-ticket-stats` lo reconstruye desde cero con una sola agregación, por
+# ejemplo tras escrituras hechas fuera de la aplicación.
+
+STATS_COLLECTION = "ticket_stats"
+STATS_ID = "tickets"
+STATS_SHARDS = 8
+# Fragmentos, más el documento único 'tickets' de versiones anteriores (que se sigue sumando
+# hasta que `flask reconcile-ticket-stats` lo reparte)
+SHARD_IDS = [f"{STATS_ID}:{n}" for n in range(STATS_SHARDS)]
+
+
+def _stats_key(value):
+    # Los valores de estado y categoría son slugs; se evita que un '.' o '$' rompa la ruta del campo.
+    return str(value).replace(".", "_").replace("$", "_")
+
+
+def stats_increments(old_status=None, new_status=None, old_category=None, new_category=None):
+    """Incrementos ($inc) para un ticket que pasa de (old_status, old_category) a (new_status, new_category)."""
+    inc = {}
+    if old_status != new_status:
+        if old_status:
+            inc[f"by_status.{_stats_key(old_status)}"] = -1
+        if new_status:
+            inc[f"by_status.{_stats_key(new_status)}"] = 1
+    if old_category != new_category:
+        if old_category:
+            inc[f"by_category.{_stats_key(old_category)}"] = -1
+        if new_category:
+            inc[f"by_category.{_stats_key(new_category)}"] = 1
+    return inc
+
+
+def stats_update(old_status=None, new_status=None, old_category=None, new_category=None):
+    """
+    (filtro, actualización) de los contadores para una transición, o None si no cambia nada.
+    Un alta es un cambio desde (None, None). Se aplica con upsert.
+    """
+    inc = stats_increments(old_status, new_status, old_category, new_category)
+    if old_status is None and new_status:
+        inc["total"] = 1
+    if not inc:
+        return None
+    return stats_shard(), {"$inc": inc}
+
+
+def stats_shard():
+    """Filtro de un fragmento de los contadores elegido al azar."""
+    return {"_id": random.choice(SHARD_IDS)}
+
+
+def get_ticket_stats(db):
+    """Contadores actuales (suma de los fragmentos): {"total": n, "by_status": {...}, "by_category": {...}}."""
+    total, by_status, by_category = 0, Counter(), Counter()
+    for doc in db[STATS_COLLECTION].find({"_id": {"$in": SHARD_IDS + [STATS_ID]}}):
+        total += doc.get("total", 0)
+        by_status.update(doc.get("by_status", {}))
+        by_category.update(doc.get("by_category", {}))
+    return {
+        "total": total,
+        "by_status": {value: count for value, count in by_status.items() if count},
+        "by_category": {value: count for value, count in by_category.items() if count},
+    }
+
+
+def rebuild_ticket_stats(db):
+    """
+    Recalcula los contadores con una única agregación sobre 'tickets', los guarda en el primer
+    fragmento y borra el resto (y el documento único de versiones anteriores). Los cambios que se produzcan mientras se ejecuta pueden perderse: conviene lanzarlo con poca actividad.
+    """
+    result = next(db.tickets.aggregate([
+        {"$facet": {
+            "by_status": [{"$group": {"_id": "$status_value", "count": {"$sum": 1}}}],
+            "by_category": [{"$group": {"_id": "$category_value", "count": {"$sum": 1}}}],
+            "total": [{"$count": "count"}],
+        }}
+    ], allowDiskUse=True), {})
+
+    stats = {
+        "_id": SHARD_IDS[0],
+        "total": (result.get("total") or [{"count": 0}])[0]["count"],
+        "by_status": {_stats_key(g["_id"]): g["count"] for g in result.get("by_status", []) if g["_id"]},
+        "by_category": {_stats_key(g["_id"]): g["count"] for g in result.get("by_category", []) if g["_id"]},
+        "rebuilt_at": datetime.now(timezone.utc),
+    }
+    db[STATS_COLLECTION].replace_one({"_id": SHARD_IDS[0]}, stats, upsert=True)
+    db[STATS_COLLECTION].delete_many({"_id": {"$in": SHARD_IDS[1:] + [STATS_ID]}})
+    return stats
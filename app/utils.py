@@ -3,27 +3,51 @@
 from datetime import datetime, timezone
 from app import mongo
 from bson.objectid import ObjectId
-from flask import current_app
 
-def log_ticket_history(ticket_id, change_type, changed_by_user, details=""):
+def user_ref(user_id, username):
     """
-    Añade una entrada de historial a un ticket en MongoDB.
-    El historial se guarda como un array de sub-documentos dentro del ticket.
+    Subdocumento con el que un ticket referencia a un usuario (creator, supervisor, operator).
+    'username_lower' es una copia normalizada del nombre para filtrar por prefijo con índice.
     """
-    try:
-        history_entry = {
-            "entry_id": ObjectId(),
-            "change_type": change_type,
-            "changed_by": {
-                "user_id": ObjectId(changed_by_user.id),
-                "username": changed_by_user.username
-            },
-            "timestamp": datetime.now(timezone.utc),
-            "details": details
-        }
-        mongo.db.tickets.update_one(
-            {"_id": ObjectId(ticket_id)},
-            {"$push": {"history": {"$each": [history_entry], "$position": 0}}} # Añade al principio
-        )
-    except Exception as e:
-        current_app.logger.error(f"Error al registrar historial para ticket {ticket_id}: {e}", exc_info=True)
\ No newline at end of file
+    return {
+        "user_id": ObjectId(user_id),
+        "username": username,
+        "username_lower": username.lower()
+    }
+
+def username_filter(role_field, username, exact=False):
+    """
+    Filtro de los listados por el nombre del usuario de `role_field` ('creator', 'operator'
+    o 'supervisor'). Por defecto busca tickets cuyo nombre empieza por `username` sin
+    distinguir mayúsculas, como rango sobre '<rol>.username_lower'. Con `exact`, resuelve
+    el nombre a su user_id una sola vez y filtra por '<rol>.user_id'.
+    Devuelve None (sin filtro) si el nombre queda vacío.
+    """
+    username = (username or "").strip()
+    if not username:
+        return None
+    if exact:
+        persona = mongo.db.personas.find_one({"username": username}, {"_id": 1})
+        # Si el usuario no existe, el filtro no debe devolver ningún ticket
+        return {f"{role_field}.user_id": persona["_id"] if persona else {"$in": []}}
+    prefix = username.lower()
+    upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return {f"{role_field}.username_lower": {"$gte": prefix, "$lt": upper_bound}}
+
+def build_history_entry(ticket_id, change_type, changed_by_user, details=""):
+    """
+    Construye el documento de una entrada de historial de la colección 'ticket_history'.
+    Cada entrada es un documento propio, indexado por (ticket_id, timestamp), para que el
+    documento del ticket no crezca con cada cambio.
+    """
+    return {
+        "_id": ObjectId(),
+        "ticket_id": ObjectId(ticket_id),
+        "change_type": change_type,
+        "changed_by": {
+            "user_id": ObjectId(changed_by_user.id),
+            "username": changed_by_user.username
+        },
+        "timestamp": datetime.now(timezone.utc),
+        "details": details
+    }
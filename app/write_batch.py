@@ -0,0 +1,104 @@
+# app/write_batch.py
+
+from flask import current_app
+from pymongo import InsertOne, UpdateOne, DeleteOne
+
+# --- Escrituras en varias colecciones en un solo viaje ---
+# Una acción sobre un ticket escribe en varias colecciones: el propio ticket, su entrada
+# en 'ticket_history', los contadores de 'ticket_stats', la bandeja de correo... Enviadas
+# una a una, cada escritura es un viaje de red más y, si el proceso falla entre dos de
+# ellas, el ticket queda sin su historial.
+#
+# WriteBatch acumula esas escrituras y las envía juntas. Con MongoDB 8.0 o superior usa el
+# bulkWrite de cliente (MongoClient.bulk_write), que admite operaciones sobre varias
+# colecciones en un único comando: un solo viaje, ordenado (si una operación falla, las
+# siguientes no se ejecutan). Con servidores anteriores (o mongomock) cada operación se
+# envía por separado, en el mismo orden y con la misma regla.
+
+CLIENT_BULK_WRITE_MIN_VERSION = 8
+
+
+def client_bulk_write_supported(client):
+    """True si el servidor admite MongoClient.bulk_write (se comprueba una vez por aplicación)."""
+    supported = current_app.extensions.get("client_bulk_write")
+    if supported is None:
+        version = client.server_info().get("versionArray") or [0]
+        supported = version[0] >= CLIENT_BULK_WRITE_MIN_VERSION
+        current_app.extensions["client_bulk_write"] = supported
+    return supported
+
+
+class WriteBatch:
+    """
+    Escrituras ordenadas sobre colecciones de `db`. execute() devuelve, por cada operación
+    y en el orden en que se añadieron, cuántos documentos afectó (insertados, o que
+    cumplían el filtro de una actualización o un borrado).
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._ops = []
+
+    def __len__(self):
+        return len(self._ops)
+
+    def _add(self, kind, collection_name, **args):
+        self._ops.append((kind, collection_name, args))
+        return len(self._ops) - 1
+
+    def insert_one(self, collection_name, document):
+        return self._add("insert", collection_name, document=document)
+
+    def update_one(self, collection_name, filter, update, upsert=False):
+        return self._add("update", collection_name, filter=filter, update=update, upsert=upsert)
+
+    def delete_one(self, collection_name, filter):
+        return self._add("delete", collection_name, filter=filter)
+
+    def execute(self):
+        if not self._ops:
+            return []
+        client = self.db.client
+        if client_bulk_write_supported(client):
+            return self._execute_client_bulk(client)
+        return self._execute_each()
+
+    def _execute_client_bulk(self, client):
+        models = []
+        for kind, collection_name, args in self._ops:
+            namespace = f"{self.db.name}.{collection_name}"
+            if kind == "insert":
+                models.append(InsertOne(args["document"], namespace=namespace))
+            elif kind == "update":
+                models.append(UpdateOne(args["filter"], args["update"], upsert=args["upsert"], namespace=namespace))
+            else:
+                models.append(DeleteOne(args["filter"], namespace=namespace))
+        result = client.bulk_write(models, ordered=True, verbose_results=True)
+
+        counts = []
+        for index, (kind, _, _) in enumerate(self._ops):
+            if kind == "insert":
+                counts.append(1)
+            elif kind == "update":
+                counts.append(_update_count(result.update_results[index]))
+            else:
+                counts.append(result.delete_results[index].deleted_count)
+        return counts
+
+    def _execute_each(self):
+        counts = []
+        for kind, collection_name, args in self._ops:
+            collection = self.db[collection_name]
+            if kind == "insert":
+                collection.insert_one(args["document"])
+                counts.append(1)
+            elif kind == "update":
+                counts.append(_update_count(collection.update_one(args["filter"], args["update"], upsert=args["upsert"])))
+            else:
+                counts.append(collection.delete_one(args["filter"]).deleted_count)
+        return counts
+
+
+def _update_count(result):
+    # Un upsert que inserta no "coincide" con ningún documento, pero sí lo afecta
+    return result.matched_count or (1 if result.upserted_id is not None else 0)
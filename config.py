@@ -26,11 +26,56 @@ class Config:
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD")
     MAIL_DEFAULT_SENDER = os.environ.get("MAIL_DEFAULT_SENDER")
     ADMINS = os.environ.get("ADMIN_EMAILS", "").split(",")
+    # Correo (app/email.py): hilos de envío por proceso, tamaño máximo de su cola,
+    # correos enviados por conexión SMTP y segundos de espera cuando la cola está llena
+    MAIL_WORKERS = int(os.environ.get("MAIL_WORKERS") or 2)
+    MAIL_QUEUE_SIZE = int(os.environ.get("MAIL_QUEUE_SIZE") or 500)
+    MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE") or 20)
+    MAIL_QUEUE_TIMEOUT = int(os.environ.get("MAIL_QUEUE_TIMEOUT") or 2)
+    # Bandeja de salida: intentos por correo y segundos antes del primer reintento (se duplican en cada uno)
+    MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS") or 6)
+    MAIL_RETRY_SECONDS = int(os.environ.get("MAIL_RETRY_SECONDS") or 30)
+    # Minutos que se acumulan los avisos de quien prefiere un resumen antes de enviárselo
+    NOTIFICATION_DIGEST_MINUTES = int(os.environ.get("NOTIFICATION_DIGEST_MINUTES") or 60)
 
     # Configuración de MongoDB
     # Flask-PyMongo espera la URI en la variable 'MONGO_URI'
     MONGO_URI = os.environ.get("MONGO_URI")
 
+    # Límites de peticiones (Flask-Limiter). Sin RATELIMIT_STORAGE_URI los contadores se
+    # guardan en la base de datos de MONGO_URI (app/rate_limits.py); si no responde, se
+    # aplican en memoria mientras tanto
+    RATELIMIT_STORAGE_URI = os.environ.get("RATELIMIT_STORAGE_URI")
+    RATELIMIT_STORAGE_POOL_SIZE = int(os.environ.get("RATELIMIT_STORAGE_POOL_SIZE") or 10)
+    RATELIMIT_IN_MEMORY_FALLBACK_ENABLED = True
+
+    # Hash de contraseñas (app/auth/passwords.py): procesos del pool (0 = en el hilo de la petición),
+    # coste N de scrypt (si no se define, el de Werkzeug) y objetivo de `flask calibrate-password-cost`
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS") or 2)
+    PASSWORD_HASH_COST = int(os.environ.get("PASSWORD_HASH_COST") or 0)
+    PASSWORD_HASH_TARGET_MS = int(os.environ.get("PASSWORD_HASH_TARGET_MS") or 250)
+
+    # Números de ticket reservados por cada proceso en cada acceso al contador
+    TICKET_NUMBER_BLOCK_SIZE = int(os.environ.get("TICKET_NUMBER_BLOCK_SIZE") or 20)
+
+    # Segundos que cada proceso mantiene en memoria estados, categorías y roles
+    REFERENCE_DATA_TTL = int(os.environ.get("REFERENCE_DATA_TTL") or 300)
+    # Cada cuánto (ms) comprueba cada proceso si otro worker ha modificado esos datos
+    REFERENCE_DATA_CHECK_INTERVAL_MS = int(os.environ.get("REFERENCE_DATA_CHECK_INTERVAL_MS") or 1000)
+
+    # Caché de usuarios del user_loader: tamaño máximo por proceso y segundos de validez
+    USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE") or 1024)
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL") or 60)
+
+    # Tiempo máximo (ms) de servidor de las consultas de los listados de tickets
+    TICKET_QUERY_MAX_TIME_MS = int(os.environ.get("TICKET_QUERY_MAX_TIME_MS") or 5000)
+
+    # Exportaciones en segundo plano: hilos por proceso (0 = solo con `flask process-export-jobs`),
+    # horas que se conserva el fichero generado e intentos antes de darlo por fallido
+    EXPORT_JOB_WORKERS = int(os.environ.get("EXPORT_JOB_WORKERS") or 2)
+    EXPORT_JOB_TTL_HOURS = int(os.environ.get("EXPORT_JOB_TTL_HOURS") or 24)
+    EXPORT_JOB_MAX_ATTEMPTS = int(os.environ.get("EXPORT_JOB_MAX_ATTEMPTS") or 3)
+
 
 class DevelopmentConfig(Config):
     """Configuración para el entorno de desarrollo."""
@@ -52,6 +97,15 @@ class TestingConfig(Config):
     TESTING = True
     SECRET_KEY = "test-secret-key"
     WTF_CSRF_ENABLED = False
+    # Los trabajos de exportación se procesan explícitamente en los tests
+    EXPORT_JOB_WORKERS = 0
+    # Los correos quedan en la bandeja de salida hasta que el test la procesa
+    MAIL_WORKERS = 0
+    # Hashes en el propio hilo y con un coste bajo
+    PASSWORD_HASH_WORKERS = 0
+    PASSWORD_HASH_COST = 2 ** 14
+    # Los tests usan mongomock: los límites se cuentan en memoria
+    RATELIMIT_STORAGE_URI = "memory://"
     MONGO_URI = (
         os.environ.get("TEST_MONGO_URI")
         or "mongodb://localhost:27017/registro_horas_test"
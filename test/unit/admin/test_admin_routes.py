@@ -0,0 +1,285 @@
+from flask import url_for
+from app.reference_data import invalidate
+from app.ticket_stats import get_ticket_stats
+
+
+def test_category_changes_invalidate_reference_cache(authenticated_admin_client, db, app):
+    """
+    GIVEN the categories already loaded in the reference-data cache
+    WHEN a category is created through the admin routes
+    THEN the new category should be offered at once, while direct database writes wait for the cache
+    """
+    db.db.categories.insert_one({'name': 'Hardware', 'value': 'hardware'})
+    response = authenticated_admin_client.get(url_for('client_bp.create_ticket'))
+    assert b'Hardware' in response.data
+
+    # Escritura fuera de las rutas de administración: se sirve la copia en caché
+    db.db.categories.insert_one({'name': 'Direct Write', 'value': 'direct_write'})
+    response = authenticated_admin_client.get(url_for('client_bp.create_ticket'))
+    assert b'Direct Write' not in response.data
+
+    # create_category invalida la caché: aparecen ambas categorías
+    authenticated_admin_client.post(url_for('admin_bp.create_category'), data={'name': 'Redes'})
+    response = authenticated_admin_client.get(url_for('client_bp.create_ticket'))
+    assert b'Redes' in response.data
+    assert b'Direct Write' in response.data
+
+
+def test_delete_category_invalidates_reference_cache(authenticated_admin_client, db, app):
+    """
+    GIVEN a cached category that no ticket uses
+    WHEN the admin deletes it
+    THEN it should no longer be offered when creating a ticket
+    """
+    category_id = db.db.categories.insert_one({'name': 'Obsoleta', 'value': 'obsoleta'}).inserted_id
+    response = authenticated_admin_client.get(url_for('client_bp.create_ticket'))
+    assert b'Obsoleta' in response.data
+
+    authenticated_admin_client.post(url_for('admin_bp.delete_category', category_id=str(category_id)))
+    response = authenticated_admin_client.get(url_for('client_bp.create_ticket'))
+    assert b'Obsoleta' not in response.data
+
+
+def test_export_tickets_to_xlsx_streams_all_rows(authenticated_admin_client, db, app, monkeypatch):
+    """
+    GIVEN more tickets than fit in one cursor batch
+    WHEN the admin exports them to XLSX
+    THEN the file should be sent in chunks with its length and contain every ticket, newest first
+    """
+    from datetime import datetime, timedelta
+    from io import BytesIO
+    from openpyxl import load_workbook
+
+    monkeypatch.setattr('app.admin.routes.EXPORT_BATCH_SIZE', 2)
+    base = datetime(2024, 1, 1)
+    db.db.tickets.insert_many([
+        {'title': f'Ticket {i}', 'description': 'Desc', 'ticket_number': i + 1,
+         'creator': {'username': 'client'}, 'status_value': 'pendiente',
+         'category_value': 'general', 'created_at': base + timedelta(minutes=i)}
+        for i in range(5)
+    ])
+
+    response = authenticated_admin_client.get(url_for('admin_bp.export_tickets_to_xlsx'))
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert int(response.headers['Content-Length']) == len(response.data)
+    rows = list(load_workbook(BytesIO(response.data), read_only=True)['Tickets'].values)
+    assert rows[0][:3] == ('ID', 'Nº Ticket', 'Título')
+    assert [row[2] for row in rows[1:]] == [f'Ticket {i}' for i in reversed(range(5))]
+
+
+def test_export_tickets_to_csv_applies_filters(authenticated_admin_client, db, app):
+    """
+    GIVEN tickets in two different statuses
+    WHEN the admin exports them to CSV filtering by one status
+    THEN only the matching tickets should be streamed, after the header row
+    """
+    import csv
+    from datetime import datetime
+    from app.reference_data import invalidate
+
+    db.db.statuses.insert_many([{'name': 'Pendiente', 'value': 'pendiente'}, {'name': 'Cerrado', 'value': 'cerrado'}])
+    invalidate('statuses')
+    db.db.tickets.insert_many([
+        {'title': 'Abierto, con coma', 'status_value': 'pendiente', 'created_at': datetime(2024, 1, 1)},
+        {'title': 'Cerrado', 'status_value': 'cerrado', 'created_at': datetime(2024, 1, 2)},
+    ])
+
+    response = authenticated_admin_client.get(url_for('admin_bp.export_tickets_to_csv', status='pendiente', category=''))
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.reader(response.data.decode('utf-8').splitlines()))
+    assert rows[0][2] == 'Título'
+    assert [(row[2], row[6]) for row in rows[1:]] == [('Abierto, con coma', 'Pendiente')]
+
+
+def test_export_tickets_to_ndjson_gzip(authenticated_admin_client, db, app):
+    """
+    GIVEN several tickets
+    WHEN the admin exports them to NDJSON with gzip=1
+    THEN the response should be a .gz file with one JSON object per ticket
+    """
+    import gzip
+    import json
+    from datetime import datetime
+
+    db.db.tickets.insert_many([
+        {'title': f'Ticket {i}', 'ticket_number': i, 'created_at': datetime(2024, 1, i)} for i in range(1, 4)
+    ])
+
+    response = authenticated_admin_client.get(url_for('admin_bp.export_tickets_to_ndjson', gzip='1'))
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    assert '.ndjson.gz' in response.headers['Content-Disposition']
+    records = [json.loads(line) for line in gzip.decompress(response.data).decode('utf-8').splitlines()]
+    assert [r['ticket_number'] for r in records] == [3, 2, 1]
+    assert records[0]['created_at'] == '2024-01-03T00:00:00'
+    assert records[0]['operator'] is None
+
+
+def test_list_tickets_sums_the_counter_shards(authenticated_admin_client, db):
+    """
+    GIVEN ticket counters spread over several shards and the single document of older versions
+    WHEN the admin opens the ticket list
+    THEN the badges should show the sum of all of them
+    """
+    db.db.ticket_stats.insert_many([
+        {'_id': 'tickets', 'total': 2, 'by_status': {'pending': 2}},
+        {'_id': 'tickets:0', 'total': 1, 'by_status': {'pending': 1}},
+        {'_id': 'tickets:5', 'total': 0, 'by_status': {'pending': -1, 'closed': 1}},
+    ])
+
+    response = authenticated_admin_client.get(url_for('admin_bp.list_tickets'))
+
+    assert response.status_code == 200
+    assert b'3 tickets' in response.data
+    assert b'2 pending' in response.data and b'1 closed' in response.data
+
+
+def test_export_job_lifecycle(authenticated_admin_client, db, app):
+    """
+    GIVEN tickets matching a status filter
+    WHEN the admin requests a background CSV export and the job is processed
+    THEN the job should record its progress, the file should be downloadable from GridFS and it should be purged once expired
+    """
+    import csv
+    from datetime import datetime, timedelta
+    from app.export_jobs import process_export_job, purge_expired_exports
+    from app.reference_data import invalidate
+
+    db.db.statuses.insert_many([{'name': 'Pendiente', 'value': 'pendiente'}, {'name': 'Cerrado', 'value': 'cerrado'}])
+    invalidate('statuses')
+    db.db.tickets.insert_many([
+        {'title': 'Abierto', 'status_value': 'pendiente', 'created_at': datetime(2024, 1, 1)},
+        {'title': 'Cerrado', 'status_value': 'cerrado', 'created_at': datetime(2024, 1, 2)},
+    ])
+
+    response = authenticated_admin_client.post(
+        url_for('admin_bp.request_export_job', status='pendiente', category=''),
+        data={'format': 'csv'}
+    )
+    job = db.db.export_jobs.find_one()
+    assert response.status_code == 302
+    assert job['status'] == 'pendiente'
+    assert job['filters'] == {'status': 'pendiente', 'category': ''}
+
+    process_export_job(db.db)
+
+    job = db.db.export_jobs.find_one({'_id': job['_id']})
+    assert job['status'] == 'completado'
+    assert (job['processed'], job['total']) == (1, 1)
+    response = authenticated_admin_client.get(url_for('admin_bp.export_job_status', job_id=str(job['_id'])))
+    assert b'completado' in response.data
+
+    response = authenticated_admin_client.get(url_for('admin_bp.download_export_job', job_id=str(job['_id'])))
+    rows = list(csv.reader(response.data.decode('utf-8').splitlines()))
+    assert [row[2] for row in rows[1:]] == ['Abierto']
+
+    assert purge_expired_exports(db.db, now=job['expires_at'] + timedelta(seconds=1)) == 1
+    assert db.db.export_jobs.count_documents({}) == 0
+    assert db.db['export_files.files'].count_documents({}) == 0
+
+
+def test_export_job_with_expired_lease_is_reclaimed(app, db):
+    """
+    GIVEN a running export job whose lease has expired and another one that already used every attempt
+    WHEN pending export jobs are processed
+    THEN the first should be reclaimed and completed, and the second should be marked as failed without running
+    """
+    from datetime import datetime, timedelta, timezone
+    from bson.objectid import ObjectId
+    from app.export_jobs import process_export_job
+
+    expired = datetime.now(timezone.utc) - timedelta(seconds=1)
+    job = {'format': 'csv', 'gzip': False, 'query': '{}', 'requested_by': {'user_id': ObjectId(), 'username': 'admin'},
+           'status': 'en_proceso', 'lease_expires_at': expired, 'processed': 0, 'total': None}
+    stalled_id = db.db.export_jobs.insert_one({**job, 'attempts': 1, 'created_at': datetime(2024, 1, 1)}).inserted_id
+    exhausted_id = db.db.export_jobs.insert_one({**job, 'attempts': app.config['EXPORT_JOB_MAX_ATTEMPTS'],
+                                                 'created_at': datetime(2024, 1, 2)}).inserted_id
+    running_id = db.db.export_jobs.insert_one({**job, 'attempts': 1, 'created_at': datetime(2024, 1, 3),
+                                               'lease_expires_at': datetime.now(timezone.utc) + timedelta(minutes=5)}).inserted_id
+
+    assert process_export_job(db.db)['_id'] == stalled_id
+    assert process_export_job(db.db)['_id'] == exhausted_id
+    assert process_export_job(db.db) is None
+
+    stalled = db.db.export_jobs.find_one({'_id': stalled_id})
+    assert (stalled['status'], stalled['attempts']) == ('completado', 2)
+    assert 'lease_expires_at' not in stalled
+    exhausted = db.db.export_jobs.find_one({'_id': exhausted_id})
+    assert exhausted['status'] == 'error'
+    assert 'file_id' not in exhausted
+    assert db.db.export_jobs.find_one({'_id': running_id})['status'] == 'en_proceso'
+
+
+def test_bulk_assign_tickets_reports_each_ticket_and_emails_the_operator_once(authenticated_admin_client, db, app):
+    """
+    GIVEN two pending tickets, a missing ticket id and an invalid id selected in the ticket list
+    WHEN the admin bulk-assigns them to an operator
+    THEN the two tickets should be assigned with one history entry each, the operator should get a single email
+         listing both, and the report should show which tickets were not modified
+    """
+    from bson.objectid import ObjectId
+    app.config['MAIL_DEFAULT_SENDER'] = 'app@example.com'
+    db.db.statuses.insert_many([{'name': 'Pendiente', 'value': 'pending'}, {'name': 'En Progreso', 'value': 'in_progress'}])
+    invalidate('statuses')
+    operator_id = db.db.personas.insert_one({'username': 'operador', 'email': 'operador@example.com', 'role': 'operador'}).inserted_id
+    ticket_ids = db.db.tickets.insert_many([
+        {'title': f'Ticket {i}', 'ticket_number': i, 'status_value': 'pending', 'category_value': 'hardware',
+         'supervisor': None, 'operator': None}
+        for i in (1, 2)
+    ]).inserted_ids
+    db.db.ticket_stats.insert_one({'_id': 'tickets', 'total': 2, 'by_status': {'pending': 2}})
+    missing_id = ObjectId()
+
+    listing = authenticated_admin_client.get(url_for('admin_bp.list_tickets'))
+    assert b'form="bulk-tickets-form"' in listing.data
+
+    response = authenticated_admin_client.post(url_for('supervisor_bp.bulk_tickets'), data={
+        'ticket_ids': [str(ticket_ids[0]), str(ticket_ids[1]), str(missing_id), 'not-an-id'],
+        'action': 'assign',
+        'operator': str(operator_id),
+    })
+
+    assert response.status_code == 200
+    assert b'No encontrado o sin permiso' in response.data
+    assert 'ID de ticket no válido'.encode() in response.data
+    for ticket_id in ticket_ids:
+        ticket = db.db.tickets.find_one({'_id': ticket_id})
+        assert ticket['operator']['user_id'] == operator_id
+        assert ticket['status_value'] == 'in_progress'
+        assert db.db.ticket_history.count_documents({'ticket_id': ticket_id}) == 1
+    emails = list(db.db.email_outbox.find())
+    assert len(emails) == 1
+    assert emails[0]['recipients'] == ['operador@example.com']
+    assert len(emails[0]['context']['tickets']) == 2
+    assert get_ticket_stats(db.db)['by_status'] == {'in_progress': 2}
+
+
+def test_manage_assignments_saves_all_categories_and_reports_every_conflict(authenticated_admin_client, db, app):
+    """
+    GIVEN three categories, a supervisor and an existing assignment for one category and shift
+    WHEN the admin assigns all three categories to that shift, and then only the two free ones
+    THEN the first request should be rejected naming the taken category, and the second should create both assignments
+    """
+    category_ids = db.db.categories.insert_many([
+        {'name': name, 'value': name.lower()} for name in ('Hardware', 'Redes', 'Software')
+    ]).inserted_ids
+    supervisor_id = db.db.personas.insert_one({'username': 'supervisora', 'email': 'sup@example.com', 'role': 'supervisor'}).inserted_id
+    db.db.supervisor_assignments.insert_one({'category_id': category_ids[0], 'shift_value': 'weekday_morning', 'supervisor_id': supervisor_id})
+    invalidate('categories', 'supervisor_assignments')
+
+    data = {'category': [str(c) for c in category_ids], 'shift': 'weekday_morning', 'supervisor': str(supervisor_id), 'submit': 'y'}
+    response = authenticated_admin_client.post(url_for('admin_bp.manage_assignments'), data=data)
+    assert response.status_code == 200
+    assert "La categoría &#39;Hardware&#39; ya tiene una asignación".encode() in response.data
+    assert db.db.supervisor_assignments.count_documents({}) == 1
+
+    data['category'] = [str(c) for c in category_ids[1:]]
+    response = authenticated_admin_client.post(url_for('admin_bp.manage_assignments'), data=data)
+    assert response.status_code == 302
+    assert db.db.supervisor_assignments.count_documents({'shift_value': 'weekday_morning', 'supervisor_id': supervisor_id}) == 3
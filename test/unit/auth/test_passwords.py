@@ -0,0 +1,64 @@
+from flask import url_for
+from unittest.mock import patch
+from werkzeug.security import generate_password_hash
+from app.auth.passwords import (hash_password, hash_passwords, verify_password, needs_rehash,
+                                calibrate_password_cost, hash_method)
+
+
+def test_needs_rehash_only_upgrades(app):
+    """
+    GIVEN the testing cost (N=2**14)
+    WHEN stored hashes with other algorithms or costs are checked
+    THEN only other algorithms and lower costs should need a rehash
+    """
+    with app.app_context():
+        assert needs_rehash(generate_password_hash("x", method="pbkdf2:sha256:1000"))
+        assert needs_rehash(generate_password_hash("x", method=hash_method(2 ** 13)))
+        assert not needs_rehash(generate_password_hash("x", method=hash_method(2 ** 14)))
+        assert not needs_rehash(generate_password_hash("x"))
+
+
+def test_calibration_stays_within_bounds():
+    """
+    GIVEN the cost bounds
+    WHEN the cost is calibrated for an unreachable and for a generous target
+    THEN it should return the minimum and the maximum cost respectively
+    """
+    assert calibrate_password_cost(target_ms=0, min_cost=2 ** 10, max_cost=2 ** 12) == 2 ** 10
+    assert calibrate_password_cost(target_ms=60000, min_cost=2 ** 10, max_cost=2 ** 12) == 2 ** 12
+
+
+def test_hashing_runs_on_process_pool(app):
+    """
+    GIVEN a password hashing pool with one process
+    WHEN passwords are hashed and verified
+    THEN the hashes should use the configured cost and verify correctly
+    """
+    app.config["PASSWORD_HASH_WORKERS"] = 1
+    with app.app_context():
+        try:
+            hashes = hash_passwords(["uno", "dos"])
+            assert all(h.startswith(hash_method(2 ** 14) + "$") for h in hashes)
+            assert verify_password(hashes[1], "dos")
+            assert not verify_password(hash_password("tres"), "uno")
+        finally:
+            app.extensions.pop("password_hasher").shutdown()
+
+
+def test_login_upgrades_outdated_hash(client, db, seed_test_user):
+    """
+    GIVEN a user whose password is stored with an outdated algorithm
+    WHEN they log in successfully
+    THEN the stored hash should be replaced with one using the current parameters
+    """
+    user_data, _ = seed_test_user
+    db.db.personas.update_one({"_id": user_data["_id"]}, {"$set": {
+        "password_hash": generate_password_hash("ThisIsA-Valid-Password123!", method="pbkdf2:sha256:1000")}})
+
+    with patch("app.auth.routes.send_2fa_code_email"):
+        client.post(url_for("auth.login"), data={"username": user_data["username"], "password": "ThisIsA-Valid-Password123!"})
+
+    stored = db.db.personas.find_one({"_id": user_data["_id"]})["password_hash"]
+    assert stored.startswith(hash_method(2 ** 14) + "$")
+    with client.application.app_context():
+        assert verify_password(stored, "ThisIsA-Valid-Password123!")
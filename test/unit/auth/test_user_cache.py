@@ -0,0 +1,31 @@
+from unittest.mock import patch
+from app.auth.models import Persona
+from app.auth.user_cache import load_cached_user, forget_user
+
+
+def test_cached_user_is_loaded_once(app, db, seed_test_user):
+    """Test que el user_loader solo lee 'personas' la primera vez que carga un usuario."""
+    user_data, _ = seed_test_user
+    with patch("app.auth.models.Persona", wraps=Persona) as persona_cls:
+        first = load_cached_user(str(user_data["_id"]))
+        second = load_cached_user(str(user_data["_id"]))
+
+    assert first is second
+    assert first.username == "testuser"
+    assert persona_cls.call_count == 1
+
+
+def test_security_stamp_change_revokes_cached_sessions(app, db, seed_test_user):
+    """Test que al cambiar el security_stamp las sesiones con el sello anterior dejan de ser válidas."""
+    user_data, _ = seed_test_user
+    old_session_id = str(user_data["_id"])
+    assert load_cached_user(old_session_id) is not None
+
+    # Lo que hacen change_password, reset_password y edit_user
+    db.db.personas.update_one({"_id": user_data["_id"]}, {"$set": {"security_stamp": "new-stamp"}})
+    forget_user(user_data["_id"])
+
+    assert load_cached_user(old_session_id) is None
+    user = load_cached_user(f"{user_data['_id']}:new-stamp")
+    assert user is not None
+    assert user.get_id() == f"{user_data['_id']}:new-stamp"
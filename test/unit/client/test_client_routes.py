@@ -1,8 +1,11 @@
+import re
 from flask import url_for
 from app.auth.models import Persona
-from unittest.mock import patch
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from bson.objectid import ObjectId
+from app.search import ticket_search_fields
+from app.reference_data import invalidate
+from app.ticket_stats import get_ticket_stats
 
 def test_create_ticket_get(logged_in_client, app):
     """
@@ -33,8 +36,7 @@ def test_create_ticket_unauthorized(logged_in_operator_client, app):
     response = logged_in_operator_client.get('/create_ticket', follow_redirects=False)
     assert response.status_code == 403
 
-@patch('app.client.routes.send_notification_email')
-def test_create_ticket_post(mock_send_email, logged_in_client, db, app):
+def test_create_ticket_post(logged_in_client, db, app):
     """
     GIVEN a logged-in user with permissions
     WHEN they submit a valid create ticket form
@@ -98,11 +100,31 @@ def test_create_ticket_post(mock_send_email, logged_in_client, db, app):
     assert ticket['description'] == 'This is a test ticket.'
     assert ticket['supervisor']['user_id'] == supervisor_id
 
-    # Check that the email was sent
-    mock_send_email.assert_called_once()
-    call_args = mock_send_email.call_args[1]
-    assert call_args['subject'] == f"Nuevo Ticket Creado: #{ticket['_id']}"
-    assert call_args['recipients'] == ['supervisor@example.com']
+    # The creation entry is stored in the ticket_history collection, not embedded
+    assert 'history' not in ticket
+    history_entry = db.db.ticket_history.find_one({'ticket_id': ticket['_id']})
+    assert history_entry['change_type'] == 'Creación de Ticket'
+
+    # The title and description are indexed for the text search
+    assert ticket['title_tokens'] == ['test', 'ticket']
+
+    # The creator keeps a lowercase copy of the username for the prefix filters
+    assert ticket['creator']['username_lower'] == ticket['creator']['username'].lower()
+
+    # The ticket gets the first number of the counter block
+    assert ticket['ticket_number'] == 1
+    assert 'this' in ticket['search_tokens']
+
+    # The status and category counters are incremented
+    stats = get_ticket_stats(db.db)
+    assert stats['total'] == 1
+    assert stats['by_status'] == {ticket['status_value']: 1}
+    assert stats['by_category'] == {ticket['category_value']: 1}
+
+    # Check that the email was queued in the outbox
+    email = db.db.email_outbox.find_one()
+    assert email['subject'] == f"Nuevo Ticket Creado: #{ticket['_id']}"
+    assert email['recipients'] == ['supervisor@example.com']
 
 def test_create_ticket_post_invalid(logged_in_client, db, app):
     """
@@ -351,14 +373,16 @@ def test_client_tickets_filter_by_title(logged_in_client, db, app):
         'creator': {'user_id': client_user_id, 'username': 'testuser'},
         'status_value': 'pending',
         'created_at': datetime.now(timezone.utc),
-        'updated_at': datetime.now(timezone.utc)
+        'updated_at': datetime.now(timezone.utc),
+        **ticket_search_fields('Apple Ticket')
     })
     db.db.tickets.insert_one({
         'title': 'Banana Ticket',
         'creator': {'user_id': client_user_id, 'username': 'testuser'},
         'status_value': 'pending',
         'created_at': datetime.now(timezone.utc),
-        'updated_at': datetime.now(timezone.utc)
+        'updated_at': datetime.now(timezone.utc),
+        **ticket_search_fields('Banana Ticket')
     })
 
     with app.test_request_context():
@@ -392,7 +416,8 @@ def test_client_tickets_filter_by_operator(logged_in_client, db, app):
     db.db.tickets.insert_one({
         'title': 'Ticket With Operator',
         'creator': {'user_id': client_user_id, 'username': 'testuser'},
-        'operator': {'user_id': operator['_id'], 'username': operator['username']},
+        'operator': {'user_id': operator['_id'], 'username': operator['username'],
+                     'username_lower': operator['username'].lower()},
         'created_at': datetime.now(timezone.utc),
         'updated_at': datetime.now(timezone.utc)
     })
@@ -413,6 +438,31 @@ def test_client_tickets_filter_by_operator(logged_in_client, db, app):
     assert b'Ticket With Operator' in response.data
     assert b'Ticket Without Operator' not in response.data
 
+def test_client_tickets_filter_by_supervisor_prefix_and_exact(logged_in_client, db, app):
+    """
+    GIVEN a logged-in client with tickets handled by supervisors with similar usernames
+    WHEN they filter by the beginning of the username, and then in exact-user mode
+    THEN the prefix should match case-insensitively and the exact mode only the named user
+    """
+    client_user_id = db.db.personas.find_one({'username': 'testuser'})['_id']
+    for username in ('SupAna', 'supanabel'):
+        supervisor_id = db.db.personas.insert_one({'username': username, 'role': 'supervisor'}).inserted_id
+        db.db.tickets.insert_one({
+            'title': f'Ticket of {username}',
+            'creator': {'user_id': client_user_id, 'username': 'testuser', 'username_lower': 'testuser'},
+            'supervisor': {'user_id': supervisor_id, 'username': username, 'username_lower': username.lower()},
+            'created_at': datetime.now(timezone.utc),
+            'updated_at': datetime.now(timezone.utc)
+        })
+
+    response = logged_in_client.get(url_for('client_bp.client_tickets', supervisor_username='supana'))
+    assert b'Ticket of SupAna' in response.data
+    assert b'Ticket of supanabel' in response.data
+
+    response = logged_in_client.get(url_for('client_bp.client_tickets', supervisor_username='SupAna', exact_users='y'))
+    assert b'Ticket of SupAna' in response.data
+    assert b'Ticket of supanabel' not in response.data
+
 def test_client_tickets_filter_by_category(logged_in_client, db, app):
     """
     GIVEN a logged-in client with multiple tickets
@@ -450,4 +500,173 @@ def test_client_tickets_filter_by_category(logged_in_client, db, app):
     assert response.status_code == 200
 
     assert b'Hardware Ticket' in response.data
-    assert b'Software Ticket' not in response.data
\ No newline at end of file
+    assert b'Software Ticket' not in response.data
+
+def _insert_client_tickets(db, client_user_id, count, **extra):
+    """Inserta `count` tickets del cliente con fechas de creación consecutivas (el mayor índice es el más reciente)."""
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(count):
+        db.db.tickets.insert_one({
+            'title': f'Paged Ticket {i:02d}',
+            'creator': {'user_id': client_user_id, 'username': 'testuser'},
+            'status_value': 'pending',
+            'created_at': base + timedelta(minutes=i),
+            'updated_at': base + timedelta(minutes=i),
+            **extra
+        })
+
+
+def test_client_tickets_paginates_with_cursor(logged_in_client, db, app):
+    """
+    GIVEN a logged-in client with more tickets than the page size
+    WHEN they browse the list page by page using the next/previous links
+    THEN each page should show the next block of tickets, newest first
+    """
+    client_user_id = db.db.personas.find_one({'username': 'testuser'})['_id']
+    _insert_client_tickets(db, client_user_id, 25)
+
+    response = logged_in_client.get(url_for('client_bp.client_tickets', per_page=10))
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'Paged Ticket 24' in page
+    assert 'Paged Ticket 15' in page
+    assert 'Paged Ticket 14' not in page
+
+    next_url = re.search(r'href="([^"]*after=[^"]*)"', page).group(1).replace('&amp;', '&')
+    response = logged_in_client.get(next_url)
+    page = response.get_data(as_text=True)
+    assert 'Paged Ticket 14' in page
+    assert 'Paged Ticket 05' in page
+    assert 'Paged Ticket 15' not in page
+    assert 'Paged Ticket 04' not in page
+
+    prev_url = re.search(r'href="([^"]*before=[^"]*)"', page).group(1).replace('&amp;', '&')
+    response = logged_in_client.get(prev_url)
+    page = response.get_data(as_text=True)
+    assert 'Paged Ticket 24' in page
+    assert 'Paged Ticket 15' in page
+    assert 'Paged Ticket 14' not in page
+
+
+def test_client_tickets_pagination_keeps_filters(logged_in_client, db, app):
+    """
+    GIVEN a logged-in client with tickets in different statuses
+    WHEN they page through a filtered list
+    THEN the next page link should keep the filter arguments
+    """
+    client_user_id = db.db.personas.find_one({'username': 'testuser'})['_id']
+    db.db.statuses.insert_many([
+        {'name': 'Pending', 'value': 'pending'},
+        {'name': 'Closed', 'value': 'closed'}
+    ])
+    _insert_client_tickets(db, client_user_id, 6)
+    db.db.tickets.insert_one({
+        'title': 'Closed Ticket',
+        'creator': {'user_id': client_user_id, 'username': 'testuser'},
+        'status_value': 'closed',
+        'created_at': datetime(2023, 1, 1, tzinfo=timezone.utc),
+        'updated_at': datetime(2023, 1, 1, tzinfo=timezone.utc)
+    })
+
+    response = logged_in_client.get(url_for('client_bp.client_tickets', status='pending', per_page=3))
+    page = response.get_data(as_text=True)
+    next_url = re.search(r'href="([^"]*after=[^"]*)"', page).group(1).replace('&amp;', '&')
+    assert 'status=pending' in next_url
+
+    response = logged_in_client.get(next_url)
+    page = response.get_data(as_text=True)
+    assert 'Paged Ticket 02' in page
+    assert 'Paged Ticket 00' in page
+    assert 'Closed Ticket' not in page
+
+
+def test_client_tickets_search_matches_description_and_ranks_title(logged_in_client, db, app):
+    """
+    GIVEN a logged-in client with tickets mentioning a word in the title or only in the description
+    WHEN they search for that word (accents and case ignored, last word as a prefix)
+    THEN both tickets should be listed, title matches first, and unrelated tickets excluded
+    """
+    client_user_id = db.db.personas.find_one({'username': 'testuser'})['_id']
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    tickets = [
+        ('Impresora atascada', 'La impresión sale cortada.', base),
+        ('Pantalla rota', 'Se cayó junto a la impresora de la oficina.', base + timedelta(days=1)),
+        ('Teclado sucio', 'Faltan teclas.', base + timedelta(days=2)),
+    ]
+    for title, description, created_at in tickets:
+        db.db.tickets.insert_one({
+            'title': title,
+            'description': description,
+            'creator': {'user_id': client_user_id, 'username': 'testuser'},
+            'status_value': 'pending',
+            'created_at': created_at,
+            'updated_at': created_at,
+            **ticket_search_fields(title, description)
+        })
+
+    response = logged_in_client.get(url_for('client_bp.client_tickets', search_title='IMPRES'))
+    page = response.get_data(as_text=True)
+    assert 'Impresora atascada' in page
+    assert 'Pantalla rota' in page
+    assert 'Teclado sucio' not in page
+    # El ticket con coincidencia en el título aparece antes aunque sea más antiguo
+    assert page.index('Impresora atascada') < page.index('Pantalla rota')
+
+    response = logged_in_client.get(url_for('client_bp.client_tickets', search_title='oficina impresora'))
+    page = response.get_data(as_text=True)
+    assert 'Pantalla rota' in page
+    assert 'Impresora atascada' not in page
+
+
+
+def test_client_tickets_filter_by_number_and_id_prefix(logged_in_client, db, app):
+    """
+    GIVEN a logged-in client with numbered tickets
+    WHEN they filter by ticket number or by the beginning of the ticket ID
+    THEN only the matching ticket should be displayed
+    """
+    client_user_id = db.db.personas.find_one({'username': 'testuser'})['_id']
+    first_id = ObjectId('65a000000000000000000001')
+    second_id = ObjectId('66b000000000000000000002')
+    for ticket_id, number, title in [(first_id, 7, 'Seventh Ticket'), (second_id, 8, 'Eighth Ticket')]:
+        db.db.tickets.insert_one({
+            '_id': ticket_id,
+            'ticket_number': number,
+            'title': title,
+            'creator': {'user_id': client_user_id, 'username': 'testuser'},
+            'status_value': 'pending',
+            'created_at': datetime.now(timezone.utc),
+            'updated_at': datetime.now(timezone.utc)
+        })
+
+    response = logged_in_client.get(url_for('client_bp.client_tickets', ticket_id='#8'))
+    assert b'Eighth Ticket' in response.data
+    assert b'Seventh Ticket' not in response.data
+
+    response = logged_in_client.get(url_for('client_bp.client_tickets', ticket_id='65A0'))
+    assert b'Seventh Ticket' in response.data
+    assert b'Eighth Ticket' not in response.data
+
+
+def test_close_ticket_moves_status_counters(logged_in_client, db, app, seed_test_user):
+    """
+    GIVEN a completed ticket of the client, already counted in ticket_stats
+    WHEN the client closes it (twice)
+    THEN the counters should move from "completed" to "closed" exactly once
+    """
+    user_data, _ = seed_test_user
+    db.db.statuses.insert_many([{'name': 'Completado', 'value': 'completed'}, {'name': 'Cerrado', 'value': 'closed'}])
+    ticket_id = db.db.tickets.insert_one({
+        'title': 'Completed', 'description': 'Desc', 'status_value': 'completed', 'category_value': 'general',
+        'creator': {'user_id': user_data['_id'], 'username': user_data['username']},
+        'created_at': datetime.now(timezone.utc)
+    }).inserted_id
+    db.db.ticket_stats.insert_one({'_id': 'tickets', 'total': 1, 'by_status': {'completed': 1}, 'by_category': {'general': 1}})
+    invalidate('statuses')
+
+    logged_in_client.post(url_for('client_bp.close_ticket', ticket_id=str(ticket_id)))
+    logged_in_client.post(url_for('client_bp.close_ticket', ticket_id=str(ticket_id)))
+
+    stats = get_ticket_stats(db.db)
+    assert stats['by_status'] == {'closed': 1}
+    assert stats['total'] == 1
@@ -0,0 +1,216 @@
+from app.indexes import INDEXES
+from app.search import tokenize, search_query
+from app.ticket_stats import get_ticket_stats
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+
+
+def test_ensure_indexes_creates_declared_indexes(app, db):
+    """
+    GIVEN an empty database
+    WHEN the `flask ensure-indexes` command is run
+    THEN every index declared in app/indexes.py should exist
+    """
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["ensure-indexes"])
+    assert result.exit_code == 0
+    assert "[ERROR]" not in result.output
+
+    for collection_name, index_specs in INDEXES.items():
+        existing = db.db[collection_name].index_information()
+        for spec in index_specs:
+            assert spec["name"] in existing
+
+
+def test_ensure_indexes_is_idempotent(app, db):
+    """
+    GIVEN indexes already created
+    WHEN the command is run a second time
+    THEN it should finish without errors
+    """
+    runner = app.test_cli_runner()
+    runner.invoke(args=["ensure-indexes"])
+    result = runner.invoke(args=["ensure-indexes"])
+    assert result.exit_code == 0
+    assert "[ERROR]" not in result.output
+
+
+def test_migrate_ticket_history_moves_embedded_entries(app, db):
+    """
+    GIVEN tickets with an embedded history array
+    WHEN the `flask migrate-ticket-history` command is run
+    THEN the entries should be in the ticket_history collection and removed from the tickets
+    """
+    entry_id = ObjectId()
+    ticket_id = db.db.tickets.insert_one({
+        'title': 'Legacy Ticket',
+        'history': [
+            {'entry_id': entry_id, 'change_type': 'Creación de Ticket', 'details': 'Ticket creado.',
+             'changed_by': {'user_id': ObjectId(), 'username': 'cliente'},
+             'timestamp': datetime(2024, 1, 1, tzinfo=timezone.utc)},
+            {'entry_id': ObjectId(), 'change_type': 'Ticket Tomado', 'details': '',
+             'changed_by': {'user_id': ObjectId(), 'username': 'supervisor'},
+             'timestamp': datetime(2024, 1, 2, tzinfo=timezone.utc)},
+        ]
+    }).inserted_id
+    db.db.tickets.insert_one({'title': 'Empty History Ticket', 'history': []})
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["migrate-ticket-history", "--batch-size", "1"])
+    assert result.exit_code == 0
+    assert "ERROR" not in result.output
+
+    assert db.db.ticket_history.count_documents({'ticket_id': ticket_id}) == 2
+    migrated = db.db.ticket_history.find_one({'_id': entry_id})
+    assert migrated['change_type'] == 'Creación de Ticket'
+    assert db.db.tickets.count_documents({'history': {'$exists': True}}) == 0
+
+    # Relanzar el comando no duplica entradas.
+    runner.invoke(args=["migrate-ticket-history"])
+    assert db.db.ticket_history.count_documents({'ticket_id': ticket_id}) == 2
+
+
+def test_reindex_ticket_search_builds_tokens(app, db):
+    """
+    GIVEN tickets created before the search index existed, one of them with a rejection note
+    WHEN the `flask reindex-ticket-search` command is run
+    THEN every ticket should have title and search tokens, including the history notes
+    """
+    ticket_id = db.db.tickets.insert_one({
+        'title': 'Correo caído', 'description': 'No llegan mensajes', 'observation': 'Revisar servidor'
+    }).inserted_id
+    db.db.tickets.insert_one({'title': 'Sin descripción'})
+    db.db.ticket_history.insert_one({
+        '_id': ObjectId(), 'ticket_id': ticket_id, 'change_type': 'Rechazo de Resolución',
+        'details': 'Sigue fallando', 'timestamp': datetime(2024, 1, 1, tzinfo=timezone.utc)
+    })
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["reindex-ticket-search", "--batch-size", "1"])
+    assert result.exit_code == 0
+    assert "ERROR" not in result.output
+
+    ticket = db.db.tickets.find_one({'_id': ticket_id})
+    assert ticket['title_tokens'] == ['correo', 'caido']
+    for token in ('mensajes', 'servidor', 'sigue', 'fallando'):
+        assert token in ticket['search_tokens']
+    assert db.db.tickets.count_documents({'search_tokens': {'$exists': False}}) == 0
+
+
+def test_search_tokenize_and_query():
+    """
+    GIVEN a search text with accents, capitals and one-letter words
+    WHEN it is tokenized and translated to a query
+    THEN tokens are normalized, short words dropped, and the last word is an anchored prefix
+    """
+    assert tokenize('Impresión  a Color', 'color rápida') == ['impresion', 'color', 'rapida']
+
+    query, tokens = search_query('Red caída de serv')
+    assert tokens == ['red', 'caida', 'de', 'serv']
+    assert query == {'search_tokens': {'$regex': '^serv', '$all': ['red', 'caida', 'de']}}
+
+    assert search_query('¿ ?') == (None, [])
+
+
+def test_backfill_ticket_numbers_in_creation_order(app, db):
+    """
+    GIVEN tickets without a ticket number and a counter already in use
+    WHEN the `flask backfill-ticket-numbers` command is run
+    THEN the tickets should be numbered by creation date after the counter value
+    """
+    db.db.counters.insert_one({'_id': 'ticket_number', 'seq': 10})
+    newer_id = db.db.tickets.insert_one({'title': 'Newer', 'created_at': datetime(2024, 2, 1, tzinfo=timezone.utc)}).inserted_id
+    older_id = db.db.tickets.insert_one({'title': 'Older', 'created_at': datetime(2024, 1, 1, tzinfo=timezone.utc)}).inserted_id
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["backfill-ticket-numbers", "--batch-size", "1"])
+    assert result.exit_code == 0
+    assert "ERROR" not in result.output
+
+    assert db.db.tickets.find_one({'_id': older_id})['ticket_number'] == 11
+    assert db.db.tickets.find_one({'_id': newer_id})['ticket_number'] == 12
+    assert db.db.counters.find_one({'_id': 'ticket_number'})['seq'] == 12
+
+
+def test_backfill_username_lower(app, db):
+    """
+    GIVEN tickets whose user subdocuments lack the lowercase username copy
+    WHEN the `flask backfill-username-lower` command is run
+    THEN every existing user subdocument should get 'username_lower'
+    """
+    ticket_id = db.db.tickets.insert_one({
+        'title': 'Legacy',
+        'creator': {'user_id': ObjectId(), 'username': 'Cliente'},
+        'operator': {'user_id': ObjectId(), 'username': 'OPERADOR'},
+        'supervisor': None
+    }).inserted_id
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["backfill-username-lower", "--batch-size", "1"])
+    assert result.exit_code == 0
+    assert "ERROR" not in result.output
+
+    ticket = db.db.tickets.find_one({'_id': ticket_id})
+    assert ticket['creator']['username_lower'] == 'cliente'
+    assert ticket['operator']['username_lower'] == 'operador'
+    assert ticket['supervisor'] is None
+
+
+def test_reconcile_ticket_stats_rebuilds_counters(app, db):
+    """
+    GIVEN tickets in several statuses and stale counters
+    WHEN the `flask reconcile-ticket-stats` command is run
+    THEN the counters should match the tickets again
+    """
+    db.db.tickets.insert_many([
+        {'status_value': 'pending', 'category_value': 'hardware'},
+        {'status_value': 'pending', 'category_value': 'software'},
+        {'status_value': 'closed', 'category_value': 'hardware'},
+    ])
+    db.db.ticket_stats.insert_many([{'_id': 'tickets', 'total': 99, 'by_status': {'pending': 42}},
+                                    {'_id': 'tickets:3', 'total': 5, 'by_status': {'closed': 5}}])
+
+    result = app.test_cli_runner().invoke(args=["reconcile-ticket-stats"])
+
+    assert result.exit_code == 0
+    stats = get_ticket_stats(db.db)
+    assert stats['total'] == 3
+    assert stats['by_status'] == {'pending': 2, 'closed': 1}
+    assert stats['by_category'] == {'hardware': 2, 'software': 1}
+    assert [doc['_id'] for doc in db.db.ticket_stats.find()] == ['tickets:0']
+
+
+def test_run_mail_worker_once_drains_outbox(app, db):
+    """
+    GIVEN two pending emails in the outbox
+    WHEN the `flask run-mail-worker --once` command is run
+    THEN both should be sent in one batch and the command should exit
+    """
+    from app.email import queue_email, OUTBOX_COLLECTION, STATUS_SENT
+    with app.test_request_context():
+        for i in range(2):
+            queue_email(f"Mensaje {i}", [f"user{i}@example.com"], "emails/export_job_finished.html",
+                        sender="app@example.com", job={"requested_by": {"username": "ana"}, "format": "csv"},
+                        succeeded=False)
+
+    result = app.test_cli_runner().invoke(args=["run-mail-worker", "--once"])
+
+    assert result.exit_code == 0
+    assert "2 correos enviados, 0 fallidos" in result.output
+    assert db.db[OUTBOX_COLLECTION].count_documents({"status": STATUS_SENT}) == 2
+
+
+def test_calibrate_password_cost_prints_the_cost(app):
+    """
+    GIVEN an unreachable target time
+    WHEN the `flask calibrate-password-cost` command is run
+    THEN it should print the minimum cost as the value to configure, without changing the app's cost
+    """
+    from app.auth.passwords import password_cost, MIN_COST
+
+    result = app.test_cli_runner().invoke(args=["calibrate-password-cost", "--target-ms", "0"])
+
+    assert result.exit_code == 0
+    assert f"PASSWORD_HASH_COST={MIN_COST}" in result.output
+    with app.app_context():
+        assert password_cost() == app.config['PASSWORD_HASH_COST']
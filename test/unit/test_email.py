@@ -0,0 +1,118 @@
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from app import mail, mongo
+from app.email import (MailQueue, queue_email, process_outbox, OUTBOX_COLLECTION,
+                       PRIORITY_HIGH, STATUS_PENDING, STATUS_SENT, STATUS_FAILED)
+
+
+def _queue_notification(i):
+    return queue_email(f"Mensaje {i}", [f"user{i}@example.com"], "emails/export_job_finished.html",
+                       job={"requested_by": {"username": f"user{i}"}, "format": "csv", "status_url": "#"},
+                       sender="app@example.com", succeeded=True)
+
+
+def test_outbox_sends_high_priority_first_and_discards_context(app, db):
+    """
+    GIVEN a notification and, queued after it, a 2FA code in the email outbox
+    WHEN the outbox is processed
+    THEN the 2FA code should be rendered and sent first, and both emails marked as sent without their context
+    """
+    with app.test_request_context():
+        notification_id = _queue_notification(1)
+        code_id = queue_email("Tu Código de Verificación", ["ana@example.com"], "email/2fa_code.html",
+                              text_template="email/2fa_code.txt", priority=PRIORITY_HIGH, sender="app@example.com",
+                              user={"username": "ana", "two_factor_code": "123456"})
+        assert db.db[OUTBOX_COLLECTION].find_one({"_id": code_id})["status"] == STATUS_PENDING
+
+        with mail.record_messages() as outbox:
+            assert process_outbox(db.db, batch_size=10) == (2, 0)
+
+    assert [msg.subject for msg in outbox] == ["Tu Código de Verificación", "Mensaje 1"]
+    assert "123456" in outbox[0].body and "123456" in outbox[0].html
+    for email_id in (code_id, notification_id):
+        email = db.db[OUTBOX_COLLECTION].find_one({"_id": email_id})
+        assert email["status"] == STATUS_SENT and "context" not in email
+
+
+def test_outbox_retries_with_exponential_backoff(app, db):
+    """
+    GIVEN an email in the outbox and an SMTP server that refuses connections
+    WHEN the outbox is processed until the email is due again each time
+    THEN each retry should wait twice as long as the previous one, and the email should fail after MAIL_MAX_ATTEMPTS
+    """
+    app.config.update(MAIL_MAX_ATTEMPTS=3, MAIL_RETRY_SECONDS=30)
+    with app.test_request_context(), patch("app.email.mail.connect", side_effect=OSError("SMTP caído")):
+        email_id = _queue_notification(1)
+        delays = []
+        for _ in range(3):
+            before = datetime.utcnow()
+            assert process_outbox(db.db) == (0, 1)
+            email = db.db[OUTBOX_COLLECTION].find_one({"_id": email_id})
+            if email["status"] == STATUS_PENDING:
+                delays.append(round((email["next_attempt_at"] - before).total_seconds() / 30))
+                # Adelanta el siguiente intento
+                db.db[OUTBOX_COLLECTION].update_one({"_id": email_id}, {"$set": {"next_attempt_at": before - timedelta(seconds=1)}})
+
+    assert delays == [1, 2]
+    assert email["status"] == STATUS_FAILED and email["attempts"] == 3
+    assert "SMTP caído" in email["last_error"]
+    assert "context" not in email
+
+
+def test_outbox_does_not_retry_an_email_already_sent(app, db):
+    """
+    GIVEN two emails in the outbox and a database error when marking the first one as sent
+    WHEN the outbox is processed
+    THEN both emails should be sent once and counted as sent, and the first should not be scheduled for a retry
+    """
+    with app.test_request_context():
+        first_id = _queue_notification(1)
+        _queue_notification(2)
+        with mail.record_messages() as outbox, patch("app.email._mark_sent", side_effect=[OSError("Mongo caído"), None]):
+            assert process_outbox(db.db, batch_size=10) == (2, 0)
+
+    assert [msg.subject for msg in outbox] == ["Mensaje 1", "Mensaje 2"]
+    email = db.db[OUTBOX_COLLECTION].find_one({"_id": first_id})
+    assert "last_error" not in email and email["attempts"] == 1
+
+
+def test_mail_queue_applies_backpressure_and_reuses_connections(app, db, caplog):
+    """
+    GIVEN a mail queue with one worker and room for two emails, whose worker is busy
+    WHEN four outbox emails are submitted
+    THEN the fourth should be rejected (left in the outbox), the queued ones should share one SMTP connection when the worker resumes,
+         and the shutdown should log the queue counters
+    """
+    entered = threading.Event()
+    release = threading.Event()
+    connect = mail.connect
+    connections = []
+
+    def slow_connect():
+        connections.append(1)
+        entered.set()
+        release.wait(5)
+        return connect()
+
+    with app.test_request_context(), patch("app.email.mail.connect", side_effect=slow_connect):
+        email_ids = [_queue_notification(i) for i in range(1, 6)]
+        mail_queue = MailQueue(app, workers=1, maxsize=2, batch_size=10, put_timeout=0.01)
+        assert mail_queue.submit(email_ids[0])
+        assert entered.wait(5)
+
+        assert mail_queue.submit(email_ids[1])
+        assert mail_queue.submit(email_ids[2])
+        assert not mail_queue.submit(email_ids[3])
+
+        release.set()
+        with caplog.at_level("INFO", logger="app.email"):
+            mail_queue.shutdown(timeout=5)
+
+    metrics = mail_queue.metrics()
+    assert (metrics["sent"], metrics["rejected"], metrics["failed"]) == (3, 1, 0)
+    assert metrics["high_water"] == 2
+    assert "3 enviados, 0 fallidos, 1 rechazados, ocupación máxima 2/2" in caplog.text
+    assert len(connections) == 2
+    assert not mail_queue.submit(email_ids[4])
+    assert mongo.db[OUTBOX_COLLECTION].count_documents({"status": STATUS_PENDING}) == 2
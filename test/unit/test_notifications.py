@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from app import mail
+from app.email import process_outbox, OUTBOX_COLLECTION
+from app.notifications import flush_due_digests, DIGEST_COLLECTION, DIGEST_TICKET_CREATED, DIGEST_TICKET_ASSIGNED
+from app.ticket_service import notification
+
+
+def _persona(db, username, digest):
+    persona = {"_id": ObjectId(), "username": username, "email": f"{username}@example.com", "notification_digest": digest}
+    db.db.personas.insert_one(persona)
+    return persona
+
+
+def _ticket(number, title):
+    return {"_id": ObjectId(), "ticket_number": number, "title": title, "category_value": "hardware", "status_value": "pending"}
+
+
+def _notify(db, recipient, kind, ticket):
+    """Guarda el aviso como lo haría el lote de app.ticket_service y devuelve la colección elegida."""
+    collection_name, document = notification(recipient, kind, ticket, "Aviso", "emails/ticket_created.html")
+    if collection_name == DIGEST_COLLECTION:
+        db.db[collection_name].insert_one(document)
+    return collection_name
+
+
+def test_digest_flushes_one_email_per_due_recipient(app, db):
+    """
+    GIVEN a supervisor with two digest entries older than the interval, a recent entry for another user and a user without the preference
+    WHEN due digests are flushed and the outbox is processed
+    THEN the supervisor should get one email listing both tickets, and the recent entry should stay pending
+    """
+    app.config.update(NOTIFICATION_DIGEST_MINUTES=60, MAIL_DEFAULT_SENDER="app@example.com")
+    supervisor = _persona(db, "supervisora", True)
+    operator = _persona(db, "operador", True)
+    regular = _persona(db, "cliente", False)
+
+    with app.test_request_context():
+        assert _notify(db, supervisor, DIGEST_TICKET_CREATED, _ticket(1001, "Impresora")) == DIGEST_COLLECTION
+        assert _notify(db, supervisor, DIGEST_TICKET_ASSIGNED, _ticket(1002, "Portátil")) == DIGEST_COLLECTION
+        assert _notify(db, operator, DIGEST_TICKET_ASSIGNED, _ticket(1003, "Monitor")) == DIGEST_COLLECTION
+        assert _notify(db, regular, DIGEST_TICKET_CREATED, _ticket(1004, "Teclado")) == OUTBOX_COLLECTION
+        db.db[DIGEST_COLLECTION].update_many({"recipient.user_id": supervisor["_id"]},
+                                             {"$set": {"created_at": datetime.utcnow() - timedelta(minutes=90)}})
+
+        assert flush_due_digests(db.db) == 1
+        with mail.record_messages() as outbox:
+            assert process_outbox(db.db) == (1, 0)
+
+    assert len(outbox) == 1
+    assert outbox[0].recipients == ["supervisora@example.com"]
+    assert "Impresora" in outbox[0].html and "Portátil" in outbox[0].html
+    assert db.db[OUTBOX_COLLECTION].count_documents({}) == 1
+    remaining = list(db.db[DIGEST_COLLECTION].find())
+    assert [entry["recipient"]["user_id"] for entry in remaining] == [operator["_id"]]
+
+
+def test_notification_preference_is_saved(logged_in_client, db, seed_test_user):
+    """
+    GIVEN a logged-in user
+    WHEN they enable the digest preference on their profile
+    THEN it should be stored on their user document
+    """
+    response = logged_in_client.post('/auth/profile/notifications', data={'notification_digest': 'y'})
+    assert response.status_code == 302
+
+    user = db.db.personas.find_one({'username': 'testuser'})
+    assert user['notification_digest'] is True
@@ -0,0 +1,38 @@
+from limits.storage import MongoDBStorage, storage_from_string
+from app import mongo
+from app.rate_limits import configure_rate_limit_storage, COUNTERS_COLLECTION
+
+
+def test_rate_limit_storage_defaults_to_application_database(app):
+    """
+    GIVEN an application without RATELIMIT_STORAGE_URI
+    WHEN the rate limit storage is configured
+    THEN Flask-Limiter should use the MongoDB backend on the application's database and counter collection
+    """
+    app.config["RATELIMIT_STORAGE_URI"] = None
+    app.config.pop("RATELIMIT_STORAGE_OPTIONS", None)
+    with app.app_context():
+        configure_rate_limit_storage(app)
+        database_name = mongo.db.name
+
+    assert app.config["RATELIMIT_STORAGE_URI"] == app.config["MONGO_URI"]
+    options = app.config["RATELIMIT_STORAGE_OPTIONS"]
+    assert options["database_name"] == database_name
+    assert options["counter_collection_name"] == COUNTERS_COLLECTION
+
+    # `limits` acepta la URI y las opciones (el cliente se crea en el primer uso)
+    storage = storage_from_string(app.config["RATELIMIT_STORAGE_URI"], **options)
+    assert isinstance(storage, MongoDBStorage)
+
+
+def test_explicit_rate_limit_storage_is_kept(app):
+    """
+    GIVEN an application with an explicit RATELIMIT_STORAGE_URI
+    WHEN the rate limit storage is configured
+    THEN the configured storage should be left unchanged
+    """
+    app.config["RATELIMIT_STORAGE_URI"] = "redis://cache:6379"
+    with app.app_context():
+        configure_rate_limit_storage(app)
+
+    assert app.config["RATELIMIT_STORAGE_URI"] == "redis://cache:6379"
@@ -0,0 +1,56 @@
+from app.reference_data import ReferenceDataCache, get_supervisor_route, invalidate
+
+
+def test_reference_cache_invalidation_reaches_other_workers(app, db):
+    """
+    GIVEN two workers with their own reference-data cache over the same database
+    WHEN one of them changes a category and invalidates the cache
+    THEN the other worker should reload the categories on its next version check
+    """
+    db.db.categories.insert_one({'name': 'Hardware', 'value': 'hardware'})
+    worker_a = ReferenceDataCache(check_interval_ms=0)
+    worker_b = ReferenceDataCache(check_interval_ms=0)
+    assert [c['value'] for c in worker_b.snapshot(db.db, 'categories').docs] == ['hardware']
+
+    db.db.categories.insert_one({'name': 'Software', 'value': 'software'})
+    worker_a.invalidate(db.db, 'categories')
+
+    assert [c['value'] for c in worker_b.snapshot(db.db, 'categories').docs] == ['hardware', 'software']
+
+
+def test_reference_cache_checks_versions_at_most_once_per_interval(app, db):
+    """
+    GIVEN a worker whose cache was loaded and version-checked recently
+    WHEN another worker invalidates the categories within the check interval
+    THEN the worker should keep serving its copy without reading the collection again
+    """
+    db.db.categories.insert_one({'name': 'Hardware', 'value': 'hardware'})
+    worker_a = ReferenceDataCache()
+    worker_b = ReferenceDataCache(check_interval_ms=60000)
+    worker_b.snapshot(db.db, 'categories')
+
+    db.db.categories.insert_one({'name': 'Software', 'value': 'software'})
+    worker_a.invalidate(db.db, 'categories')
+
+    assert [c['value'] for c in worker_b.snapshot(db.db, 'categories').docs] == ['hardware']
+
+
+def test_supervisor_route_is_cached_until_assignments_are_invalidated(app, db):
+    """
+    GIVEN a supervisor assignment for a category and shift
+    WHEN the route is looked up twice, then the supervisor's email changes and the assignments are invalidated
+    THEN the second lookup should not read 'personas' again, and the one after invalidation should see the new email
+    """
+    category_id = db.db.categories.insert_one({'name': 'Hardware', 'value': 'hardware'}).inserted_id
+    supervisor_id = db.db.personas.insert_one({'username': 'sup', 'email': 'sup@example.com', 'role': 'supervisor'}).inserted_id
+    db.db.supervisor_assignments.insert_one({'category_id': category_id, 'shift_value': 'weekday_morning', 'supervisor_id': supervisor_id})
+
+    with app.app_context():
+        assert get_supervisor_route(category_id, 'weekday_morning')['email'] == 'sup@example.com'
+        assert get_supervisor_route(category_id, 'weekend_night') is None
+
+        db.db.personas.update_one({'_id': supervisor_id}, {'$set': {'email': 'new@example.com'}})
+        assert get_supervisor_route(category_id, 'weekday_morning')['email'] == 'sup@example.com'
+
+        invalidate('supervisor_assignments')
+        assert get_supervisor_route(category_id, 'weekday_morning')['email'] == 'new@example.com'
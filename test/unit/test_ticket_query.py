@@ -0,0 +1,104 @@
+from datetime import date, datetime
+from bson.objectid import ObjectId
+from flask import url_for
+from werkzeug.datastructures import MultiDict
+from app.auth.models import Persona
+from app.reference_data import invalidate
+from app.supervisor.forms import TicketFilterForm
+from app.ticket_ids import ticket_id_filter
+from app.ticket_query import TicketQuery, set_filter_choices
+from app.utils import username_filter
+
+
+def _persona(role):
+    return Persona(_id=ObjectId(), username=f'{role}user', email=f'{role}@example.com',
+                   name='Test', firstSurname='User', role=role)
+
+
+def _form(**args):
+    form = TicketFilterForm(MultiDict(args))
+    set_filter_choices(form)
+    return form
+
+
+def test_supervisor_query_shape(app, db):
+    """
+    GIVEN a supervisor filtering by status, creator prefix and a single day
+    WHEN the TicketQuery is built
+    THEN equality fields should come before ranges, and the visibility $or should be combined with $and
+    """
+    db.db.statuses.insert_one({'name': 'Pendiente', 'value': 'pending'})
+    supervisor = _persona('supervisor')
+
+    ticket_query = TicketQuery(_form(status='pending', creator_username='Ana', start_date='2024-03-01'), supervisor)
+
+    filters, visibility = ticket_query.filter['$and']
+    assert list(filters) == ['status_value', 'creator.username_lower', 'created_at']
+    assert filters['creator.username_lower'] == {'$gte': 'ana', '$lt': 'anb'}
+    assert filters['created_at'] == {'$gte': datetime(2024, 3, 1), '$lte': datetime.combine(date(2024, 3, 1), datetime.max.time())}
+    assert visibility == {'$or': [{'supervisor.user_id': ObjectId(supervisor.id)}, {'supervisor': None}]}
+    assert ticket_query.max_time_ms == app.config['TICKET_QUERY_MAX_TIME_MS']
+
+
+def test_operator_query_ignores_foreign_filters(app, db):
+    """
+    GIVEN an operator sending a supervisor filter and an invalid ticket ID
+    WHEN the TicketQuery is built
+    THEN only the operator's own tickets should be queried and the invalid ID should produce a warning
+    """
+    operator = _persona('operador')
+
+    ticket_query = TicketQuery(_form(supervisor_username='otro', ticket_id='zz'), operator)
+
+    assert ticket_query.filter == {'operator.user_id': ObjectId(operator.id)}
+    assert ticket_query.warnings == ['ID de Ticket inválido.']
+
+
+def test_blank_username_filter_is_ignored(app, db):
+    """
+    GIVEN a supervisor sending a whitespace-only creator filter
+    WHEN the TicketQuery is built
+    THEN no username filter should be added
+    """
+    supervisor = _persona('supervisor')
+
+    ticket_query = TicketQuery(_form(creator_username='   '), supervisor)
+
+    assert 'creator.username_lower' not in str(ticket_query.filter)
+    assert username_filter('creator', '   ') is None
+
+
+def test_ticket_id_filter_long_digits():
+    """
+    GIVEN a digits-only ticket ID too long to fit in a 64-bit integer
+    WHEN the ID filter is built
+    THEN it should only search by ObjectId prefix, while a short number also matches the ticket number
+    """
+    long_value = '9' * 24
+
+    assert ticket_id_filter(long_value) == {'_id': {'$gte': ObjectId(long_value), '$lte': ObjectId(long_value)}}
+    assert ticket_id_filter('#1042')['$or'][0] == {'ticket_number': 1042}
+
+
+def test_operator_tickets_applies_filters(logged_in_operator_client, db, seed_test_operator):
+    """
+    GIVEN an operator with assigned tickets in different statuses
+    WHEN the operator filters their list by status
+    THEN only the matching assigned tickets should be shown
+    """
+    operator_data, _ = seed_test_operator
+    db.db.statuses.insert_many([{'name': 'Pendiente', 'value': 'pending'}, {'name': 'En Progreso', 'value': 'in_progress'}])
+    invalidate('statuses')
+    operator = {'user_id': operator_data['_id'], 'username': operator_data['username']}
+    db.db.tickets.insert_many([
+        {'title': 'Ticket pendiente', 'status_value': 'pending', 'operator': operator, 'created_at': datetime(2024, 1, 1)},
+        {'title': 'Ticket en curso', 'status_value': 'in_progress', 'operator': operator, 'created_at': datetime(2024, 1, 2)},
+        {'title': 'Ticket ajeno', 'status_value': 'pending', 'created_at': datetime(2024, 1, 3)},
+    ])
+
+    response = logged_in_operator_client.get(url_for('operator_bp.operator_tickets', status='pending'))
+
+    assert response.status_code == 200
+    assert b'Ticket pendiente' in response.data
+    assert b'Ticket en curso' not in response.data
+    assert b'Ticket ajeno' not in response.data
@@ -0,0 +1,90 @@
+import threading
+from types import SimpleNamespace
+from bson.objectid import ObjectId
+from app.email import OUTBOX_COLLECTION
+from app.notifications import DIGEST_TICKET_ASSIGNED
+from app.ticket_service import update_ticket, notification, claim_ticket
+from app.ticket_stats import get_ticket_stats
+from app.utils import user_ref
+
+
+def _setup(db):
+    user = SimpleNamespace(id=str(ObjectId()), username='supervisora')
+    operator = {'_id': ObjectId(), 'username': 'operador', 'email': 'operador@example.com'}
+    ticket = {'_id': ObjectId(), 'title': 'Impresora', 'status_value': 'pending', 'category_value': 'hardware'}
+    db.db.tickets.insert_one(dict(ticket))
+    db.db.ticket_stats.insert_one({'_id': 'tickets', 'total': 1, 'by_status': {'pending': 1}, 'by_category': {'hardware': 1}})
+    return user, operator, ticket
+
+
+def test_update_ticket_writes_ticket_history_stats_and_notification(app, db):
+    """
+    GIVEN a pending ticket
+    WHEN it is assigned to an operator through update_ticket
+    THEN the ticket, its history entry, the status counters and the operator's email should all be written
+    """
+    user, operator, ticket = _setup(db)
+    with app.test_request_context():
+        email = notification(operator, DIGEST_TICKET_ASSIGNED, ticket, 'Ticket Asignado', 'emails/ticket_assigned.html',
+                             sender='app@example.com')
+        assert update_ticket(ticket, user, 'Asignación de Operador', 'Ticket asignado a operador',
+                             set_fields={'status_value': 'in_progress'}, search_text='urgente',
+                             expected={'status_value': 'pending'}, notifications=[email])
+
+    stored = db.db.tickets.find_one({'_id': ticket['_id']})
+    assert stored['status_value'] == 'in_progress'
+    assert 'urgente' in stored['search_tokens']
+    assert db.db.ticket_history.find_one({'ticket_id': ticket['_id']})['change_type'] == 'Asignación de Operador'
+    assert get_ticket_stats(db.db)['by_status'] == {'in_progress': 1}
+    assert db.db[OUTBOX_COLLECTION].find_one()['recipients'] == ['operador@example.com']
+
+
+def test_update_ticket_discards_the_change_when_the_ticket_changed_meanwhile(app, db):
+    """
+    GIVEN a ticket whose status changed after it was read
+    WHEN a change conditioned on the old status is applied
+    THEN update_ticket should return False without writing any history entry, counter change or notification
+    """
+    user, operator, ticket = _setup(db)
+    db.db.tickets.update_one({'_id': ticket['_id']}, {'$set': {'status_value': 'cancelled'}})
+    with app.test_request_context():
+        email = notification(operator, DIGEST_TICKET_ASSIGNED, ticket, 'Ticket Asignado', 'emails/ticket_assigned.html',
+                             sender='app@example.com')
+        assert not update_ticket(ticket, user, 'Asignación de Operador', 'Ticket asignado a operador',
+                                 set_fields={'status_value': 'in_progress'},
+                                 expected={'status_value': 'pending'}, notifications=[email])
+
+    assert db.db.tickets.find_one({'_id': ticket['_id']})['status_value'] == 'cancelled'
+    assert db.db.ticket_history.count_documents({}) == 0
+    assert get_ticket_stats(db.db)['by_status'] == {'pending': 1}
+    assert db.db[OUTBOX_COLLECTION].count_documents({}) == 0
+
+
+def test_claim_ticket_has_exactly_one_winner_under_contention(app, db):
+    """
+    GIVEN an unassigned ticket and 16 supervisors released at the same time
+    WHEN all of them try to take it concurrently
+    THEN exactly one claim should succeed, the ticket should belong to the winner and only one history entry should exist
+    """
+    ticket_id = db.db.tickets.insert_one({'title': 'Impresora', 'status_value': 'pending', 'supervisor': None}).inserted_id
+    claimers = 16
+    barrier = threading.Barrier(claimers)
+    winners = []
+
+    def claim(index):
+        supervisor = SimpleNamespace(id=str(ObjectId()), username=f'supervisor{index}')
+        with app.app_context():
+            barrier.wait()
+            if claim_ticket(str(ticket_id), 'supervisor', user_ref(supervisor.id, supervisor.username),
+                            supervisor, 'Ticket Tomado'):
+                winners.append(supervisor.username)
+
+    threads = [threading.Thread(target=claim, args=(index,)) for index in range(claimers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(winners) == 1
+    assert db.db.tickets.find_one({'_id': ticket_id})['supervisor']['username'] == winners[0]
+    assert db.db.ticket_history.count_documents({'ticket_id': ticket_id}) == 1
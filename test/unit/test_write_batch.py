@@ -0,0 +1,45 @@
+from unittest.mock import MagicMock
+from app.write_batch import WriteBatch
+
+
+def test_write_batch_runs_each_operation_in_order_on_older_servers(app, db):
+    """
+    GIVEN a server without client-level bulkWrite (mongomock reports 5.0)
+    WHEN a batch inserts a document, updates it, upserts a counter and deletes a missing document
+    THEN the writes should be applied in order and the affected counts returned per operation
+    """
+    with app.app_context():
+        batch = WriteBatch(db.db)
+        batch.insert_one('tickets', {'_id': 1, 'title': 'Impresora'})
+        batch.update_one('tickets', {'_id': 1}, {'$set': {'title': 'Portátil'}})
+        batch.update_one('ticket_stats', {'_id': 'tickets'}, {'$inc': {'total': 1}}, upsert=True)
+        batch.delete_one('ticket_history', {'_id': 'missing'})
+        assert batch.execute() == [1, 1, 1, 0]
+
+    assert db.db.tickets.find_one({'_id': 1})['title'] == 'Portátil'
+    assert db.db.ticket_stats.find_one({'_id': 'tickets'})['total'] == 1
+
+
+def test_write_batch_sends_one_client_bulk_write_on_mongodb_8(app):
+    """
+    GIVEN a MongoDB 8.0 server
+    WHEN a batch writes to two collections
+    THEN a single ordered client-level bulkWrite should be sent, with each model's namespace
+    """
+    client = MagicMock()
+    client.server_info.return_value = {'versionArray': [8, 0, 4, 0]}
+    client.bulk_write.return_value.update_results = {1: MagicMock(matched_count=0, upserted_id='tickets')}
+    database = MagicMock(client=client)
+    database.name = 'ticketing'
+
+    with app.app_context():
+        batch = WriteBatch(database)
+        batch.insert_one('tickets', {'_id': 1})
+        batch.update_one('ticket_stats', {'_id': 'tickets'}, {'$inc': {'total': 1}}, upsert=True)
+        assert batch.execute() == [1, 1]
+
+    client.bulk_write.assert_called_once()
+    models = client.bulk_write.call_args[0][0]
+    assert [model._namespace for model in models] == ['ticketing.tickets', 'ticketing.ticket_stats']
+    assert client.bulk_write.call_args[1]['ordered'] is True
+    database.__getitem__.assert_not_called()